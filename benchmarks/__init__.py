@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for logdispatchr. Each module can be run on its own, like
+
+    $ python -m benchmarks.bench_routing
+
+or all of them at once, saving the results as JSON, see
+:mod:`benchmarks.__main__`.
+
+Every module has a ``run()`` function returning its results, as a dict of
+case names to numbers, and a ``main()`` printing them.
+"""
+
+import timeit
+
+
+def throughput(func, count, repeat=3):
+    """
+    :param func: the code to measure, handling count items per call
+    :type func: callable
+    :param count: the number of items handled by each call
+    :type count: int
+    :return: the best number of items handled per second
+    :rtype: float
+    """
+    elapsed = min(timeit.repeat(func, number=1, repeat=repeat))
+    return count / elapsed
+
+
+def _format(value):
+    if value is None:
+        return '%12s' % 'n/a'
+    return '%12.0f' % value if abs(value) >= 100 else '%12.3f' % value
+
+
+def print_results(results, unit='msgs/s'):
+    for name, value in results.items():
+        if isinstance(value, dict):
+            print(name)
+            for case, number in value.items():
+                print(('  %-30s %s %s' % (case, _format(number), unit))
+                      .rstrip())
+        else:
+            print(('%-32s %s %s' % (name, _format(value), unit)).rstrip())
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Runs every benchmark, and saves the results as JSON, along with the
+logdispatchr and Python versions. Given the results of a previous run, the
+differences are printed, and the exit status is 1 if anything got worse by
+more than the threshold.
+
+    $ python -m benchmarks --output before.json
+    $ git checkout my-branch
+    $ python -m benchmarks --output after.json --compare before.json
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+
+import logdispatchr
+from benchmarks import (bench_micro, bench_pipeline, bench_routing,
+                        bench_scheduler, bench_syslog, print_results)
+
+# results whose names contain these are better when lower
+LOWER_IS_BETTER = ('latency', 'drop', 'rss')
+
+
+def run(messages):
+    results = {
+        'micro': bench_micro.run(messages),
+        'routing': bench_routing.run(messages),
+        'syslog': bench_syslog.run(messages),
+        'pipeline': {kind: bench_pipeline.run(kind, messages)
+                     for kind in ('syslog', 'msgpack')},
+        'scheduler': bench_scheduler.run(),
+    }
+    return {
+        'version': logdispatchr.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'messages': messages,
+        'results': without_nan(results),
+    }
+
+
+def flatten(results, prefix=()):
+    for name, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, prefix + (name,))
+        else:
+            yield ' / '.join(prefix + (name,)), value
+
+
+def without_nan(results):
+    """
+    :return: the results, with the NaN values (e.g. the percentiles of no
+             value at all) replaced by None, which JSON supports
+    :rtype: dict
+    """
+    return {name: without_nan(value) if isinstance(value, dict)
+            else None if value != value else value
+            for name, value in results.items()}
+
+
+def compare(before, after, threshold):
+    """
+    Prints how each result changed. A result which is better when lower, and
+    was 0 (like a drop rate), regresses as soon as it isn't 0 anymore.
+
+    :param threshold: the relative change considered a regression
+    :type threshold: float
+    :return: the names of the regressed results
+    :rtype: list
+    """
+    previous = dict(flatten(before['results']))
+    regressions = []
+    print('compared with %s (%s)' % (before['version'], before['date']))
+    for name, value in flatten(after['results']):
+        old = previous.get(name)
+        if old is None or value is None:
+            continue
+        lower_is_better = any(word in name for word in LOWER_IS_BETTER)
+        if old == 0:
+            if value == 0 or not lower_is_better:
+                continue
+            regressions.append(name)
+            print('  %-60s was 0, now %g  REGRESSION' % (name, value))
+            continue
+        change = (value - old) / old
+        worse = change if lower_is_better else -change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('  %-60s %+7.1f%%%s' % (name, change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--messages', type=int, default=100000,
+                        help='the number of messages per benchmark')
+    parser.add_argument('--output', default=None,
+                        help='where to save the results as JSON')
+    parser.add_argument('--compare', default=None,
+                        help='the results of a previous run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='the relative change considered a regression')
+    args = parser.parse_args()
+
+    report = run(args.messages)
+    for name, results in report['results'].items():
+        print('== %s' % name)
+        print_results(results, unit='')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True, allow_nan=False)
+    if args.compare:
+        with open(args.compare) as f:
+            before = json.load(f)
+        if compare(before, report, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
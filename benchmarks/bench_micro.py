@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of the per message hot spots: matching a key against an
+output filter, building messages, decoding forwarded msgpack payloads,
+searching a regular expression in a batch, and aggregating messages.
+
+    $ python -m benchmarks.bench_micro
+"""
+
+import re
+
+import msgpack
+
+from benchmarks import throughput, print_results
+from logdispatchr.inputs import unpack_messages
+from logdispatchr.matching import BatchRegex
+from logdispatchr.models import Message
+from logdispatchr.outputs import AggregatingOutput, BaseOutput
+
+MESSAGES = 100000
+
+FIELDS = {'key': 'app.web', 'message': 'GET /index.html 200',
+          'hostname': 'web1', 'severity': 'info'}
+
+
+def bench_match(messages):
+    keys = ['app.web', 'app.db', 'system.auth'] * (messages // 3)
+    results = {}
+    for filtr in ('*', 'app.web', 'app.*', '*.w[aeiou]b'):
+        output = BaseOutput(filtr)
+        match = output._match
+        results[filtr] = throughput(lambda: [match(k) for k in keys],
+                                    len(keys))
+    return results
+
+
+def bench_message(messages):
+    payload = b'<13>Oct 11 22:14:15 web1 nginx: GET /index.html 200'
+    rng = range(messages)
+    return {
+        'Message(**fields)': throughput(
+            lambda: [Message(**FIELDS) for _ in rng], messages),
+        'Message.from_fields': throughput(
+            lambda: [Message.from_fields(dict(FIELDS)) for _ in rng],
+            messages),
+        'Message.from_raw': throughput(
+            lambda: [Message.from_raw(payload, 'app.web') for _ in rng],
+            messages),
+    }
+
+
+def bench_msgpack(messages):
+    packed = msgpack.packb(FIELDS, use_bin_type=True)
+    address = ('127.0.0.1', 5140)
+    results = {}
+    for per_datagram in (1, 10):
+        datagrams = [packed * per_datagram] * (messages // per_datagram)
+        results['%d per datagram' % per_datagram] = throughput(
+                lambda: [unpack_messages(d, address) for d in datagrams],
+                len(datagrams) * per_datagram)
+    return results
+
+
+def bench_batch_regex(messages, batch_size=256):
+    batch = ['GET /index.html?page=%d 200' % i for i in range(batch_size)]
+    batches = messages // batch_size
+    results = {}
+    for name, pattern in (('rare', r'/health'), ('frequent', r' 200$')):
+        search = re.compile(pattern).search
+        batch_regex = BatchRegex(pattern)
+        results['%s, one by one' % name] = throughput(
+                lambda: [[search(v) for v in batch] for _ in range(batches)],
+                batches * batch_size)
+        results['%s, batched' % name] = throughput(
+                lambda: [batch_regex.search(batch) for _ in range(batches)],
+                batches * batch_size)
+    return results
+
+
+def bench_aggregate(messages, batch_size=256):
+    batches = messages // batch_size
+    results = {}
+    for repeated in (True, False):
+        batch = [Message(key='app.web', hostname='web%d' % (i % 10),
+                         severity='info',
+                         message='GET /item/%d 200' % (i % 4 if repeated
+                                                       else i))
+                 for i in range(batch_size)]
+        output = AggregatingOutput({'class': 'NullOutput'})
+        results['repeated' if repeated else 'distinct'] = throughput(
+                lambda: [output._write_messages(batch)
+                         for _ in range(batches)],
+                batches * batch_size)
+        output.close()
+    return results
+
+
+def run(messages=MESSAGES):
+    return {'BaseOutput._match': bench_match(messages),
+            'Message construction': bench_message(messages),
+            'msgpack decode': bench_msgpack(messages),
+            'regex search': bench_batch_regex(messages),
+            'AggregatingOutput': bench_aggregate(messages)}
+
+
+def main():
+    print_results(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Drives a whole LogDispatcher, with a UDPSyslogInput, a LogdispatchrUDPInput
+and an output discarding everything, with the load generator running in
+other processes. Reports the throughput, the share of messages lost on the
+way, the end-to-end latency and the memory used.
+
+    $ python -m benchmarks.bench_pipeline --kind msgpack --count 200000
+"""
+
+import os
+import time
+import argparse
+import resource
+import tempfile
+import threading
+
+import logdispatchr.outputs
+from benchmarks import loadgen, print_results
+from logdispatchr.core import LogDispatcher
+from logdispatchr.outputs import NullOutput
+
+MESSAGES = 100000
+
+CONFIG = """
+mainqueue_max_size = 10000
+
+[inputs.syslog]
+class = "UDPSyslogInput"
+key = "bench.syslog"
+host = "127.0.0.1"
+port = 0
+receive_buffer_size = 8388608
+
+[inputs.forward]
+class = "LogdispatchrUDPInput"
+host = "127.0.0.1"
+port = 0
+receive_buffer_size = 8388608
+
+[outputs.null]
+class = "LatencyOutput"
+filtr = "bench*"
+queue_size = 10000
+"""
+
+
+class LatencyOutput(NullOutput):
+    """
+    Discards the messages, after noting when they arrive and, for one
+    message in sample_every, how long ago it was sent.
+    """
+    sample_every = 16
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.count = 0
+        self.last = None
+        self.latencies = []
+
+    def _write_messages(self, batch):
+        now = time.monotonic()
+        self.latencies.extend(now - loadgen.sent_at(m)
+                              for m in batch[::self.sample_every])
+        self.count += len(batch)
+        self.last = now
+
+
+# outputs are looked up by class name in logdispatchr.outputs
+logdispatchr.outputs.LatencyOutput = LatencyOutput
+
+
+def percentile(values, percent):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def rss_mib():
+    """
+    :return: the current and peak resident memory of this process, in MiB
+    :rtype: tuple
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        return current / 1024 ** 2, peak
+    except OSError:
+        return peak, peak
+
+
+def run(kind='syslog', count=MESSAGES, rate=None, senders=1,
+        idle_timeout=1.0):
+    """
+    :param kind: the kind of messages to send, see :func:`loadgen.send`
+    :type kind: str
+    :param idle_timeout: how long to wait for more messages once the
+                         senders are done, in seconds
+    :type idle_timeout: float
+    :rtype: dict
+    """
+    fd, path = tempfile.mkstemp(suffix='.toml')
+    with os.fdopen(fd, 'w') as f:
+        f.write(CONFIG)
+    try:
+        app = LogDispatcher(path)
+    finally:
+        os.unlink(path)
+    output = app.outputs[0]
+    for worker in app.workers:
+        worker.start()
+    app.output_thread = threading.Thread(target=app.write_outputs)
+    app.output_thread.daemon = True
+    app.output_thread.start()
+    _input = app.inputs[0 if kind == 'syslog' else 1]
+
+    began = time.monotonic()
+    for process in loadgen.start(_input.socket.getsockname(), senders, count,
+                                 kind=kind, rate=rate, key='bench.forward'):
+        process.join()
+    # wait for the pipeline to drain
+    seen = -1
+    while output.count != seen and output.count < count:
+        seen = output.count
+        time.sleep(idle_timeout)
+    app.shutdown()
+
+    elapsed = (output.last or time.monotonic()) - began
+    current, peak = rss_mib()
+    latencies = output.latencies
+    return {
+        'throughput (msgs/s)': output.count / elapsed,
+        'drop rate': 1 - output.count / count,
+        'p50 latency (ms)': percentile(latencies, 50) * 1000,
+        'p99 latency (ms)': percentile(latencies, 99) * 1000,
+        'rss (MiB)': current,
+        'max rss (MiB)': peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--kind', choices=loadgen.KINDS, default='syslog')
+    parser.add_argument('--count', type=int, default=MESSAGES)
+    parser.add_argument('--rate', type=float, default=None,
+                        help='messages per second, unlimited by default')
+    parser.add_argument('--senders', type=int, default=1)
+    args = parser.parse_args()
+    print_results({'%s, %d messages' % (args.kind, args.count): run(
+        args.kind, args.count, args.rate, args.senders)}, unit='')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Compares routing a message through the Router with matching it against
+every output, as the dispatcher used to do.
+
+    $ python -m benchmarks.bench_routing
+"""
+
+from benchmarks import throughput, print_results
+from logdispatchr.outputs import BaseOutput
+from logdispatchr.routing import Router
+
+OUTPUTS = 200
+KEYS = 1000
+MESSAGES = 100000
+
+
+def make_outputs():
+    outputs = []
+    for i in range(OUTPUTS):
+        if i % 4 == 0:
+            filtr = 'service%d.*' % i
+        elif i % 4 == 1:
+            filtr = 'service%d.log' % i
+        elif i % 4 == 2:
+            filtr = 'service%d.[ae]*' % i
+        else:
+            filtr = '*.service%d' % i
+        outputs.append(BaseOutput(filtr))
+    return outputs
+
+
+def run(messages=MESSAGES):
+    outputs = make_outputs()
+    router = Router((output.filtr, output) for output in outputs)
+    keys = ['service%d.log' % (i % OUTPUTS) for i in range(KEYS)]
+    keys = [keys[i % KEYS] for i in range(messages)]
+
+    def per_output():
+        for key in keys:
+            [output for output in outputs if output._match(key)]
+
+    def routed():
+        route = router.route
+        for key in keys:
+            route(key)
+
+    return {'per output _match': throughput(per_output, messages),
+            'Router': throughput(routed, messages)}
+
+
+def main():
+    print_results(run())
+
+
+if __name__ == '__main__':
+    main()
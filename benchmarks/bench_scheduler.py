@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the plain FIFO main queue with the weighted fair queuing
+scheduler, while a debug key floods a dispatcher which can only handle so
+many messages per second. A few critical messages are mixed in the flood,
+as they would come from the same input. Reports the latency of the critical
+messages in the queue, and the share of each kind which was lost.
+
+    $ python -m benchmarks.bench_scheduler
+"""
+
+import time
+import argparse
+import threading
+
+from benchmarks import print_results
+from logdispatchr.models import Message
+from logdispatchr.queues import BatchQueue, WeightedFairQueue
+
+# messages per second handled by the simulated dispatcher
+SERVICE_RATE = 20000
+# one message in every CRITICAL_EVERY is critical
+CRITICAL_EVERY = 100
+QUEUE_SIZE = 10000
+BATCH_SIZE = 256
+
+CLASSES = {
+    'critical': {'keys': ['auth.*', 'kernel.*'], 'weight': 8,
+                 'priority': 10},
+    'debug': {'keys': ['*.debug'], 'weight': 1, 'priority': 0},
+}
+
+
+def percentile(values, percent):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def produce(mainqueue, rate, stop, sent):
+    """
+    Sends messages at rate, like an UDP input: what doesn't fit in the queue
+    is lost.
+    """
+    chunk = 64
+    interval = chunk / rate
+    deadline = time.monotonic()
+    count = 0
+    while not stop.is_set():
+        now = time.monotonic()
+        if now < deadline:
+            time.sleep(deadline - now)
+            continue
+        batch = []
+        for _ in range(chunk):
+            count += 1
+            key = 'auth.ssh' if not count % CRITICAL_EVERY else 'app.debug'
+            sent[key] += 1
+            batch.append(Message(key=key, sent=now))
+        mainqueue.put_many(batch, block=False)
+        deadline += interval
+
+
+def consume(mainqueue, stop, received, latencies):
+    """
+    Takes batches from the queue, and spends the time the dispatcher would
+    on them.
+    """
+    while True:
+        try:
+            batch = mainqueue.get_many(BATCH_SIZE, timeout=0.1)
+        except Exception:
+            if stop.is_set():
+                return
+            continue
+        now = time.monotonic()
+        for m in batch:
+            received[m['key']] += 1
+            if m['key'] == 'auth.ssh':
+                latencies.append(now - m['sent'])
+        time.sleep(len(batch) / SERVICE_RATE)
+
+
+def run_case(mainqueue, load, duration):
+    """
+    :param load: the rate of the flood, relative to SERVICE_RATE
+    :type load: float
+    :param duration: how long to flood, in seconds
+    :type duration: float
+    :rtype: dict
+    """
+    sent = {'auth.ssh': 0, 'app.debug': 0}
+    received = dict.fromkeys(sent, 0)
+    latencies = []
+    stop_producer = threading.Event()
+    stop_consumer = threading.Event()
+    producer = threading.Thread(target=produce, args=(
+            mainqueue, load * SERVICE_RATE, stop_producer, sent))
+    consumer = threading.Thread(target=consume, args=(
+            mainqueue, stop_consumer, received, latencies))
+    consumer.start()
+    producer.start()
+    time.sleep(duration)
+    stop_producer.set()
+    producer.join()
+    stop_consumer.set()
+    consumer.join()
+    return {
+        'p50 critical latency (ms)': percentile(latencies, 50) * 1000,
+        'p99 critical latency (ms)': percentile(latencies, 99) * 1000,
+        'critical drop rate':
+            1 - received['auth.ssh'] / max(sent['auth.ssh'], 1),
+        'debug drop rate':
+            1 - received['app.debug'] / max(sent['app.debug'], 1),
+    }
+
+
+def run(duration=1.0, loads=(0.5, 2, 4)):
+    results = {}
+    for load in loads:
+        results['fifo, %gx load' % load] = run_case(
+                BatchQueue(QUEUE_SIZE), load, duration)
+        results['wfq, %gx load' % load] = run_case(
+                WeightedFairQueue(QUEUE_SIZE, CLASSES), load, duration)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--duration', type=float, default=1.0,
+                        help='how long to flood each case, in seconds')
+    args = parser.parse_args()
+    print_results(run(args.duration), unit='')
+
+
+if __name__ == '__main__':
+    main()
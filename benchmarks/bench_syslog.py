@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the cost of building syslog messages without parsing them (raw
+passthrough), with the naïve whole-line decoder, and with the structured
+parser, with or without the timestamp, in the dispatcher or in a pool of
+processes.
+
+    $ python -m benchmarks.bench_syslog
+"""
+
+from benchmarks import throughput, print_results
+from logdispatchr.models import Message
+from logdispatchr.parallel import ProcessPoolStage
+from logdispatchr.syslog import parse_syslog
+
+RFC3164 = b'<13>Oct 11 22:14:15 mymachine sshd[1234]: Accepted publickey ' \
+          b'for paul from 10.0.0.1 port 52341 ssh2'
+RFC5424 = b'<34>1 2003-10-11T22:14:15.003Z mymachine.example.com su - ID47 ' \
+          b'[exampleSDID@32473 iut="3" eventSource="Application"] ' \
+          b'\'su root\' failed for lonvick on /dev/pts/8'
+MESSAGES = 100000
+
+# the size of the batches handed to the process pool
+BATCH_SIZE = 256
+
+
+def parse_in_pool(stage, datagrams):
+    for i in range(0, len(datagrams), BATCH_SIZE):
+        stage.process([Message.from_raw(d, 'k', parse_syslog)
+                       for d in datagrams[i:i + BATCH_SIZE]])
+    return stage._collect(len(stage.pending))
+
+
+def run(messages=MESSAGES):
+    results = {}
+    pool = ProcessPoolStage()
+    for name, payload in (('RFC 3164', RFC3164), ('RFC 5424', RFC5424)):
+        datagrams = [payload] * messages
+        cases = (
+            ('passthrough (key only)',
+             lambda: [Message.from_raw(d, 'k')['key'] for d in datagrams]),
+            ('whole line',
+             lambda: [Message.from_raw(d, 'k')['message']
+                      for d in datagrams]),
+            ('parsed',
+             lambda: [Message.from_raw(d, 'k', parse_syslog)['severity']
+                      for d in datagrams]),
+            ('parsed + time',
+             lambda: [Message.from_raw(d, 'k', parse_syslog)['time']
+                      for d in datagrams]),
+            ('parsed, %d processes' % pool.processes,
+             lambda: parse_in_pool(pool, datagrams)),
+        )
+        results[name] = {case: throughput(func, messages)
+                         for case, func in cases}
+    pool.flush()
+    return results
+
+
+def main():
+    print_results(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+A local load generator, sending syslog lines or forwarded msgpack messages
+over UDP, as fast as possible or at a given rate. Each message carries its
+sequence number and the time it was sent (from the monotonic clock, shared
+by all the processes of the machine), to measure end-to-end latency.
+
+    $ python -m benchmarks.loadgen --kind syslog --count 100000 127.0.0.1:514
+"""
+
+import time
+import socket
+import argparse
+import multiprocessing
+
+import msgpack
+
+KINDS = ('syslog', 'msgpack')
+
+
+def syslog_datagrams(key, start, count, per_datagram):
+    for seq in range(start, start + count):
+        yield (b'<13>Oct 11 22:14:15 loadgen bench[1]: seq=%d sent=%.6f'
+               % (seq, time.monotonic()))
+
+
+def msgpack_datagrams(key, start, count, per_datagram):
+    packer = msgpack.Packer(use_bin_type=True)
+    for first in range(start, start + count, per_datagram):
+        now = time.monotonic()
+        yield b''.join(
+                packer.pack({'key': key, 'seq': seq, 'sent': now,
+                             'message': 'benchmark message'})
+                for seq in range(first, min(first + per_datagram,
+                                            start + count)))
+
+
+def sent_at(message):
+    """
+    :param message: a message built from a datagram of this generator
+    :type message: logdispatchr.models.Message
+    :return: when it was sent, on the monotonic clock
+    :rtype: float
+    """
+    if message.raw is not None:
+        # don't pay for decoding the syslog line
+        return float(message.raw.rsplit(b'=', 1)[1])
+    return message['sent']
+
+
+def send(address, kind='syslog', count=100000, rate=None, per_datagram=10,
+         key='bench', start=0):
+    """
+    Sends count messages to address.
+
+    :param address: the (host, port) to send to
+    :type address: tuple
+    :param kind: "syslog", one message per datagram, or "msgpack",
+                 per_datagram messages per datagram
+    :type kind: str
+    :param rate: the number of messages per second, as fast as possible if
+                 None
+    :type rate: float
+    :param start: the first sequence number
+    :type start: int
+    :return: the time it took, in seconds
+    :rtype: float
+    """
+    generate = {'syslog': syslog_datagrams,
+                'msgpack': msgpack_datagrams}[kind]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect(address)
+    per_datagram = per_datagram if kind == 'msgpack' else 1
+    interval = per_datagram / rate if rate else 0
+    began = next_send = time.monotonic()
+    for datagram in generate(key, start, count, per_datagram):
+        if interval:
+            next_send += interval
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        try:
+            sock.send(datagram)
+        except (BlockingIOError, ConnectionRefusedError):
+            # dropped, like the kernel would
+            pass
+    sock.close()
+    return time.monotonic() - began
+
+
+def start(address, senders=1, count=100000, **kwargs):
+    """
+    Runs send in senders processes, splitting count and rate among them.
+
+    :return: the started processes
+    :rtype: list
+    """
+    processes = []
+    share = count // senders
+    if kwargs.get('rate'):
+        kwargs['rate'] /= senders
+    for i in range(senders):
+        kwargs['start'] = i * share
+        process = multiprocessing.Process(
+                target=send, args=(address,),
+                kwargs=dict(kwargs, count=share if i < senders - 1
+                            else count - i * share))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('address', help='host:port to send to')
+    parser.add_argument('--kind', choices=KINDS, default='syslog')
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--rate', type=float, default=None,
+                        help='messages per second, unlimited by default')
+    parser.add_argument('--per-datagram', type=int, default=10,
+                        help='messages per msgpack datagram')
+    parser.add_argument('--senders', type=int, default=1,
+                        help='number of sending processes')
+    args = parser.parse_args()
+    host, _, port = args.address.rpartition(':')
+    began = time.monotonic()
+    for process in start((host, int(port)), args.senders, args.count,
+                         kind=args.kind, rate=args.rate,
+                         per_datagram=args.per_datagram):
+        process.join()
+    elapsed = time.monotonic() - began
+    print('sent %d messages in %.2fs, %.0f msgs/s'
+          % (args.count, elapsed, args.count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
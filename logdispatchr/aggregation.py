@@ -0,0 +1,160 @@
+# -*- coding:utf-8 -*-
+"""
+Bounded memory summaries of a stream of messages, used by
+:class:`logdispatchr.outputs.AggregatingOutput`: message templates, a
+count-min sketch estimating how often each template was seen, and the
+heavy hitters, the templates seen the most.
+"""
+
+import re
+import array
+
+# the variable parts of a message: IP addresses, hexadecimal identifiers,
+# and numbers
+VARIABLE_REGEX = re.compile(r'\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?'
+                            r'|\b0x[0-9a-fA-F]+\b'
+                            r'|\b(?=[0-9a-fA-F]*\d)(?=[0-9a-fA-F]*[a-fA-F])'
+                            r'[0-9a-fA-F]+\b'
+                            r'|\d+')
+PLACEHOLDER = '<*>'
+
+
+def template(message, max_length=256):
+    """
+    :param message: the body of a message
+    :type message: str
+    :param max_length: the message is cut to this length first
+    :type max_length: int
+    :return: the message, with its variable parts replaced by a placeholder
+    :rtype: str
+
+    >>> template('Accepted publickey for paul from 10.0.0.1 port 52341')
+    'Accepted publickey for paul from <*> port <*>'
+    """
+    return VARIABLE_REGEX.sub(PLACEHOLDER, message[:max_length])
+
+
+class CountMinSketch(object):
+    """
+    Estimates how many times each item was added, in a fixed amount of
+    memory. Estimates are never too low, and too high by at most
+    e / width of the total count, with a probability of 1 - exp(-depth).
+
+    Sketches of the same size can be added to and subtracted from each
+    other, e.g. to drop the counts of an old time window.
+
+    :param width: the number of counters per row
+    :type width: int
+    :param depth: the number of rows, each with its own hash function
+    :type depth: int
+    """
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array.array('q', bytes(8 * width)) for _ in range(depth)]
+
+    def _indexes(self, item):
+        # double hashing: the rows' hash functions are derived from a single
+        # hash of the item
+        h = hash(item)
+        h1 = h & 0xffffffff
+        h2 = (h >> 32) | 1
+        width = self.width
+        return [(h1 + i * h2) % width for i in range(self.depth)]
+
+    def add(self, item, count=1):
+        """
+        :return: the estimated count of item, once added
+        :rtype: int
+        """
+        estimate = None
+        for row, index in zip(self.rows, self._indexes(item)):
+            value = row[index] = row[index] + count
+            if estimate is None or value < estimate:
+                estimate = value
+        return estimate
+
+    def estimate(self, item):
+        return min(row[index]
+                   for row, index in zip(self.rows, self._indexes(item)))
+
+    def merge(self, other, sign=1):
+        """
+        Adds the counts of other, a sketch of the same size, or subtracts
+        them if sign is -1.
+        """
+        for row, other_row in zip(self.rows, other.rows):
+            for index, value in enumerate(other_row):
+                if value:
+                    row[index] += sign * value
+
+    def clear(self):
+        for row in self.rows:
+            row[:] = array.array('q', bytes(8 * self.width))
+
+
+class HeavyHitters(object):
+    """
+    Keeps track of the items added the most to a :class:`CountMinSketch`:
+    at most capacity candidates are remembered with their estimated count,
+    and a new item replaces the least frequent one once its estimate is
+    higher.
+
+    :param sketch: the sketch counting the items
+    :type sketch: CountMinSketch
+    :param capacity: the maximum number of candidates
+    :type capacity: int
+    """
+    def __init__(self, sketch, capacity=40):
+        self.sketch = sketch
+        self.capacity = capacity
+        # item -> estimated count
+        self.candidates = {}
+        # the smallest count of the candidates, once there are capacity of
+        # them
+        self.threshold = 0
+
+    def add(self, item, count=1):
+        estimate = self.sketch.add(item, count)
+        candidates = self.candidates
+        if item in candidates:
+            candidates[item] = estimate
+        elif len(candidates) < self.capacity:
+            candidates[item] = estimate
+            if len(candidates) == self.capacity:
+                self.threshold = min(candidates.values())
+        elif estimate > self.threshold:
+            # the estimates of the candidates only grow: the threshold is a
+            # lower bound, only recomputed when it is crossed
+            least = min(candidates, key=candidates.get)
+            if estimate > candidates[least]:
+                del candidates[least]
+                candidates[item] = estimate
+            self.threshold = min(candidates.values())
+
+    def refresh(self):
+        """
+        Updates the estimates of the candidates from the sketch, after
+        counts were subtracted from it, and forgets those which dropped to
+        zero.
+        """
+        estimate = self.sketch.estimate
+        self.candidates = {item: count for item, count in (
+                (item, estimate(item)) for item in self.candidates) if count}
+        if len(self.candidates) == self.capacity:
+            self.threshold = min(self.candidates.values())
+        else:
+            self.threshold = 0
+
+    def top(self, n):
+        """
+        :return: the n most frequent candidates, as (item, estimated count)
+                 tuples, the most frequent first
+        :rtype: list
+        """
+        return sorted(self.candidates.items(), key=lambda item: -item[1])[:n]
+
+    def clear(self):
+        self.sketch.clear()
+        self.candidates.clear()
+        self.threshold = 0
@@ -3,24 +3,42 @@
 import click
 import logging
 
-from logdispatchr.core import LogDispatcher
+from logdispatchr.core import ConfigParser, LogDispatcher, AsyncLogDispatcher
+from logdispatchr.supervisor import Supervisor
 
 
 console_formatter = logging.Formatter('%(asctime)s %(processName)-10s %(name)s %(levelname)-8s %(message)s')
 console = logging.StreamHandler()
 console.setFormatter(console_formatter)
 root = logging.getLogger()
-root.setLevel(logging.DEBUG)
 root.addHandler(console)
 
+engines = {
+    'threads': LogDispatcher,
+    'asyncio': AsyncLogDispatcher,
+}
+
 
 @click.command()
 @click.option('--config', default='/etc/config.toml',
               help='use this file for the configuration')
-def main(config):
+@click.option('--engine', default='threads',
+              type=click.Choice(sorted(engines)),
+              help='the runtime used to move messages around')
+@click.option('--loglevel', default=None,
+              type=click.Choice(['DEBUG', 'INFO', 'WARNING', 'ERROR']),
+              help='overrides the loglevel of the configuration file')
+def main(config, engine, loglevel):
     """Console script for logdispatchr"""
-    root.debug("trying to read config file...")
-    app = LogDispatcher(config)
+    parsed = ConfigParser(config)
+    # messages are never logged one by one, see the tracing settings
+    root.setLevel(loglevel or parsed.get('loglevel', 'INFO').upper())
+    workers = parsed.get('workers', 1)
+    if workers > 1:
+        root.info('launching %d workers...', workers)
+        Supervisor(config, workers, engines[engine]).run()
+        return
+    app = engines[engine](config)
     root.info('launching main loop...')
     app.mainloop()
 
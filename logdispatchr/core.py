@@ -1,15 +1,38 @@
 # -*- coding:utf-8 -*-
 
+import time
 import toml
-import queue
+import asyncio
 import logging
 import logging.config
+import queue
+import signal
 import threading
+import collections
 import logdispatchr.inputs
 import logdispatchr.outputs
+# registers the process_pool stage
+import logdispatchr.parallel
+from logdispatchr import metrics
+from logdispatchr.matching import RuleCompiler
+from logdispatchr.queues import (BatchQueue, SegmentStore, SpillingQueue,
+                                 WeightedFairQueue)
+from logdispatchr.routing import Router
+from logdispatchr.stages import Pipeline, make_stage
+from logdispatchr.throttle import LogThrottle
+from logdispatchr.tracing import TRACER
+from logdispatchr.workers import OutputWorker, WORKER_OPTIONS, STOP
 
 logger = logging.getLogger(__name__)
 
+# the settings only applied at startup, ignored by reloads
+RESTART_OPTIONS = ('workers', 'mainqueue_max_size', 'mainqueue_spill_dir',
+                   'mainqueue_spill_budget', 'mainqueue_spill_segment_size',
+                   'metrics_address', 'dispatch_batch_size', 'scheduler')
+
+# shorthands for the most common pipeline stages, run first, in this order
+STAGE_SECTIONS = ('process_pool', 'dedup', 'rate_limit')
+
 
 class ConfigParser(object):
     def __init__(self, config_path):
@@ -22,32 +45,96 @@ class ConfigParser(object):
             self.config = toml.loads(f.read())
         logger.debug('parsed config: %s', self.config)
 
-    def get_declared_inputs(self):
-        inputs = []
-        for _input in self.config.get('inputs', ()):
-            logger.debug('Getting input %s from config file', _input)
-            inputs.append(
-                    self._instanciate_class(logdispatchr.inputs,
-                                            self.config['inputs'][_input]))
-        return inputs
+    def get_declared_inputs(self, **extra):
+        """
+        :param extra: additional keyword arguments given to every input, on
+                      top of its own configuration (e.g. the shared
+                      message_queue)
+        """
+        return [self.get_input(_input, **extra)
+                for _input in self.config.get('inputs', ())]
+
+    def get_input(self, name, **extra):
+        """
+        :param name: the name of an input, as declared in the config file
+        :param extra: see :meth:`get_declared_inputs`
+        :return: a new instance of this input, not set up yet
+        """
+        logger.debug('Getting input %s from config file', name)
+        input_config = dict(self.config['inputs'][name])
+        input_config.update(extra)
+        instance = self._instanciate_class(logdispatchr.inputs, input_config)
+        instance.name = name
+        return instance
 
 # factorize get_declared_{in,out}puts
     def get_declared_outputs(self):
         outputs = []
         for _output in self.config.get('outputs', ()):
-            logger.debug('Getting output %s from config file', _output)
-            output_config = self.config['outputs'][_output]
-            if "class" not in output_config:
-                logger.error('invalid configuration for %s. Missing "class" attribute' % _output)
+            try:
+                outputs.append(self.get_output(_output))
+            except ValueError as e:
+                logger.error('%s', e)
                 # TODO: find a better way to handle this
                 import sys
                 sys.exit(1)
-
-            outputs.append(
-                    self._instanciate_class(logdispatchr.outputs,
-                                            self.config['outputs'][_output]))
         return outputs
 
+    def get_output(self, name):
+        """
+        :param name: the name of an output, as declared in the config file
+        :return: a new instance of this output
+        :raises: ValueError if the output has no class
+        """
+        logger.debug('Getting output %s from config file', name)
+        output_config = dict(self.config['outputs'][name])
+        if "class" not in output_config:
+            raise ValueError('invalid configuration for %s. Missing "class" '
+                             'attribute' % name)
+        for option in WORKER_OPTIONS + ('match',):
+            output_config.pop(option, None)
+        output = self._instanciate_class(logdispatchr.outputs, output_config)
+        output.name = name
+        return output
+
+    def get_output_worker_options(self, name):
+        """
+        :param name: the name of an output, as declared in the config file
+        :return: the settings of this output's worker
+        :rtype: dict
+
+        .. seealso:: :class:`logdispatchr.workers.OutputWorker`
+        """
+        output_config = self.config['outputs'][name]
+        return {option: output_config[option]
+                for option in WORKER_OPTIONS if option in output_config}
+
+    def get_output_match_rules(self, destinations):
+        """
+        Compiles the match rules of the outputs, so that the regular
+        expressions of all of them are merged.
+
+        :param destinations: the name of the output of each destination
+        :type destinations: dict
+        :return: the predicate of each destination having match rules
+        :rtype: dict
+
+        .. seealso:: :mod:`logdispatchr.matching`
+        """
+        compiler = RuleCompiler()
+        predicates = {}
+        for destination, name in destinations.items():
+            rule = self.config['outputs'][name].get('match', None)
+            if rule is None:
+                continue
+            try:
+                predicates[destination] = compiler.compile(rule)
+            except ValueError as e:
+                raise ValueError('invalid match rules for output %s: %s'
+                                 % (name, e))
+        compiler.finish()
+        return predicates
+
     def _instanciate_class(self, module, config):
         logger.debug(config)
         clazz = getattr(module, config.pop('class'))
@@ -57,37 +144,589 @@ class ConfigParser(object):
 class LogDispatcher(object):
     """
     Core application. The Great Orchestrator (tm).
-    Everything shall be rewritten with asyncio
+    This is the threaded engine, see :class:`AsyncLogDispatcher` for the
+    asyncio one.
+
+    :param config_path: the configuration file
+    :type config_path: str
+    :param worker: the index of this process, when running several workers
+    :type worker: int
     """
-    def __init__(self, config_path):
+    def __init__(self, config_path, worker=0):
+        self.config_path = config_path
         self.config = ConfigParser(config_path)
-        self.inputs = self.config.get_declared_inputs()
+        self.worker = worker
+        self.metrics_server = None
+        # held while a batch is dispatched, so reloads swap the routing
+        # between two batches
+        self.dispatch_lock = threading.Lock()
+        # a failure to route a batch is logged at most every 10 seconds
+        self.dispatch_throttle = LogThrottle(10)
+        # set by SIGHUP, reloads are run one at a time by the reload thread
+        self.reload_requested = threading.Event()
+        self.reload_thread = None
+        self.stopping = False
+        self.tracing = self.config.get('tracing', {})
+        if self.tracing.get('enabled', False):
+            self._configure_tracing()
+        self.mainqueue = self._make_mainqueue(
+                self.config.get('mainqueue_max_size', 100))
+        metrics.MAINQUEUE_DEPTH.labels().set_function(self.mainqueue.qsize)
+        # inputs push their messages straight into the mainqueue, so the
+        # output thread is woken up by the queue itself, without polling.
+        # when running several workers, they all bind the same addresses
+        inputs = self.config.get_declared_inputs(
+                message_queue=self.mainqueue,
+                reuse_port=self.config.get('workers', 1) > 1)
+        self.inputs = [_input for _input in inputs if self._runs_here(_input)]
         self.outputs = self.config.get_declared_outputs()
-        self.mainqueue = queue.Queue(self.config.get('mainqueue_max_size', 100))
+        self.setup_stages()
+        self.setup_outputs()
+        self.setup_inputs()
+
+    def _runs_here(self, _input):
+        """
+        :return: whether this worker runs the input: inputs which aren't
+                 per_worker only run in the first one
+        :rtype: bool
+        """
+        if _input.per_worker or not self.worker:
+            return True
+        logger.info('input %s only runs in the first worker', _input.name)
+        return False
 
-    def mainloop(self):  # asynciiiioooooo
+    def setup_stages(self):
+        """
+        Builds the stages run on each batch before routing it: the process
+        pool, the deduplication and the rate limiting, when configured, then
+        the stages of the pipeline.
+        """
+        self.pipeline = self._make_pipeline(self.config)
+
+    def _make_pipeline(self, config):
+        stages = []
+        for section in STAGE_SECTIONS:
+            if section in config.config:
+                stages.append(make_stage(dict(config.get(section),
+                                              type=section)))
+        for index, stage_config in enumerate(config.get('pipeline', ())):
+            try:
+                stages.append(make_stage(stage_config))
+            except (TypeError, ValueError) as e:
+                raise ValueError('invalid pipeline stage #%d: %s'
+                                 % (index + 1, e))
+        return Pipeline(stages)
+
+    def setup_outputs(self):
+        self.workers = [
+                OutputWorker(output,
+                             **self.config.get_output_worker_options(
+                                 output.name))
+                for output in self.outputs]
+        names = {worker: worker.output.name for worker in self.workers}
+        self.router = self._make_router(self.config, names)
+        self._setup_routing_metrics(names)
+
+    def _make_router(self, config, names):
+        """
+        :param names: the output name of each destination, in order
+        :type names: dict
+        """
+        return Router(
+                ((self._output_of(destination).filtr, destination)
+                 for destination in names),
+                config.get('routing_cache_size', 4096),
+                config.get_output_match_rules(names))
+
+    def _output_of(self, destination):
+        return destination.output
+
+    def _setup_routing_metrics(self, names):
+        """
+        :param names: the output name of each destination of the router
+        :type names: dict
+        """
+        self.matched = {destination: metrics.OUTPUT_MATCHED.labels(name)
+                        for destination, name in names.items()}
+        cache_info = self.router.route.cache_info
+        metrics.ROUTING_CACHE_HITS.labels().set_function(
+                lambda: cache_info().hits)
+        metrics.ROUTING_CACHE_MISSES.labels().set_function(
+                lambda: cache_info().misses)
+
+    def _count_routes(self, routes):
+        """
+        :param routes: how many messages were sent to each tuple of
+                       destinations
+        :type routes: collections.Counter
+        """
+        unrouted = routes.pop((), 0)
+        if unrouted:
+            metrics.UNROUTED.labels().inc(unrouted)
+        metrics.DISPATCHED.labels().inc(sum(routes.values()) + unrouted)
+        for destinations, count in routes.items():
+            for destination in destinations:
+                self.matched[destination].inc(count)
+
+    def _make_mainqueue(self, size):
+        spill_dir = self.config.get('mainqueue_spill_dir', None)
+        scheduler = self.config.get('scheduler', None)
+        if scheduler is not None:
+            if spill_dir is not None:
+                logger.warning('mainqueue_spill_dir is not supported with a '
+                               'scheduler, ignoring it')
+            return self._make_scheduler(size, scheduler)
+        if spill_dir is None:
+            return BatchQueue(size)
+        if self.config.get('workers', 1) > 1:
+            # each worker spills to its own directory
+            spill_dir = '%s.%d' % (spill_dir, self.worker)
+        store = SegmentStore(
+                spill_dir,
+                self.config.get('mainqueue_spill_budget', 1024 ** 3),
+                self.config.get('mainqueue_spill_segment_size',
+                                64 * 1024 ** 2))
+        return SpillingQueue(size, store)
+
+    def _make_scheduler(self, size, settings):
+        """
+        :param settings: the scheduler section of the configuration
+        :type settings: dict
+        :rtype: WeightedFairQueue
+        """
+        mainqueue = WeightedFairQueue(size, settings.get('classes', {}),
+                                      settings.get('cache_size', 4096))
+        for traffic_class in mainqueue.classes:
+            metrics.SCHEDULER_QUEUE_DEPTH.labels(
+                    traffic_class.name).set_function(
+                    lambda c=traffic_class: len(c.messages))
+            metrics.SCHEDULER_SHED.labels(traffic_class.name).set_function(
+                    lambda c=traffic_class: c.shed)
+        return mainqueue
+
+    def setup_inputs(self):
+        for _input in self.inputs:
+            _input.setup()
+
+    def start_metrics_server(self):
+        """
+        Serves the metrics if metrics_address is set. When running several
+        workers, each serves its own, on the next port or on a socket path
+        suffixed with its index.
+        """
+        address = self.config.get('metrics_address', None)
+        if address is None:
+            return
+        if self.config.get('workers', 1) > 1:
+            if '/' in address:
+                address = '%s.%d' % (address, self.worker)
+            else:
+                host, _, port = address.rpartition(':')
+                address = '%s:%d' % (host, int(port) + self.worker)
+        self.metrics_server = metrics.MetricsServer(address)
+        self.metrics_server.start()
+
+    def _configure_tracing(self):
+        TRACER.configure(self.tracing.get('every', 1000),
+                         self.tracing.get('keys', ()))
+
+    def _toggle_tracing(self, signum, frame):
+        if TRACER.enabled:
+            TRACER.disable()
+        else:
+            self._configure_tracing()
+
+    def _reload(self, signum, frame):
+        # a reload takes locks and waits for the outputs: running it in the
+        # handler could deadlock, or nest, on the next signal
+        self.reload_requested.set()
+
+    def start_reload_thread(self):
+        """
+        Starts the thread running the reloads requested by SIGHUP, one at a
+        time. Signals received during a reload are coalesced into a single
+        one, run after it.
+        """
+        self.reload_thread = threading.Thread(target=self._run_reloads)
+        self.reload_thread.setDaemon(True)
+        self.reload_thread.start()
+
+    def _run_reloads(self):
+        while True:
+            self.reload_requested.wait()
+            self.reload_requested.clear()
+            if self.stopping:
+                return
+            try:
+                self.reload()
+            except Exception:
+                logger.exception('failed to reload %s', self.config_path)
+
+    def reload(self, timeout=10):
+        """
+        Reads the configuration file again, and applies the differences with
+        the running one, without losing the queued messages:
+
+        * the inputs and outputs whose settings did not change keep running,
+          and their sockets stay bound
+        * new and modified outputs are started, then the routing is switched
+          to them between two batches
+        * removed and modified outputs are drained: they write what was
+          already routed to them, then are closed
+        * removed and modified inputs are closed, then the new ones are set
+          up
+
+        If the new configuration can't be loaded, the running one is kept.
+
+        :param timeout: how long to wait for each removed output to drain, in
+                        seconds
+        :type timeout: float
+        :return: whether the new configuration was applied
+        :rtype: bool
+        """
+        logger.info('reloading %s', self.config_path)
+        try:
+            config = ConfigParser(self.config_path)
+        except Exception:
+            logger.exception('failed to read %s, keeping the current '
+                             'configuration', self.config_path)
+            return False
+        old, new = self.config.config, config.config
+        for option in RESTART_OPTIONS:
+            if old.get(option) != new.get(option):
+                logger.warning('%s changed, it will only be applied on '
+                               'restart', option)
+
+        old_outputs = old.get('outputs', {})
+        new_outputs = new.get('outputs', {})
+        running = {worker.output.name: worker for worker in self.workers
+                   if old_outputs.get(worker.output.name) ==
+                   new_outputs.get(worker.output.name)}
+        workers = []
+        started = []
+        try:
+            for name in new_outputs:
+                worker = running.get(name)
+                if worker is None:
+                    worker = OutputWorker(
+                            config.get_output(name),
+                            **config.get_output_worker_options(name))
+                    started.append(worker)
+                workers.append(worker)
+            names = {worker: worker.output.name for worker in workers}
+            router = self._make_router(config, names)
+            pipeline = self.pipeline
+            if any(old.get(section) != new.get(section)
+                   for section in STAGE_SECTIONS + ('pipeline',)):
+                pipeline = self._make_pipeline(config)
+        except Exception:
+            logger.exception('invalid configuration in %s, keeping the '
+                             'current one', self.config_path)
+            for worker in started:
+                worker.output.close()
+            return False
+
+        for worker in started:
+            worker.start()
+        removed = [worker for worker in self.workers
+                   if worker not in names]
+        with self.dispatch_lock:
+            self.workers = workers
+            self.outputs = [worker.output for worker in workers]
+            self.router = router
+            self._setup_routing_metrics(names)
+            if pipeline is not self.pipeline:
+                leftovers = self.pipeline.flush()
+                self.pipeline = pipeline
+                self._dispatch(leftovers)
+        for worker in removed:
+            logger.info('draining output %s', worker.output.name)
+            worker.stop(timeout)
+            if worker.output.name not in new_outputs:
+                metrics.OUTPUT_QUEUE_DEPTH.remove(worker.output.name)
+                metrics.OUTPUT_DROPPED.remove(worker.output.name)
+
+        old_inputs = old.get('inputs', {})
+        new_inputs = new.get('inputs', {})
+        running = {}
+        for _input in self.inputs:
+            if old_inputs.get(_input.name) == new_inputs.get(_input.name):
+                running[_input.name] = _input
+            else:
+                logger.info('closing input %s', _input.name)
+                _input.close()
+                _input.join(timeout)
+        inputs = []
+        for name in new_inputs:
+            _input = running.get(name)
+            if _input is None:
+                try:
+                    _input = config.get_input(
+                            name, message_queue=self.mainqueue,
+                            reuse_port=self.config.get('workers', 1) > 1)
+                    if not self._runs_here(_input):
+                        continue
+                    _input.setup()
+                except Exception:
+                    logger.exception('failed to start input %s', name)
+                    continue
+            inputs.append(_input)
+        self.inputs = inputs
+        self.config = config
+        if old.get('tracing') != new.get('tracing'):
+            self.tracing = config.get('tracing', {})
+            if self.tracing.get('enabled', False):
+                self._configure_tracing()
+            elif TRACER.enabled:
+                TRACER.disable()
+        logger.info('reloaded %s: %d inputs, %d outputs', self.config_path,
+                    len(self.inputs), len(self.outputs))
+        return True
+
+    def mainloop(self):
         logger.info("Entering main event loop")
-        inputs_thread = threading.Thread(target=self.read_inputs)
-        inputs_thread.setDaemon(True)
-        output_thread = threading.Thread(target=self.write_outputs)
-        output_thread.setDaemon(True)
-        logger.debug('starting input listener thread')
-        inputs_thread.start()
+        signal.signal(signal.SIGTERM, self._terminate)
+        signal.signal(signal.SIGUSR1, self._toggle_tracing)
+        self.start_reload_thread()
+        signal.signal(signal.SIGHUP, self._reload)
+        self.start_metrics_server()
+        for worker in self.workers:
+            worker.start()
+        self.output_thread = threading.Thread(target=self.write_outputs)
+        self.output_thread.setDaemon(True)
         logger.debug('starting output listener thread')
-        output_thread.start()
+        self.output_thread.start()
         logger.info('ready')
-        inputs_thread.join()
-        output_thread.join()
+        try:
+            self.output_thread.join()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            self.shutdown()
 
-    def read_inputs(self):
-        while True:
-            for _input in self.inputs:
-                if _input.has_available_message():
-                    self.mainqueue.put(_input.get())
+    def _terminate(self, signum, frame):
+        raise SystemExit(0)
+
+    def shutdown(self, timeout=10):
+        """
+        Stops the inputs, then flushes everything that was already recieved
+        to the outputs, and closes them.
+
+        :param timeout: how long to wait for each input and output to
+                        finish, in seconds
+        :type timeout: float
+        """
+        logger.info('shutting down')
+        # let a running reload finish, and skip the pending one
+        self.stopping = True
+        self.reload_requested.set()
+        if self.reload_thread is not None:
+            self.reload_thread.join(timeout)
+        for _input in self.inputs:
+            _input.close()
+        # the input threads may still push what they already recieved: STOP
+        # must come after it
+        for _input in self.inputs:
+            _input.join(timeout)
+        self.mainqueue.put(STOP)
+        self.output_thread.join(timeout)
+        for worker in self.workers:
+            worker.stop(timeout)
+        if hasattr(self.mainqueue, 'close'):
+            self.mainqueue.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
 
     def write_outputs(self):
+        batch_size = self.config.get('dispatch_batch_size', 256)
         while True:
-            msg = self.mainqueue.get()
-            logger.debug('Got a message to process: %s', msg)
-            for output in self.outputs:
-                output.accept(msg)
+            try:
+                # wake up regularly when stages have periodic work
+                batch = self.mainqueue.get_many(
+                        batch_size, timeout=self.pipeline.tick_interval)
+            except queue.Empty:
+                batch = []
+            stop = False
+            for i, msg in enumerate(batch):
+                if msg is STOP:
+                    # whatever follows is too late
+                    stop = True
+                    del batch[i:]
+                    break
+            with self.dispatch_lock:
+                pipeline = self.pipeline
+                if pipeline:
+                    batch = pipeline.process(batch)
+                    if stop:
+                        batch.extend(pipeline.flush())
+                try:
+                    self._dispatch(batch)
+                except Exception:
+                    metrics.DISPATCH_ERRORS.labels().inc()
+                    suppressed = self.dispatch_throttle.allow()
+                    if suppressed is not None:
+                        logger.exception('failed to dispatch %d messages '
+                                         '(%d errors not logged)',
+                                         len(batch), suppressed)
+            if stop:
+                return
+
+    def _dispatch(self, batch):
+        if TRACER.enabled:
+            TRACER.mark(batch, 'dispatched')
+        route_message = self.router.route_message
+        routes = collections.Counter()
+        for msg in batch:
+            workers = route_message(msg)
+            routes[workers] += 1
+            for worker in workers:
+                worker.put(msg)
+        self._count_routes(routes)
+
+
+class AsyncLogDispatcher(LogDispatcher):
+    """
+    The asyncio engine. Inputs, the mainqueue and outputs all live on a
+    single event loop, instead of a thread per input plus the dispatcher
+    thread.
+
+    :param loop: the event loop to run on. A new one is created if omitted.
+    :type loop: asyncio.AbstractEventLoop
+    """
+    def __init__(self, config_path, worker=0, loop=None):
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+        self.loop = loop
+        # the wait for the next message, cancelled to stop
+        self.getter = None
+        super().__init__(config_path, worker)
+
+    def _make_mainqueue(self, size):
+        for option in ('mainqueue_spill_dir', 'scheduler'):
+            if option in self.config.config:
+                logger.warning('%s is not supported by the asyncio engine, '
+                               'ignoring it', option)
+        return asyncio.Queue(size)
+
+    def setup_outputs(self):
+        # outputs are awaited directly from the event loop
+        self.workers = []
+        names = {output: output.name for output in self.outputs}
+        self.router = self._make_router(self.config, names)
+        self._setup_routing_metrics(names)
+
+    def _output_of(self, destination):
+        return destination
+
+    def _reload(self, signum, frame):
+        # only logs that reloading is unsupported
+        self.reload()
+
+    def reload(self, timeout=10):
+        logger.warning('reloading the configuration is not supported by the '
+                       'asyncio engine, restart it to apply changes')
+        return False
+
+    def setup_inputs(self):
+        self.loop.run_until_complete(asyncio.gather(
+                *[_input.setup_async(self.loop) for _input in self.inputs]))
+
+    def mainloop(self):
+        logger.info("Entering asyncio event loop")
+        signal.signal(signal.SIGUSR1, self._toggle_tracing)
+        signal.signal(signal.SIGHUP, self._reload)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.loop.add_signal_handler(signum, self._stop)
+        self.start_metrics_server()
+        logger.info('ready')
+        try:
+            self.loop.run_until_complete(self.write_outputs())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        logger.info('shutting down')
+        for _input in self.inputs:
+            _input.close()
+        batch = []
+        while not self.mainqueue.empty():
+            batch.append(self.mainqueue.get_nowait())
+        if self.pipeline:
+            batch = self.pipeline.process(batch) + self.pipeline.flush()
+        self.loop.run_until_complete(self._write_batch(batch))
+        for output in self.outputs:
+            output.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+
+    def _stop(self):
+        # the batch being written is finished, then shutdown drains the rest
+        logger.info('stopping')
+        self.stopping = True
+        if self.getter is not None:
+            self.getter.cancel()
+
+    async def write_outputs(self):
+        batch_size = self.config.get('dispatch_batch_size', 256)
+        pipeline = self.pipeline
+        while not self.stopping:
+            self.getter = asyncio.ensure_future(asyncio.wait_for(
+                    self.mainqueue.get(), pipeline.tick_interval))
+            try:
+                batch = [await self.getter]
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                batch = []
+            finally:
+                self.getter = None
+            # take whatever else is waiting, without yielding
+            while len(batch) < batch_size and not self.mainqueue.empty():
+                batch.append(self.mainqueue.get_nowait())
+            if pipeline:
+                batch = pipeline.process(batch)
+            try:
+                await self._write_batch(batch)
+            except Exception:
+                metrics.DISPATCH_ERRORS.labels().inc()
+                suppressed = self.dispatch_throttle.allow()
+                if suppressed is not None:
+                    logger.exception('failed to dispatch %d messages '
+                                     '(%d errors not logged)',
+                                     len(batch), suppressed)
+
+    async def _write_batch(self, batch):
+        per_output = {}
+        if TRACER.enabled:
+            TRACER.mark(batch, 'dispatched')
+        routes = collections.Counter()
+        for msg in batch:
+            outputs = self.router.route_message(msg)
+            routes[outputs] += 1
+            for output in outputs:
+                per_output.setdefault(output, []).append(msg)
+        self._count_routes(routes)
+        for output, messages in per_output.items():
+            for i in range(0, len(messages), output.max_batch_size):
+                await self._write_chunk(
+                        output, messages[i:i + output.max_batch_size])
+
+    async def _write_chunk(self, output, messages):
+        start = time.monotonic()
+        stage = 'failed@'
+        try:
+            await output._write_messages_async(messages)
+            stage = 'written@'
+        except Exception:
+            # like the threaded engine, carry on with the other outputs
+            metrics.OUTPUT_FAILED.labels(output.name).inc(len(messages))
+            logger.exception('%s failed to write %d messages', output,
+                             len(messages))
+        else:
+            metrics.OUTPUT_WRITTEN.labels(output.name).inc(len(messages))
+        finally:
+            metrics.OUTPUT_WRITE_SECONDS.labels(output.name).observe(
+                    time.monotonic() - start)
+            if TRACER.enabled:
+                TRACER.finish(messages, stage + str(output.name), start)
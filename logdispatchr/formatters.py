@@ -1,13 +1,201 @@
 # -*- coding:utf-8 -*-
+"""
+Formatters turn messages into bytes, for the outputs. They are found by
+name with :func:`get_formatter`, which hands out a single instance per
+name: since each message caches what every formatter rendered for it,
+outputs sharing a format only serialize each message once.
+"""
+
+import json
+import string
+import datetime
+import threading
+
+import msgpack
+
+from logdispatchr.syslog import FACILITIES, SEVERITY_LEVELS
+
+_formatter_classes = {}
+_formatters = {}
+_lock = threading.Lock()
+
+
+def register(name):
+    """
+    Class decorator, making a formatter available under name.
+
+    :param name: the name to use in the configuration file
+    :type name: str
+    """
+    def decorator(clazz):
+        _formatter_classes[name] = clazz
+        return clazz
+    return decorator
 
 
 def get_formatter(formater):
-    return None
+    """
+    :param formater: the name of a registered formatter, or a template, like
+                     "{key}: {message}"
+    :type formater: str
+    :return: the formatter, shared with everyone asking for the same one,
+             or None if formater is None
+    :rtype: BaseFormatter
+    """
+    if formater is None:
+        return None
+    with _lock:
+        if formater not in _formatters:
+            if formater in _formatter_classes:
+                _formatters[formater] = _formatter_classes[formater]()
+            elif '{' in formater:
+                _formatters[formater] = TemplateFormatter(formater)
+            else:
+                raise ValueError('unknown formatter %r, expected a template '
+                                 'or one of %s' % (
+                                     formater,
+                                     ', '.join(sorted(_formatter_classes))))
+        return _formatters[formater]
+
+
+class BaseFormatter(object):
+    """
+    Base class for all formatters. Children implement :meth:`_render`.
+    """
+    def render(self, message):
+        """
+        :param message: the message to format
+        :type message: Message
+        :return: the formatted message, computed once per message
+        :rtype: bytes
+        """
+        rendered = message._rendered
+        if rendered is None:
+            rendered = message._rendered = {}
+        else:
+            data = rendered.get(self)
+            if data is not None:
+                return data
+        data = rendered[self] = self._render(message)
+        return data
+
+    def _render(self, message):
+        raise NotImplementedError
+
+
+def _compile_template(template):
+    """
+    Compiles a str.format template into a function of a message. Fields
+    missing from the message are rendered as empty strings.
+
+    :rtype: callable
+    """
+    parts = []
+    for literal, field, spec, conversion in string.Formatter().parse(
+            template):
+        if literal:
+            parts.append(repr(literal))
+        if field is None:
+            continue
+        if not field.isidentifier() or (spec and '{' in spec):
+            # attribute or index lookups, nested fields: leave it to str.format
+            return lambda m: template.format_map(_Defaulting(m))
+        value = 'm.get(%r, "")' % field
+        if conversion:
+            value = {'r': 'repr', 's': 'str', 'a': 'ascii'}[conversion] + \
+                '(%s)' % value
+        parts.append('format(%s, %r)' % (value, spec or ''))
+    return eval('lambda m: ' + (' + '.join(parts) or "''"))
+
+
+class _Defaulting(dict):
+    def __init__(self, message):
+        self.message = message
+
+    def __missing__(self, name):
+        return self.message.get(name, '')
+
+
+@register('template')
+class TemplateFormatter(BaseFormatter):
+    """
+    Formats messages with a :meth:`str.format` template, compiled once.
+
+    :param template: the template, like "{key}: {message}"
+    :type template: str
+    """
+    def __init__(self, template='{message}'):
+        self.template = template
+        self.format = _compile_template(template)
+
+    def _render(self, message):
+        return self.format(message).encode('utf-8')
+
+
+@register('json')
+class JSONFormatter(BaseFormatter):
+    """
+    One JSON object per message. Values JSON doesn't know about are
+    converted to strings.
+    """
+    def __init__(self):
+        self.encoder = json.JSONEncoder(ensure_ascii=False, default=str,
+                                        separators=(',', ':'))
+
+    def _render(self, message):
+        return self.encoder.encode(dict(message)).encode('utf-8')
+
+
+@register('msgpack')
+class MsgpackFormatter(BaseFormatter):
+    """
+    One msgpack map per message: the exchange format between logdispatchr
+    instances.
+    """
+    def __init__(self):
+        self.local = threading.local()
+
+    def _render(self, message):
+        # packers aren't thread safe, use one per thread
+        packer = getattr(self.local, 'packer', None)
+        if packer is None:
+            packer = self.local.packer = msgpack.Packer(use_bin_type=True,
+                                                        default=str)
+        return packer.pack(dict(message))
+
+
+@register('syslog')
+class SyslogFormatter(BaseFormatter):
+    """
+    RFC 5424 syslog lines, from the fields parsed by
+    :func:`logdispatchr.syslog.parse_syslog`. Missing fields are replaced by
+    "-", or by user.notice and the current time for the priority and
+    timestamp.
+    """
+    FACILITY_CODES = {name: code for code, name in enumerate(FACILITIES)}
+
+    def _render(self, message):
+        get = message.get
+        pri = self.FACILITY_CODES.get(get('facility'), 1) * 8 + \
+            SEVERITY_LEVELS.get(get('severity'), 5)
+        timestamp = get('timestamp')
+        if not timestamp or not timestamp[:1].isdigit():
+            timestamp = datetime.datetime.now(
+                    datetime.timezone.utc).isoformat()
+        return ('<%d>1 %s %s %s %s %s %s %s' % (
+            pri, timestamp, get('hostname') or '-', get('app_name') or '-',
+            get('procid') or '-', get('msgid') or '-',
+            get('structured_data') or '-', get('message', ''))
+        ).encode('utf-8')
 
 
 class BasicFormater(object):
+    """
+    Kept for compatibility, see :class:`TemplateFormatter`.
+    """
     def __init__(self, format_string):
         self.format_string = format_string
+        self._format = _compile_template(format_string)
 
     def format(self, **data):
-        return self.format_string.format(**data)
+        return self._format(data)
@@ -0,0 +1,56 @@
+# -*- coding:utf-8 -*-
+"""
+Length framing for the stream transports: each frame is a 4 bytes, big
+endian, payload length, followed by the payload itself.
+"""
+
+import struct
+
+HEADER = struct.Struct('>I')
+
+
+def frame(payload):
+    """
+    :param payload: the data to frame
+    :type payload: bytes
+    :return: the framed payload
+    :rtype: bytes
+    """
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder(object):
+    """
+    Reassembles frames from a stream of bytes.
+
+    :param max_frame_size: larger frames are considered as garbage
+    :type max_frame_size: int
+    """
+    def __init__(self, max_frame_size=16 * 1024 * 1024):
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        :param data: the bytes read from the stream
+        :type data: bytes
+        :return: the payloads of the frames completed by data
+        :rtype: list
+        :raises: ValueError if a frame is larger than max_frame_size
+        """
+        buf = self.buffer
+        buf += data
+        payloads = []
+        offset = 0
+        while len(buf) - offset >= HEADER.size:
+            length, = HEADER.unpack_from(buf, offset)
+            if length > self.max_frame_size:
+                raise ValueError('frame too large: %d bytes' % length)
+            end = offset + HEADER.size + length
+            if len(buf) < end:
+                break
+            payloads.append(bytes(buf[offset + HEADER.size:end]))
+            offset = end
+        if offset:
+            del buf[:offset]
+        return payloads
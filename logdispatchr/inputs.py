@@ -1,14 +1,25 @@
 # -*- coding:utf-8 -*-
 
-import queue
+import os
+import json
+import time
+import socket
+import asyncio
 import logging
 import msgpack
+import tempfile
+import selectors
 import threading
-import socketserver
 
 
-from logdispatchr import formatters
-from logdispatchr.models import Message
+from logdispatchr import inotify
+from logdispatchr import metrics
+from logdispatchr.framing import FrameDecoder
+from logdispatchr.models import Message, decode_text
+from logdispatchr.queues import BatchQueue
+from logdispatchr.syslog import parse_syslog
+from logdispatchr.throttle import LogThrottle
+from logdispatchr.tracing import TRACER
 
 logger = logging.getLogger(__name__)
 
@@ -18,18 +29,27 @@ class BaseInput(object):
     This class takes stuff from a source, and converts it in the standard
     internal message format. It is also the base class for any input.
 
-    :param formatter: A string identifying the formatter to use
     :param key: the identifier for the messages comming from this source
     :param max_waiting_messages: the size of the internal queue.
-    :type formatter: str
+    :param message_queue: a queue shared with the dispatcher. When given,
+                          recieved messages are pushed directly into it,
+                          and max_waiting_messages is ignored.
     :type key: str
-    :type max_waiting_messages: queue.Queue
+    :type max_waiting_messages: int
+    :type message_queue: logdispatchr.queues.BatchQueue
     """
+    # set from the configuration file
+    name = None
+    # whether every worker process runs this input. Inputs which can't share
+    # their source between processes set it to False, and only run in the
+    # first worker.
+    per_worker = True
+
     def __init__(self, **kwargs):
-        self.formatter = formatters.get_formatter(
-                kwargs.get('formatter', None))
         self.key = kwargs.get('key', 'undefined')
-        self.messages = queue.Queue(kwargs.get('max_waiting_messages', 10))
+        self.messages = kwargs.get('message_queue', None)
+        if self.messages is None:
+            self.messages = BatchQueue(kwargs.get('max_waiting_messages', 10))
 
     def setup(self):
         """
@@ -38,6 +58,90 @@ class BaseInput(object):
         """
         pass
 
+    def close(self):
+        """
+        Stops recieving messages. Should be overriden in child classes if
+        needed.
+        """
+        pass
+
+    def join(self, timeout=None):
+        """
+        Waits for the input to be fully stopped, after :meth:`close`, e.g.
+        for its socket to be released. Should be overriden in child classes
+        running their own thread.
+        """
+        pass
+
+    async def setup_async(self, loop):
+        """
+        asyncio counterpart of :meth:`setup`, used by the asyncio engine.
+        Inputs supporting this engine must override it, and push their
+        messages with ``self.messages.put_nowait`` from the event loop.
+
+        :param loop: the event loop the dispatcher runs on
+        :type loop: asyncio.AbstractEventLoop
+        """
+        raise NotImplementedError('%s does not support the asyncio engine'
+                                  % self.__class__.__name__)
+
+    def make_message(self, data, client_address):
+        """
+        Converts a raw payload into a Message. Should be overriden by inputs
+        recieving raw data.
+
+        :param data: the raw payload
+        :type data: bytes
+        :param client_address: where the payload came from
+        :rtype: Message
+        """
+        raise NotImplementedError
+
+    def make_messages(self, data, client_address):
+        """
+        Converts a raw payload into Messages. Inputs whose payloads may hold
+        several messages should override it, the default is to call
+        :meth:`make_message`.
+
+        :param data: the raw payload
+        :type data: bytes
+        :param client_address: where the payload came from
+        :rtype: list
+        """
+        m = self.make_message(data, client_address)
+        if m is None:
+            return []
+        return [m]
+
+    @property
+    def received(self):
+        """
+        The counter of the messages recieved by this input.
+
+        :rtype: logdispatchr.metrics.CounterValue
+        """
+        return metrics.INPUT_RECEIVED.labels(self.name or self.key)
+
+    @property
+    def dropped(self):
+        """
+        The counter of the messages this input had no room for.
+
+        :rtype: logdispatchr.metrics.CounterValue
+        """
+        return metrics.INPUT_DROPPED.labels(self.name or self.key)
+
+    def _received(self, messages):
+        """
+        Accounts for newly recieved messages, before queueing them: counts
+        them, and picks the ones to trace.
+
+        :type messages: list
+        """
+        self.received.inc(len(messages))
+        if TRACER.enabled:
+            TRACER.start(messages, 'received@%s' % (self.name or self.key))
+
     # rewrite this as iterators?
     def has_available_message(self):
         """
@@ -56,93 +160,633 @@ class BaseInput(object):
         return self.messages.get()
 
 
-class UDPSyslogInput(BaseInput):
+class DatagramInputProtocol(asyncio.DatagramProtocol):
+    """
+    Generic asyncio protocol for the datagram based inputs. Each datagram is
+    converted by the input's :meth:`BaseInput.make_messages`, and put in its
+    queue. Since we can't apply backpressure on UDP, messages are dropped
+    when the queue is full.
+    """
+    # drops are logged at most this often, in seconds
+    DROP_LOG_INTERVAL = 10
+
+    def __init__(self, _input):
+        self.input = _input
+        self.dropped = _input.dropped
+        self.drop_throttle = LogThrottle(self.DROP_LOG_INTERVAL)
+
+    def datagram_received(self, data, addr):
+        messages = self.input.make_messages(data, addr)
+        self.input._received(messages)
+        put_nowait = self.input.messages.put_nowait
+        for i, m in enumerate(messages):
+            try:
+                put_nowait(m)
+            except asyncio.QueueFull:
+                # the rest won't fit either
+                self._drop(len(messages) - i, addr)
+                return
+
+    def _drop(self, count, addr):
+        self.dropped.inc(count)
+        suppressed = self.drop_throttle.allow()
+        if suppressed is not None:
+            logger.warning('queue full, dropping %d messages from %s (%d '
+                           'drops not logged)', count, addr[0], suppressed)
+
+    def error_received(self, exc):
+        logger.error('error on %s:%s: %s',
+                     self.input.host, self.input.port, exc)
+
+
+class DatagramInput(BaseInput):
     """
-    A naïve UDP rsyslog reciever. Doesn't parse the recieved message.
+    Base class for the UDP inputs. A dedicated thread waits for the socket
+    to become readable, then drains as many datagrams as it can (up to
+    max_batch) in a single preallocated buffer, and enqueues them at once.
 
     :param host: the host to bind to. The most common is 0.0.0.0, to listen to
                  all interfaces, but localhost or 127.0.0.1 are a possibility
     :type host: str
     :param port: the port we should listen to
     :type port: int
+    :param max_batch: the maximum number of datagrams read per wakeup
+    :type max_batch: int
+    :param max_datagram_size: the size of the receive buffer. Longer
+                              datagrams are truncated.
+    :type max_datagram_size: int
+    :param receive_buffer_size: if set, the kernel socket buffer size
+                                (SO_RCVBUF), to absorb bursts
+    :type receive_buffer_size: int
+    :param reuse_port: whether to set SO_REUSEPORT, so that several
+                       processes can share the same address. Set by the
+                       dispatcher when running several workers.
+    :type reuse_port: bool
     """
-
-    class UDPSyslogServer(socketserver.UDPServer):
-        def __init__(self, host, port, message_queue, key):
-            self.message_queue = message_queue
-            self.key = key
-            super().__init__((host, port), UDPSyslogInput.UDPSyslogHandler)
-
-    class UDPSyslogHandler(socketserver.DatagramRequestHandler):
-        def handle(self):
-            data = bytes.decode(self.request[0].strip())
-#            socket = self.request[1]
-            m = Message()
-            m['message'] = str(data)
-            m['key'] = self.server.key
-            logger.debug('got UDP syslog message: %s from %s',
-                         m, self.client_address[0])
-            self.server.message_queue.put(m)
+    default_port = None
 
     def __init__(self, **kwargs):
         self.host = kwargs.get('host', 'localhost')
-        self.port = kwargs.get('port', 514)
+        self.port = kwargs.get('port', self.default_port)
+        self.max_batch = kwargs.get('max_batch', 256)
+        self.max_datagram_size = kwargs.get('max_datagram_size', 65535)
+        self.receive_buffer_size = kwargs.get('receive_buffer_size', None)
+        self.reuse_port = kwargs.get('reuse_port', False)
+        self.running = False
         super().__init__(**kwargs)
-        self.setup()
+
+    def _bind(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if self.receive_buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                            self.receive_buffer_size)
+        sock.bind((self.host, self.port))
+        return sock
 
     def setup(self):
-        self.server = UDPSyslogInput.UDPSyslogServer(self.host, self.port,
-                                                     self.messages, self.key)
-        self.serverthread = threading.Thread(target=self.server.serve_forever)
+        if not hasattr(self.messages, 'put_many'):
+            raise TypeError('%s needs a queue supporting put_many'
+                            % self.__class__.__name__)
+        self.socket = self._bind()
+        self.socket.setblocking(False)
+        self.running = True
+        self.serverthread = threading.Thread(target=self.receive_loop)
         self.serverthread.setDaemon(True)
         self.serverthread.start()
-        logger.info("successfully started Rsyslog server on %s:%s",
-                    self.host, self.port)
+        logger.info("successfully started %s on %s:%s",
+                    self.__class__.__name__, self.host, self.port)
+
+    async def setup_async(self, loop):
+        self.socket = self._bind()
+        self.transport, _ = await loop.create_datagram_endpoint(
+                lambda: DatagramInputProtocol(self), sock=self.socket)
+        logger.info("successfully started asyncio %s on %s:%s",
+                    self.__class__.__name__, self.host, self.port)
+
+    def close(self):
+        """
+        Stops listening. The receive thread exits on its next wakeup.
+        """
+        self.running = False
+        if hasattr(self, 'transport'):
+            self.transport.close()
+
+    def join(self, timeout=None):
+        if getattr(self, 'serverthread', None) is not None:
+            self.serverthread.join(timeout)
+
+    def receive_loop(self):
+        buf = bytearray(self.max_datagram_size)
+        view = memoryview(buf)
+        recvfrom_into = self.socket.recvfrom_into
+        make_messages = self.make_messages
+        selector = selectors.DefaultSelector()
+        selector.register(self.socket, selectors.EVENT_READ)
+        while self.running:
+            # the timeout only serves to notice close()
+            if not selector.select(1):
+                continue
+            batch = []
+            while len(batch) < self.max_batch:
+                try:
+                    nbytes, address = recvfrom_into(buf)
+                except (BlockingIOError, InterruptedError):
+                    break
+                batch.extend(make_messages(bytes(view[:nbytes]), address))
+            if batch:
+                self._received(batch)
+                self.messages.put_many(batch)
+        selector.close()
+        self.socket.close()
+
+
+class UDPSyslogInput(DatagramInput):
+    """
+    A UDP rsyslog reciever. Messages are parsed as RFC 5424 or RFC 3164
+    syslog, lazily: only when one of their fields is first used. See
+    :func:`logdispatchr.syslog.parse_syslog` for the available fields.
+
+    See :class:`DatagramInput` for the other parameters.
+
+    :param parse: set to false to keep the whole line in the "message"
+                  field, without parsing it
+    :type parse: bool
+    """
+    default_port = 514
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.decode = parse_syslog if kwargs.get('parse', True) \
+            else decode_text
+
+    def make_message(self, data, client_address):
+        return Message.from_raw(data, self.key, self.decode)
+
+
+class LogdispatchrUDPInput(DatagramInput):
+    """
+    Listens to forwarded messages from other logdispatchr instances, as sent
+    by :class:`logdispatchr.outputs.LogdispatchrUDPOutput`. Please see the
+    "models" page of the documentation to know more about the exchange
+    format
+
+    See :class:`DatagramInput` for the parameters.
+    """
+    default_port = 5140
+
+    def make_messages(self, data, client_address):
+        # a datagram holds as many messages as the sender could fit in it
+        return unpack_messages(data, client_address)
+
+
+class StreamInputProtocol(asyncio.Protocol):
+    """
+    asyncio protocol for the framed stream inputs. When the queue is full,
+    reading from the connection is paused until there is room again, so the
+    sender is slowed down by TCP flow control.
+    """
+    def __init__(self, _input):
+        self.input = _input
+        self.decoder = FrameDecoder(_input.max_frame_size)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = transport.get_extra_info('peername')
+
+    def data_received(self, data):
+        try:
+            payloads = self.decoder.feed(data)
+        except ValueError as e:
+            logger.warning('closing connection from %s: %s', self.peer[0], e)
+            self.transport.close()
+            return
+        messages = []
+        for payload in payloads:
+            messages.extend(self.input.make_messages(payload, self.peer))
+        self.input._received(messages)
+        for i, m in enumerate(messages):
+            try:
+                self.input.messages.put_nowait(m)
+            except asyncio.QueueFull:
+                self.transport.pause_reading()
+                asyncio.ensure_future(self._put_later(messages[i:]))
+                return
 
+    async def _put_later(self, messages):
+        for m in messages:
+            await self.input.messages.put(m)
+        if not self.transport.is_closing():
+            self.transport.resume_reading()
 
-class LogdispatchrUDPInput(BaseInput):
+
+class LogdispatchrTCPInput(BaseInput):
     """
-    Listens to forwarded messages from other logdispatchr instances. Please
+    Listens to messages streamed by other logdispatchr instances over long
+    lived TCP connections, as sent by
+    :class:`logdispatchr.outputs.LogdispatchrTCPOutput`. Each frame is a 4
+    bytes big endian length, followed by one or more msgpack maps. Please
     see the "models" page of the documentation to know more about the
-    exchange format
+    exchange format.
 
-    :param host: the host to bind to. The most common is 0.0.0.0, to listen to
-                 all interfaces, but localhost or 127.0.0.1 are a possibility
+    All the connections are served by a single thread. When the queue is
+    full, the sockets are not read anymore, and TCP flow control slows the
+    senders down.
+
+    :param host: the host to bind to
     :type host: str
     :param port: the port we should listen to
     :type port: int
+    :param max_frame_size: connections sending larger frames are closed
+    :type max_frame_size: int
+    :param reuse_port: whether to set SO_REUSEPORT, so that several
+                       processes can share the same address. Set by the
+                       dispatcher when running several workers.
+    :type reuse_port: bool
     """
-    class UDPMessagePackServer(socketserver.UDPServer):
-        def __init__(self, host, port, message_queue):
-            self.message_queue = message_queue
-            self.key = None
-            super().__init__((host, port),
-                             LogdispatchrUDPInput.UDPMessagePackHandler)
-
-    class UDPMessagePackHandler(socketserver.DatagramRequestHandler):
-        def handle(self):
-            data = bytes.decode(self.request[0].strip())
-#            socket = self.request[1]
-            m = Message(msgpack.unpackb(data))
-            # Don't update the key, since it is a forward.
-            # but let's check for its presence
-            if 'key' not in m:
-                logger.warning('got forwarded message without a key: %s', m)
-            logger.debug('got UDP Logdispatchr message: %s from %s',
-                         m, self.client_address[0])
-            self.server.message_queue.put(m)
-
     def __init__(self, **kwargs):
         self.host = kwargs.get('host', 'localhost')
         self.port = kwargs.get('port', 5140)
+        self.max_frame_size = kwargs.get('max_frame_size', 16 * 1024 * 1024)
+        self.reuse_port = kwargs.get('reuse_port', False)
+        self.running = False
         super().__init__(**kwargs)
-        self.setup()
+
+    def _bind(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(128)
+        return sock
 
     def setup(self):
-        self.server = LogdispatchrUDPInput.UDPMessagePackServer(
-                self.host, self.port, self.messages)
-        self.serverthread = threading.Thread(target=self.server.serve_forever)
+        if not hasattr(self.messages, 'put_many'):
+            raise TypeError('%s needs a queue supporting put_many'
+                            % self.__class__.__name__)
+        self.socket = self._bind()
+        self.socket.setblocking(False)
+        self.running = True
+        self.serverthread = threading.Thread(target=self.receive_loop)
         self.serverthread.setDaemon(True)
         self.serverthread.start()
-        logger.info("successfully started Logdispatchr \
-                message server on %s:%s", self.host, self.port)
+        logger.info("successfully started %s on %s:%s",
+                    self.__class__.__name__, self.host, self.port)
+
+    async def setup_async(self, loop):
+        self.socket = self._bind()
+        self.server = await loop.create_server(
+                lambda: StreamInputProtocol(self), sock=self.socket)
+        logger.info("successfully started asyncio %s on %s:%s",
+                    self.__class__.__name__, self.host, self.port)
+
+    def close(self):
+        """
+        Stops listening, and closes the connections. The receive thread
+        exits on its next wakeup.
+        """
+        self.running = False
+        if hasattr(self, 'server'):
+            self.server.close()
+
+    def join(self, timeout=None):
+        if getattr(self, 'serverthread', None) is not None:
+            self.serverthread.join(timeout)
+
+    def make_messages(self, data, client_address):
+        return unpack_messages(data, client_address)
+
+    def receive_loop(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.socket, selectors.EVENT_READ)
+        while self.running:
+            # the timeout only serves to notice close()
+            for key, _ in selector.select(1):
+                if key.fileobj is self.socket:
+                    self._accept(selector)
+                else:
+                    self._read(selector, key)
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+
+    def _accept(self, selector):
+        try:
+            conn, address = self.socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        logger.info('new connection from %s', address[0])
+        conn.setblocking(False)
+        selector.register(conn, selectors.EVENT_READ,
+                          (FrameDecoder(self.max_frame_size), address))
+
+    def _read(self, selector, key):
+        conn = key.fileobj
+        decoder, address = key.data
+        try:
+            data = conn.recv(1 << 18)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            logger.warning('error on connection from %s: %s', address[0], e)
+            data = b''
+        try:
+            payloads = decoder.feed(data) if data else None
+        except ValueError as e:
+            logger.warning('closing connection from %s: %s', address[0], e)
+            payloads = None
+        if payloads is None:
+            logger.info('connection from %s closed', address[0])
+            selector.unregister(conn)
+            conn.close()
+            return
+        batch = []
+        for payload in payloads:
+            batch.extend(self.make_messages(payload, address))
+        if batch:
+            self._received(batch)
+            self.messages.put_many(batch)
+
+
+def decode_line(raw):
+    return {'message': raw.decode('utf-8', 'replace')}
+
+
+class Checkpoint(object):
+    """
+    Remembers how far a file was read, in a small JSON file, replaced
+    atomically on each save.
+
+    :param path: the checkpoint file
+    :type path: str
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """
+        :return: the saved state, or an empty dict
+        :rtype: dict
+        """
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning('ignoring corrupted checkpoint %s', self.path)
+            return {}
+
+    def save(self, **state):
+        # a unique temporary file, in case another process saves too
+        fd, tmp = tempfile.mkstemp(
+                prefix=os.path.basename(self.path) + '.', suffix='.tmp',
+                dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+class FileTailInput(BaseInput):
+    """
+    Follows a file, like ``tail -F``. Changes are watched with inotify (on
+    other platforms, the file is polled), new data is read in large chunks,
+    and each line becomes a message. Rotation (the file being renamed or
+    deleted, then recreated) and truncation are detected.
+
+    The position in the file can be saved to a checkpoint file, so that a
+    restart resumes where the previous run stopped.
+
+    When running several workers, the file is only followed by the first
+    one, so that each line is sent once.
+
+    :param path: the file to follow
+    :type path: str
+    :param checkpoint_path: if set, the file holding the current position.
+                            Each input needs its own.
+    :type checkpoint_path: str
+    :param checkpoint_interval: the minimum delay between two checkpoint
+                                saves, in seconds
+    :type checkpoint_interval: float
+    :param start_at: where to start when there is no checkpoint: "end" (only
+                     new lines) or "beginning"
+    :type start_at: str
+    :param chunk_size: the number of bytes read at once
+    :type chunk_size: int
+    :param poll_interval: how often to check the file when inotify isn't
+                          available, and as a safety net when it is
+    :type poll_interval: float
+    """
+    per_worker = False
+
+    def __init__(self, **kwargs):
+        self.path = os.path.abspath(kwargs['path'])
+        checkpoint_path = kwargs.get('checkpoint_path', None)
+        self.checkpoint = Checkpoint(checkpoint_path) \
+            if checkpoint_path else None
+        self.checkpoint_interval = kwargs.get('checkpoint_interval', 1)
+        self.start_at = kwargs.get('start_at', 'end')
+        if self.start_at not in ('end', 'beginning'):
+            raise ValueError('start_at must be "end" or "beginning"')
+        self.chunk_size = kwargs.get('chunk_size', 1024 * 1024)
+        self.poll_interval = kwargs.get('poll_interval', 1)
+        self.file = None
+        self.inode = None
+        self.offset = 0
+        self.partial = b''
+        self.last_checkpoint = 0
+        self.running = False
+        super().__init__(**kwargs)
+
+    def setup(self):
+        if not hasattr(self.messages, 'put_many'):
+            raise TypeError('%s needs a queue supporting put_many'
+                            % self.__class__.__name__)
+        self._start(self.messages.put_many)
+
+    async def setup_async(self, loop):
+        # file IO can't be made asynchronous, so we still use a thread, and
+        # wait for each batch to be queued in the event loop.
+        def put_many(batch):
+            asyncio.run_coroutine_threadsafe(
+                    self._put_async(batch), loop).result()
+        self._start(put_many)
+
+    async def _put_async(self, batch):
+        for m in batch:
+            await self.messages.put(m)
+
+    def _start(self, put_many):
+        self.put_many = put_many
+        self.watcher = None
+        if inotify.available:
+            self.watcher = inotify.Inotify()
+            self.watcher.add_watch(
+                    os.path.dirname(self.path),
+                    inotify.IN_MODIFY | inotify.IN_CREATE |
+                    inotify.IN_MOVED_TO | inotify.IN_MOVED_FROM |
+                    inotify.IN_DELETE | inotify.IN_ATTRIB)
+        self._resume()
+        self.running = True
+        self.thread = threading.Thread(target=self.follow)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        logger.info('following %s from offset %d%s', self.path, self.offset,
+                    '' if self.watcher else ', polling')
+
+    def _resume(self):
+        state = self.checkpoint.load() if self.checkpoint else {}
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if state.get('inode') == st.st_ino and \
+                state.get('offset', 0) <= st.st_size:
+            self._open(state['offset'])
+        elif state:
+            # rotated while we were away
+            self._open(0)
+        else:
+            self._open(st.st_size if self.start_at == 'end' else 0)
+
+    def _open(self, offset):
+        try:
+            self.file = open(self.path, 'rb', buffering=0)
+        except FileNotFoundError:
+            self.file = None
+            return
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.file.seek(offset)
+        self.offset = offset
+        self.partial = b''
+
+    def close(self):
+        """
+        Stops following the file. The thread exits on its next wakeup.
+        """
+        self.running = False
+
+    def join(self, timeout=None):
+        if getattr(self, 'thread', None) is not None:
+            self.thread.join(timeout)
+
+    def follow(self):
+        selector = selectors.DefaultSelector()
+        if self.watcher:
+            selector.register(self.watcher, selectors.EVENT_READ)
+        name = os.path.basename(self.path)
+        while self.running:
+            if self.watcher:
+                if selector.select(self.poll_interval):
+                    events = self.watcher.read_events()
+                    if not any(e[3] == name or e[1] & inotify.IN_Q_OVERFLOW
+                               for e in events):
+                        continue
+            else:
+                time.sleep(self.poll_interval)
+            self._check()
+        self._save_checkpoint(force=True)
+        selector.close()
+        if self.watcher:
+            self.watcher.close()
+        if self.file:
+            self.file.close()
+
+    def _check(self):
+        """
+        Reads whatever was appended, after dealing with rotation and
+        truncation.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        if self.file is not None:
+            if st is None:
+                # moved or deleted, the writer may still append to it until
+                # the new file shows up
+                self._read()
+                return
+            if st.st_ino != self.inode:
+                # rotated: finish the old file, then switch to the new one
+                self._read()
+                if self.partial:
+                    self._emit([self.partial])
+                self.file.close()
+                self.file = None
+                logger.info('%s was rotated', self.path)
+            elif st.st_size < self.offset:
+                logger.warning('%s was truncated', self.path)
+                self.file.seek(0)
+                self.offset = 0
+                self.partial = b''
+        if self.file is None and st is not None:
+            self._open(0)
+        if self.file is not None:
+            self._read()
+        self._save_checkpoint()
+
+    def _read(self):
+        while True:
+            data = self.file.read(self.chunk_size)
+            if not data:
+                return
+            self.offset += len(data)
+            lines = (self.partial + data).split(b'\n')
+            self.partial = lines.pop()
+            if lines:
+                self._emit(lines)
+
+    def _emit(self, lines):
+        key = self.key
+        from_raw = Message.from_raw
+        batch = [from_raw(line, key, decode_line) for line in lines]
+        self._received(batch)
+        self.put_many(batch)
+
+    def _save_checkpoint(self, force=False):
+        if self.checkpoint is None or self.inode is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_checkpoint < self.checkpoint_interval:
+            return
+        # the incomplete last line will be read again
+        self.checkpoint.save(path=self.path, inode=self.inode,
+                             offset=self.offset - len(self.partial))
+        self.last_checkpoint = now
+
+
+def unpack_messages(data, client_address):
+    """
+    Decodes concatenated msgpack maps, as sent by other logdispatchr
+    instances.
+
+    :param data: the payload
+    :type data: bytes
+    :param client_address: where the payload came from
+    :return: the decoded messages. Decoding stops at the first invalid one.
+    :rtype: list
+    """
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(data)
+    messages = []
+    try:
+        for obj in unpacker:
+            if not isinstance(obj, dict):
+                raise TypeError('expected a map, got %s' % type(obj).__name__)
+            m = Message.from_fields(obj)
+            # Don't update the key, since it is a forward.
+            # but let's check for its presence
+            if 'key' not in m:
+                logger.warning('got forwarded message without a key: %s', m)
+            messages.append(m)
+    except (ValueError, TypeError, msgpack.UnpackException) as e:
+        logger.warning('got an invalid payload from %s: %s',
+                       client_address[0], e)
+    return messages
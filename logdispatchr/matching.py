@@ -0,0 +1,361 @@
+# -*- coding:utf-8 -*-
+"""
+Content based routing rules. On top of its key filter, each output may
+only accept the messages matching a ``match`` table of its configuration::
+
+    [outputs.aggregator.match]
+    severity = "emerg..warning"
+    not = { regex = "healthcheck" }
+
+A rule is a table, whose entries must all match:
+
+* ``severity``: a severity name, a range of them like "emerg..warning" (in
+  the syslog order, from the most to the least severe), or a list of those
+* ``regex``: a regular expression searched in the message body, or a table
+  of field names to regular expressions
+* ``fields``: a table of field names to expected values, or lists of
+  accepted values
+* ``all``, ``any``: lists of rules, which must all, or any, match
+* ``not``: a rule which must not match
+
+Rules are compiled once, at load time, into closures. The regular
+expressions of all the rules on a same field are merged into a single
+alternation, so a message body matching none of them is only scanned once,
+however many outputs filter on it.
+"""
+
+import re
+import bisect
+import itertools
+
+from logdispatchr.syslog import SEVERITIES, SEVERITY_LEVELS
+
+# global inline flags, which can't be merged as is into an alternation
+GLOBAL_FLAGS = re.compile(r'^\(\?([aiLmsux]+)\)')
+
+# numbered or named backreferences, which would break once merged
+BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+
+def parse_severities(spec):
+    """
+    :param spec: a severity name, a range like "emerg..warning", or a list
+                 of those
+    :return: the matching severity names
+    :rtype: frozenset
+    """
+    if isinstance(spec, (list, tuple)):
+        names = set()
+        for item in spec:
+            names |= parse_severities(item)
+        return frozenset(names)
+    first, sep, last = spec.partition('..')
+    for name in (first, last) if sep else (first,):
+        if name and name not in SEVERITY_LEVELS:
+            raise ValueError('unknown severity %r, expected one of %s'
+                             % (name, ', '.join(SEVERITIES)))
+    if not sep:
+        return frozenset((first,))
+    low = SEVERITY_LEVELS[first] if first else 0
+    high = SEVERITY_LEVELS[last] if last else len(SEVERITIES) - 1
+    low, high = min(low, high), max(low, high)
+    return frozenset(SEVERITIES[low:high + 1])
+
+
+class RegexSet(object):
+    """
+    Several regular expressions, searched at once in a text.
+
+    They are merged into a single alternation: when it finds nothing, none
+    of them matches, after a single scan. Otherwise, the first match tells
+    which expression matched first, and where: the other ones are then only
+    searched from there.
+    """
+    def __init__(self):
+        self.patterns = []
+        self.compiled = []
+        self.regex = None
+        self.groups = {}
+        self.separate = []
+
+    def add(self, pattern):
+        """
+        :param pattern: a regular expression
+        :type pattern: str
+        :return: the index of this expression in the results of :meth:`scan`
+        :rtype: int
+        :raises: ValueError if the expression is invalid
+        """
+        try:
+            self.compiled.append(re.compile(pattern))
+        except re.error as e:
+            raise ValueError('invalid regular expression %r: %s'
+                             % (pattern, e))
+        self.patterns.append(pattern)
+        self.regex = None
+        return len(self.patterns) - 1
+
+    def compile(self):
+        parts = []
+        group = 1
+        self.groups = {}
+        self.separate = []
+        for index, (pattern, compiled) in enumerate(zip(self.patterns,
+                                                        self.compiled)):
+            if BACKREFERENCE.search(pattern) or compiled.groupindex:
+                # group numbers and names would clash once merged
+                self.separate.append(index)
+                continue
+            flags = GLOBAL_FLAGS.match(pattern)
+            if flags:
+                pattern = '(?%s:%s)' % (flags.group(1), pattern[flags.end():])
+            parts.append('(%s)' % pattern)
+            self.groups[group] = index
+            group += 1 + compiled.groups
+        try:
+            self.regex = re.compile('|'.join(parts)) if parts else None
+        except re.error:
+            # some flags or syntax can't be merged, search them one by one
+            self.regex = None
+            self.separate = list(range(len(self.patterns)))
+
+    def scan(self, text):
+        """
+        :param text: the text to search
+        :type text: str
+        :return: the indexes of the expressions found in text
+        :rtype: set
+        """
+        if self.regex is None and len(self.separate) < len(self.patterns):
+            self.compile()
+        found = set()
+        for index in self.separate:
+            if self.compiled[index].search(text):
+                found.add(index)
+        if self.regex is None:
+            return found
+        m = self.regex.search(text)
+        if m is None:
+            return found
+        first = self.groups[m.lastindex]
+        found.add(first)
+        start = m.start()
+        for index in self.groups.values():
+            if index not in found and \
+                    self.compiled[index].search(text, start):
+                found.add(index)
+        return found
+
+
+class BatchRegex(object):
+    """
+    A regular expression searched in many texts at once, e.g. in a field of
+    every message of a batch. The texts are joined in a single string,
+    scanned in one pass: only the texts where a match starts are searched
+    again, on their own, so the texts which don't match cost next to
+    nothing.
+
+    This only pays off when few texts match: while most of them do, they are
+    searched one by one instead.
+
+    :param pattern: a regular expression
+    :type pattern: str
+    :raises: ValueError if the expression is invalid
+    """
+    # the share of matching texts above which they are searched one by one
+    MAX_HIT_RATE = 0.1
+
+    def __init__(self, pattern):
+        try:
+            self.regex = re.compile(pattern)
+            # ^ and $ must match around each text once they are joined.
+            # \A and \Z would not, so these are searched text by text.
+            self.joined = None if '\\A' in pattern or '\\Z' in pattern \
+                else re.compile(pattern, re.MULTILINE)
+        except re.error as e:
+            raise ValueError('invalid regular expression %r: %s'
+                             % (pattern, e))
+        # the share of matching texts in the last batches
+        self.hit_rate = 0.0
+
+    def search(self, values):
+        """
+        :param values: the texts to search. None stands for a missing one,
+                       and other values are converted to strings.
+        :type values: list
+        :return: the match of each text where the expression was found, by
+                 index
+        :rtype: dict
+        """
+        if not values:
+            return {}
+        found = None
+        if self.joined is not None and self.hit_rate <= self.MAX_HIT_RATE:
+            found = self._search_joined(values)
+        if found is None:
+            found = {}
+            search = self.regex.search
+            for index, value in enumerate(values):
+                if value is None:
+                    continue
+                match = search(value if isinstance(value, str)
+                               else str(value))
+                if match is not None:
+                    found[index] = match
+        self.hit_rate = (self.hit_rate + len(found) / len(values)) / 2
+        return found
+
+    def _search_joined(self, values):
+        """
+        :return: see :meth:`search`, or None if the texts can't be joined
+        """
+        try:
+            texts = values
+            joined = '\n'.join(values)
+        except TypeError:
+            texts = ['' if value is None else
+                     value if isinstance(value, str) else str(value)
+                     for value in values]
+            joined = '\n'.join(texts)
+        if joined.count('\n') >= len(texts):
+            # some contain newlines, they can't be told apart
+            return None
+        search = self.joined.search
+        found = {}
+        starts = None
+        position = 0
+        while True:
+            candidate = search(joined, position)
+            if candidate is None:
+                break
+            if starts is None:
+                starts = [0]
+                starts.extend(itertools.accumulate(len(text) + 1
+                                                   for text in texts))
+            # the text where it starts. It may span several texts, so check
+            index = bisect.bisect_right(starts, candidate.start()) - 1
+            match = self.regex.search(texts[index])
+            if match is not None and values[index] is not None:
+                found[index] = match
+            if index + 1 >= len(texts):
+                break
+            position = starts[index + 1]
+        return found
+
+
+class RuleCompiler(object):
+    """
+    Compiles match rules into predicates, called as
+    ``predicate(message, hits)``, where hits is a dict shared by all the
+    predicates evaluated on this message, caching the regex scans.
+
+    The regular expressions of all the rules compiled by a same compiler are
+    merged per field, so use one for all the outputs.
+    """
+    def __init__(self):
+        self.regex_sets = {}
+
+    def compile(self, rule):
+        """
+        :param rule: a match table, as found in the configuration
+        :type rule: dict
+        :rtype: callable
+        :raises: ValueError if the rule is invalid
+        """
+        if not isinstance(rule, dict) or not rule:
+            raise ValueError('a match rule must be a non empty table, got %r'
+                             % (rule,))
+        predicates = []
+        for name, value in rule.items():
+            method = getattr(self, '_compile_' + name, None)
+            if method is None:
+                raise ValueError('unknown match rule %r' % name)
+            predicates.extend(method(value))
+        if len(predicates) == 1:
+            return predicates[0]
+        return self._all(predicates)
+
+    def finish(self):
+        """
+        Merges the regular expressions, once all the rules are compiled.
+        """
+        for regex_set in self.regex_sets.values():
+            regex_set.compile()
+
+    def _all(self, predicates):
+        def match_all(message, hits):
+            for predicate in predicates:
+                if not predicate(message, hits):
+                    return False
+            return True
+        return match_all
+
+    def _compile_all(self, rules):
+        return [self._all([self.compile(rule) for rule in rules])]
+
+    def _compile_any(self, rules):
+        predicates = [self.compile(rule) for rule in rules]
+
+        def match_any(message, hits):
+            for predicate in predicates:
+                if predicate(message, hits):
+                    return True
+            return False
+        return [match_any]
+
+    def _compile_not(self, rule):
+        predicate = self.compile(rule)
+
+        def match_not(message, hits):
+            return not predicate(message, hits)
+        return [match_not]
+
+    def _compile_severity(self, spec):
+        severities = parse_severities(spec)
+
+        def match_severity(message, hits):
+            return message.get('severity') in severities
+        return [match_severity]
+
+    def _compile_fields(self, fields):
+        predicates = []
+        for field, expected in fields.items():
+            if isinstance(expected, list):
+                predicates.append(self._field_in(field, frozenset(expected)))
+            else:
+                predicates.append(self._field_equals(field, expected))
+        return predicates
+
+    def _field_in(self, field, accepted):
+        def match_field(message, hits):
+            return message.get(field) in accepted
+        return match_field
+
+    def _field_equals(self, field, expected):
+        def match_field(message, hits):
+            return message.get(field) == expected
+        return match_field
+
+    def _compile_regex(self, patterns):
+        if isinstance(patterns, str):
+            patterns = {'message': patterns}
+        predicates = []
+        for field, pattern in patterns.items():
+            regex_set = self.regex_sets.setdefault(field, RegexSet())
+            predicates.append(self._regex(field, regex_set,
+                                          regex_set.add(pattern)))
+        return predicates
+
+    def _regex(self, field, regex_set, index):
+        def match_regex(message, hits):
+            found = hits.get(field)
+            if found is None:
+                value = message.get(field)
+                if value is None:
+                    found = ()
+                else:
+                    found = regex_set.scan(
+                            value if isinstance(value, str) else str(value))
+                hits[field] = found
+            return index in found
+        return match_regex
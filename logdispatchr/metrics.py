@@ -0,0 +1,454 @@
+# -*- coding:utf-8 -*-
+"""
+Counters, gauges and histograms describing the pipeline, exposed in the
+Prometheus text format by :class:`MetricsServer`.
+
+They are cheap enough to be always on: each thread updates its own cell of
+a counter or histogram, without any lock, and the cells are only summed
+when the metrics are scraped. Gauges are usually backed by a function,
+called on scrape, like the size of a queue.
+"""
+
+import os
+import math
+import socket
+import bisect
+import logging
+import threading
+import socketserver
+import http.server
+import urllib.parse
+
+from logdispatchr.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+# in seconds
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1,
+                   2.5, 5, 10)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+
+class _Value(object):
+    """
+    A single time series: a metric, for a given set of label values.
+    """
+    def __init__(self):
+        self.function = None
+
+    def set_function(self, function):
+        """
+        :param function: called on each scrape to get the value, instead of
+                         using the recorded one
+        :type function: callable
+        """
+        self.function = function
+
+
+class CounterValue(_Value):
+    def __init__(self):
+        super().__init__()
+        self.local = threading.local()
+        self.cells = []
+        self.lock = threading.Lock()
+
+    def _cell(self):
+        cell = self.local.cell = [0]
+        with self.lock:
+            self.cells.append(cell)
+        return cell
+
+    def inc(self, amount=1):
+        try:
+            cell = self.local.cell
+        except AttributeError:
+            cell = self._cell()
+        # only this thread ever writes to its cell
+        cell[0] += amount
+
+    def get(self):
+        if self.function is not None:
+            return self.function()
+        with self.lock:
+            return sum(cell[0] for cell in self.cells)
+
+
+class GaugeValue(_Value):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class HistogramValue(_Value):
+    def __init__(self, buckets):
+        super().__init__()
+        self.buckets = buckets
+        self.local = threading.local()
+        self.cells = []
+        self.lock = threading.Lock()
+
+    def _cell(self):
+        # a count per bucket, plus the +Inf one, then the sum
+        cell = self.local.cell = [0] * (len(self.buckets) + 2)
+        with self.lock:
+            self.cells.append(cell)
+        return cell
+
+    def observe(self, value):
+        try:
+            cell = self.local.cell
+        except AttributeError:
+            cell = self._cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def get(self):
+        """
+        :return: the cumulated counts of each bucket, the +Inf one last, and
+                 the sum of the observed values
+        :rtype: tuple
+        """
+        with self.lock:
+            totals = [sum(column) for column in zip(*self.cells)] or \
+                [0] * (len(self.buckets) + 2)
+        counts = []
+        count = 0
+        for n in totals[:-1]:
+            count += n
+            counts.append(count)
+        return counts, totals[-1]
+
+
+class Metric(object):
+    """
+    A family of time series, one per set of label values.
+
+    :param name: the metric name
+    :type name: str
+    :param documentation: what the metric measures
+    :type documentation: str
+    :param labelnames: the names of the labels
+    :type labelnames: tuple
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *labelvalues):
+        """
+        :return: the time series for these label values, created on first
+                 use
+        """
+        value = self.values.get(labelvalues)
+        if value is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError('%s expects the labels %s' % (
+                    self.name, ', '.join(self.labelnames)))
+            with self.lock:
+                value = self.values.setdefault(labelvalues, self._new())
+        return value
+
+    def remove(self, *labelvalues):
+        """
+        Stops exporting the time series for these label values, e.g. once
+        the output they describe is gone.
+        """
+        with self.lock:
+            self.values.pop(labelvalues, None)
+
+    def _new(self):
+        raise NotImplementedError
+
+    def _labels(self, labelvalues, extra=()):
+        pairs = list(zip(self.labelnames, labelvalues)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                                 for name, value in pairs)
+
+    def collect(self):
+        """
+        :return: the exposition of this metric, one line per sample
+        :rtype: list
+        """
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.type)]
+        with self.lock:
+            values = list(self.values.items())
+        for labelvalues, value in values:
+            try:
+                lines.extend(self._samples(labelvalues, value))
+            except Exception:
+                logger.exception('failed to collect %s', self.name)
+        return lines
+
+    def _samples(self, labelvalues, value):
+        return ['%s%s %s' % (self.name, self._labels(labelvalues),
+                             _format_value(value.get()))]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new(self):
+        return CounterValue()
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _new(self):
+        return GaugeValue()
+
+
+class Histogram(Metric):
+    """
+    See :class:`Metric`.
+
+    :param buckets: the upper bounds of the buckets, sorted
+    :type buckets: tuple
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new(self):
+        return HistogramValue(self.buckets)
+
+    def _samples(self, labelvalues, value):
+        counts, total = value.get()
+        lines = []
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            lines.append('%s_bucket%s %d' % (
+                self.name,
+                self._labels(labelvalues, [('le', _format_value(bound))]),
+                count))
+        labels = self._labels(labelvalues)
+        lines.append('%s_sum%s %s' % (self.name, labels, _format_value(total)))
+        lines.append('%s_count%s %d' % (self.name, labels, counts[-1]))
+        return lines
+
+
+class Registry(object):
+    """
+    A collection of metrics, exposed together.
+    """
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames,
+                                       buckets))
+
+    def exposition(self):
+        """
+        :return: all the metrics, in the Prometheus text format
+        :rtype: bytes
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+REGISTRY = Registry()
+
+INPUT_RECEIVED = REGISTRY.counter(
+        'logdispatchr_input_received_messages_total',
+        'Messages received by each input', ('input',))
+INPUT_DROPPED = REGISTRY.counter(
+        'logdispatchr_input_dropped_messages_total',
+        'Messages dropped by each input, because the main queue was full',
+        ('input',))
+MAINQUEUE_DEPTH = REGISTRY.gauge(
+        'logdispatchr_mainqueue_messages',
+        'Messages waiting in the main queue, including the spilled ones')
+SCHEDULER_QUEUE_DEPTH = REGISTRY.gauge(
+        'logdispatchr_scheduler_queue_messages',
+        'Messages waiting in the main queue, for each traffic class',
+        ('class',))
+SCHEDULER_SHED = REGISTRY.counter(
+        'logdispatchr_scheduler_shed_messages_total',
+        'Messages of each traffic class shed because the main queue was full',
+        ('class',))
+DISPATCHED = REGISTRY.counter(
+        'logdispatchr_dispatched_messages_total',
+        'Messages taken from the main queue and routed')
+UNROUTED = REGISTRY.counter(
+        'logdispatchr_unrouted_messages_total',
+        'Messages matching no output')
+STAGE_DROPPED = REGISTRY.counter(
+        'logdispatchr_stage_dropped_messages_total',
+        'Messages dropped or collapsed by each pipeline stage', ('stage',))
+STAGE_ERRORS = REGISTRY.counter(
+        'logdispatchr_stage_errors_total',
+        'Batches passed through unchanged because a pipeline stage failed',
+        ('stage',))
+DISPATCH_ERRORS = REGISTRY.counter(
+        'logdispatchr_dispatch_errors_total',
+        'Batches which failed to be routed to the outputs')
+STAGE_SECONDS = REGISTRY.histogram(
+        'logdispatchr_stage_seconds',
+        'Time taken by each pipeline stage to process a batch', ('stage',))
+OUTPUT_MATCHED = REGISTRY.counter(
+        'logdispatchr_output_matched_messages_total',
+        'Messages matching the filter of each output', ('output',))
+ROUTING_CACHE_HITS = REGISTRY.counter(
+        'logdispatchr_routing_cache_hits_total',
+        'Routing lookups answered from the cache')
+ROUTING_CACHE_MISSES = REGISTRY.counter(
+        'logdispatchr_routing_cache_misses_total',
+        'Routing lookups matching the key against every filter')
+OUTPUT_QUEUE_DEPTH = REGISTRY.gauge(
+        'logdispatchr_output_queue_messages',
+        'Messages waiting in the queue of each output', ('output',))
+OUTPUT_DROPPED = REGISTRY.counter(
+        'logdispatchr_output_dropped_messages_total',
+        'Messages dropped by the overflow policy of each output', ('output',))
+OUTPUT_WRITTEN = REGISTRY.counter(
+        'logdispatchr_output_written_messages_total',
+        'Messages written by each output', ('output',))
+OUTPUT_FAILED = REGISTRY.counter(
+        'logdispatchr_output_failed_messages_total',
+        'Messages each output failed to write', ('output',))
+OUTPUT_WRITE_SECONDS = REGISTRY.histogram(
+        'logdispatchr_output_write_seconds',
+        'Time taken by each output to write a batch', ('output',))
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.exposition()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        """
+        /trace configures tracing from the query string: "every", the
+        sampling rate, and "key", which may be repeated. Without any,
+        tracing is disabled.
+        """
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/trace':
+            self.send_error(404)
+            return
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            TRACER.configure(int(query.get('every', ['0'])[0]),
+                             query.get('key', ()))
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        state = 'enabled' if TRACER.enabled else 'disabled'
+        body = ('tracing %s\n' % state).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('metrics request: ' + format, *args)
+
+
+class _TCPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MetricsServer(object):
+    """
+    Serves the metrics over HTTP, on /metrics, from its own thread. Tracing
+    can also be configured with a POST on /trace, see
+    :mod:`logdispatchr.tracing`.
+
+    :param address: "host:port", or the path of a Unix socket
+    :type address: str
+    :param registry: the metrics to serve
+    :type registry: Registry
+    """
+    def __init__(self, address, registry=REGISTRY):
+        self.address = address
+        if '/' in address:
+            # a previous run may have left its socket behind
+            if os.path.exists(address):
+                os.unlink(address)
+            self.server = _UnixServer(address, _MetricsHandler)
+        else:
+            host, _, port = address.rpartition(':')
+            self.server = _TCPServer((host or 'localhost', int(port)),
+                                     _MetricsHandler)
+        self.server.registry = registry
+        self.thread = None
+
+    @property
+    def server_address(self):
+        return self.server.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        logger.info('serving metrics on %s', self.address)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.server.address_family == socket.AF_UNIX:
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
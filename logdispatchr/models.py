@@ -1,8 +1,135 @@
 # -*- coding:utf-8 -*-
 
+from collections.abc import MutableMapping
 
-class Message(dict):
+_MISSING = object()
+
+
+def decode_text(raw):
+    """
+    Default decoder for the line based inputs: the whole payload is the
+    message.
+    """
+    return {'message': raw.strip().decode('utf-8', 'replace')}
+
+
+class Message(MutableMapping):
     """
     The base message class
+
+    It behaves like a dict, but is much lighter. The key is stored apart
+    from the other fields, so that routing a message never needs them.
+    Messages built with :meth:`from_raw` keep the received bytes, and only
+    decode them into fields when one is first accessed: messages which are
+    only routed, forwarded or dropped never pay for it.
+
+    Messages also cache their rendering by each formatter, see
+    :mod:`logdispatchr.formatters`, and the stages they went through when
+    traced, see :mod:`logdispatchr.tracing`.
+
+    When forwarded between logdispatchr instances, messages are encoded as
+    msgpack maps, strings being sent as str and binary data as bin. A
+    datagram holds one or more concatenated maps. Over TCP, maps are sent in
+    frames: a 4 bytes big endian length, followed by one or more
+    concatenated maps.
     """
-    pass
+    __slots__ = ('_key', '_fields', 'raw', '_decode', '_rendered',
+                 'trace')
+
+    def __init__(self, *args, **kwargs):
+        fields = dict(*args, **kwargs)
+        self._key = fields.pop('key', _MISSING)
+        self._fields = fields
+        self.raw = None
+        self._decode = None
+        self._rendered = None
+        self.trace = None
+
+    @classmethod
+    def from_raw(cls, raw, key, decode=decode_text):
+        """
+        :param raw: the received payload
+        :type raw: bytes
+        :param key: the key of the message
+        :type key: str
+        :param decode: turns raw into a dict of fields, on first access
+        :type decode: callable
+        :rtype: Message
+        """
+        m = cls.__new__(cls)
+        m._key = key
+        m._fields = None
+        m.raw = raw
+        m._decode = decode
+        m._rendered = None
+        m.trace = None
+        return m
+
+    @classmethod
+    def from_fields(cls, fields):
+        """
+        Same as Message(fields), but takes ownership of the fields dict
+        instead of copying it.
+
+        :type fields: dict
+        :rtype: Message
+        """
+        m = cls.__new__(cls)
+        m._key = fields.pop('key', _MISSING)
+        m._fields = fields
+        m.raw = None
+        m._decode = None
+        m._rendered = None
+        m.trace = None
+        return m
+
+    @property
+    def fields(self):
+        """
+        The fields other than the key, decoded on first access.
+
+        :rtype: dict
+        """
+        if self._fields is None:
+            self._fields = self._decode(self.raw)
+        return self._fields
+
+    def __getitem__(self, name):
+        if name == 'key':
+            if self._key is _MISSING:
+                raise KeyError(name)
+            return self._key
+        return self.fields[name]
+
+    def __setitem__(self, name, value):
+        # what the formatters rendered is now outdated
+        self._rendered = None
+        if name == 'key':
+            self._key = value
+        else:
+            self.fields[name] = value
+
+    def __delitem__(self, name):
+        self._rendered = None
+        if name == 'key':
+            if self._key is _MISSING:
+                raise KeyError(name)
+            self._key = _MISSING
+        else:
+            del self.fields[name]
+
+    def __contains__(self, name):
+        if name == 'key':
+            return self._key is not _MISSING
+        return name in self.fields
+
+    def __iter__(self):
+        if self._key is not _MISSING:
+            yield 'key'
+        yield from self.fields
+
+    def __len__(self):
+        return (self._key is not _MISSING) + len(self.fields)
+
+    def __repr__(self):
+        return 'Message(%r)' % dict(self)
@@ -1,6 +1,19 @@
 # -*- coding:utf-8 -*-
 
+import os
+import gzip
+import asyncio
+import time
+import shutil
+import socket
+import fnmatch
 import logging
+import threading
+import collections
+
+from logdispatchr import aggregation, formatters
+from logdispatchr.framing import frame
+from logdispatchr.models import Message
 
 logger = logging.getLogger(__name__)
 
@@ -11,18 +24,36 @@ class BaseOutput(object):
 
     :param filtr: a shell glob based filter for the keys to be parsed
     :type filtr: str
+    :param max_batch_size: the maximum number of messages handed at once to
+                           :meth:`_write_messages`
+    :type max_batch_size: int
+    :param max_batch_latency_ms: how long to wait for a batch to fill up
+                                 before writing it. With the default of 0,
+                                 batches only hold the messages already
+                                 waiting.
+    :type max_batch_latency_ms: int
+
+    The dispatcher routes the messages itself (see
+    :class:`logdispatchr.routing.Router`), and only hands each output the
+    messages matching its filter.
     """
-    def __init__(self, filtr='*'):
+    # the section name in the configuration file, set by the ConfigParser
+    name = None
+    # whether _write_messages may block on IO, in which case the asyncio
+    # engine runs it in an executor
+    blocking = True
+
+    def __init__(self, filtr='*', max_batch_size=256,
+                 max_batch_latency_ms=0):
         self.filtr = filtr
+        self.max_batch_size = max_batch_size
+        self.max_batch_latency_ms = max_batch_latency_ms
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.name)
 
     def _match(self, key):
-        i = 0
-        while i < len(key):
-            if self.filtr[i] == '*':
-                return True
-            if key[i] != self.filtr[i]:
-                return False
-            i = i + 1
+        return fnmatch.fnmatchcase(key, self.filtr)
 
     def accept(self, message):
         """
@@ -33,11 +64,24 @@ class BaseOutput(object):
 
         .. seealso: :doc:`models`
         """
+        if self._accepts(message):
+            self._write_message(message)
+
+    async def accept_async(self, message):
+        """
+        Coroutine counterpart of :meth:`accept`, used by the asyncio engine.
+
+        :param message: A record we wish to send to this output
+        :type message: Message
+        """
+        if self._accepts(message):
+            await self._write_message_async(message)
+
+    def _accepts(self, message):
         if 'key' not in message.keys():
             logger.warning('got message without key! %s, discarding', message)
-            return
-        if self._match(message.get('key')):
-            self._write_message(message)
+            return False
+        return self._match(message.get('key'))
 
     def _write_message(self, message):
         """
@@ -52,6 +96,52 @@ class BaseOutput(object):
         """
         raise NotImplemented
 
+    def _write_messages(self, batch):
+        """
+        Writes several messages at once. This is what the dispatcher calls:
+        outputs able to write in bulk should override it. Defaults to
+        calling :meth:`_write_message` for each message.
+
+        :param batch: the records we wish to send to this output
+        :type batch: list
+        """
+        for message in batch:
+            self._write_message(message)
+
+    async def _write_message_async(self, message):
+        """
+        Async write hook, used by the asyncio engine. Defaults to calling
+        :meth:`_write_message`, which blocks the event loop: outputs doing
+        network or disk IO should override it.
+
+        :param message: A record we wish to send to this output
+        :type message: Message
+        """
+        self._write_message(message)
+
+    async def _write_messages_async(self, batch):
+        """
+        Async counterpart of :meth:`_write_messages`, which it defaults to
+        calling, so that outputs write in bulk with both engines. Outputs
+        setting blocking to True, the default, are run in the loop's
+        executor, outside of the event loop.
+
+        :param batch: the records we wish to send to this output
+        :type batch: list
+        """
+        if self.blocking:
+            await asyncio.get_running_loop().run_in_executor(
+                    None, self._write_messages, batch)
+        else:
+            self._write_messages(batch)
+
+    def close(self):
+        """
+        Called at shutdown, once the last batch has been written. Should be
+        overriden by outputs holding buffers or connections.
+        """
+        pass
+
 
 class ConsolePrinter(BaseOutput):
     """
@@ -61,5 +151,632 @@ class ConsolePrinter(BaseOutput):
     Yeah, you probably don't need it.
     """
     def _write_message(self, message):
-        logger.debug('Writing %s to console', message)
         print(message)
+
+
+class NullOutput(BaseOutput):
+    """
+    Discards the messages, like /dev/null. Useful to silence some keys, or
+    to measure the pipeline without any output cost.
+    """
+    def _write_messages(self, batch):
+        pass
+
+    async def _write_messages_async(self, batch):
+        pass
+
+
+class FileOutput(BaseOutput):
+    """
+    Writes messages to a file, one line each. Lines are kept in a userspace
+    buffer, and written with a single writev call when it is full, after
+    flush_interval_ms, or at shutdown.
+
+    :param path: the file to write to
+    :type path: str
+    :param format: the formatter used to write each message: a name, like
+                   "json", or a template, like "{key}: {message}". See
+                   :func:`logdispatchr.formatters.get_formatter`.
+    :type format: str
+    :param buffer_size: the number of bytes to buffer before writing them
+    :type buffer_size: int
+    :param flush_interval_ms: the maximum time a line stays in the buffer
+    :type flush_interval_ms: int
+    :param rotate_size: if set, rotate the file when it reaches this size,
+                        in bytes
+    :type rotate_size: int
+    :param rotate_interval: if set, rotate the file every rotate_interval
+                            seconds
+    :type rotate_interval: int
+    :param compress: whether to gzip rotated files, in the background
+    :type compress: bool
+    :param fsync: when to fsync the file: "never" (leave it to the kernel),
+                  "batch" (after each write), or a number of milliseconds
+                  between two fsyncs
+    :type fsync: str or int
+    """
+    # a single writev call accepts at most IOV_MAX buffers
+    IOV_MAX = 1024
+
+    def __init__(self, path, format='{message}', buffer_size=1024 * 1024,
+                 flush_interval_ms=1000, rotate_size=None,
+                 rotate_interval=None, compress=False, fsync='never',
+                 **kwargs):
+        super().__init__(**kwargs)
+        if fsync not in ('never', 'batch') and not isinstance(fsync, int):
+            raise ValueError('fsync must be "never", "batch" or a number of '
+                             'milliseconds, got %r' % fsync)
+        self.path = path
+        self.formatter = formatters.get_formatter(format)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.compress = compress
+        self.fsync = fsync
+        self.lock = threading.RLock()
+        self.buffer = []
+        self.buffered = 0
+        self.timer = None
+        self.compressors = []
+        self.last_fsync = time.monotonic()
+        self._open()
+
+    def _open(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                          0o644)
+        self.size = os.fstat(self.fd).st_size
+        self.opened_at = time.time()
+
+    def _write_message(self, message):
+        self._write_messages([message])
+
+    def _write_messages(self, batch):
+        render = self.formatter.render
+        lines = [render(message) + b'\n' for message in batch]
+        with self.lock:
+            self.buffer.extend(lines)
+            self.buffered += sum(map(len, lines))
+            if self.buffered >= self.buffer_size:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """
+        Writes the buffer to the file, rotating it first if needed.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.buffer:
+                return
+            if self._should_rotate():
+                self.rotate()
+            buffer = self.buffer
+            for i in range(0, len(buffer), self.IOV_MAX):
+                self._writev(buffer[i:i + self.IOV_MAX])
+            self.size += self.buffered
+            self.buffer = []
+            self.buffered = 0
+            self._maybe_fsync()
+
+    def _writev(self, buffers):
+        written = os.writev(self.fd, buffers)
+        total = sum(map(len, buffers))
+        while written < total:
+            # short write, write the rest
+            rest = b''.join(buffers)[written:]
+            written += os.write(self.fd, rest)
+
+    def _maybe_fsync(self):
+        if self.fsync == 'never':
+            return
+        now = time.monotonic()
+        if self.fsync == 'batch' or \
+                (now - self.last_fsync) * 1000 >= self.fsync:
+            os.fsync(self.fd)
+            self.last_fsync = now
+
+    def _should_rotate(self):
+        if self.rotate_size is not None and self.size and \
+                self.size + self.buffered > self.rotate_size:
+            return True
+        if self.rotate_interval is not None and \
+                time.time() - self.opened_at >= self.rotate_interval:
+            return True
+        return False
+
+    def rotate(self):
+        """
+        Renames the current file with a timestamp suffix, and opens a new
+        one.
+        """
+        with self.lock:
+            if self.fsync != 'never':
+                os.fsync(self.fd)
+            os.close(self.fd)
+            rotated = '%s.%s' % (self.path, time.strftime('%Y%m%d-%H%M%S'))
+            suffix = 0
+            while os.path.exists(rotated) or \
+                    os.path.exists(rotated + '.gz'):
+                suffix += 1
+                rotated = '%s.%s.%d' % (self.path,
+                                        time.strftime('%Y%m%d-%H%M%S'),
+                                        suffix)
+            os.rename(self.path, rotated)
+            logger.info('rotated %s to %s', self.path, rotated)
+            self._open()
+        if self.compress:
+            self.compressors = [t for t in self.compressors if t.is_alive()]
+            compressor = threading.Thread(target=self._compress,
+                                          args=(rotated,))
+            compressor.start()
+            self.compressors.append(compressor)
+
+    def _compress(self, path):
+        with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.unlink(path)
+
+    def close(self):
+        self.flush()
+        if self.fsync != 'never':
+            os.fsync(self.fd)
+        os.close(self.fd)
+        for compressor in self.compressors:
+            compressor.join()
+
+
+class LogdispatchrUDPOutput(BaseOutput):
+    """
+    Forwards messages to another logdispatchr instance, listening with a
+    :class:`logdispatchr.inputs.LogdispatchrUDPInput`. Messages are packed
+    with the msgpack formatter, as many as fit in a datagram.
+
+    :param host: the host to send the messages to
+    :type host: str
+    :param port: its port
+    :type port: int
+    :param mtu: the maximum size of a datagram. A message larger than that
+                is sent alone.
+    :type mtu: int
+    """
+    def __init__(self, host='localhost', port=5140, mtu=1472, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.mtu = mtu
+        self.formatter = formatters.get_formatter('msgpack')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.connect((host, port))
+
+    def _write_message(self, message):
+        self._write_messages([message])
+
+    def _write_messages(self, batch):
+        render = self.formatter.render
+        datagram = []
+        size = 0
+        for message in batch:
+            data = render(message)
+            if datagram and size + len(data) > self.mtu:
+                self._send(datagram)
+                datagram = []
+                size = 0
+            datagram.append(data)
+            size += len(data)
+        if datagram:
+            self._send(datagram)
+
+    def _send(self, datagram):
+        try:
+            self.socket.send(b''.join(datagram))
+        except OSError as e:
+            logger.error('could not forward %d messages to %s:%s: %s',
+                         len(datagram), self.host, self.port, e)
+
+    def close(self):
+        self.socket.close()
+
+
+class TCPConnection(object):
+    """
+    A long lived connection, with its own sender thread. Frames are
+    appended to a bounded buffer, and written as large chunks by the
+    sender, so that writes are pipelined. When the connection breaks, the
+    sender reconnects with an exponential backoff, and resends the chunk
+    which failed: delivery is at least once.
+
+    :param address: the (host, port) to connect to
+    :type address: tuple
+    :param max_in_flight: the maximum number of bytes waiting to be sent.
+                          Writers block when it is reached.
+    :type max_in_flight: int
+    :param min_delay: the first reconnection delay, in seconds
+    :type min_delay: float
+    :param max_delay: the maximum reconnection delay, in seconds
+    :type max_delay: float
+    :param timeout: the connection and send timeout, in seconds
+    :type timeout: float
+    """
+    def __init__(self, address, max_in_flight=4 * 1024 * 1024,
+                 min_delay=0.1, max_delay=30, timeout=10):
+        self.address = address
+        self.max_in_flight = max_in_flight
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.buffer = bytearray()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.deadline = None
+        self.socket = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def write(self, data):
+        with self.condition:
+            while self.buffer and not self.closed and \
+                    len(self.buffer) + len(data) > self.max_in_flight:
+                self.condition.wait()
+            self.buffer += data
+            self.condition.notify_all()
+
+    def _connect(self):
+        delay = self.min_delay
+        while True:
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                logger.error('giving up connecting to %s:%s, %d bytes lost',
+                             self.address[0], self.address[1],
+                             len(self.buffer))
+                return None
+            try:
+                sock = socket.create_connection(self.address, self.timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                logger.info('connected to %s:%s', *self.address)
+                return sock
+            except OSError as e:
+                logger.warning('could not connect to %s:%s: %s, retrying in '
+                               '%.1fs', self.address[0], self.address[1], e,
+                               delay)
+                with self.condition:
+                    self.condition.wait(delay)
+                delay = min(delay * 2, self.max_delay)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.buffer and not self.closed:
+                    self.condition.wait()
+                if not self.buffer:
+                    break
+                chunk = bytes(self.buffer)
+            if self.socket is None:
+                self.socket = self._connect()
+                if self.socket is None:
+                    break
+            try:
+                self.socket.sendall(chunk)
+            except OSError as e:
+                logger.warning('connection to %s:%s lost: %s',
+                               self.address[0], self.address[1], e)
+                self.socket.close()
+                self.socket = None
+                continue
+            with self.condition:
+                del self.buffer[:len(chunk)]
+                self.condition.notify_all()
+        if self.socket is not None:
+            self.socket.close()
+
+    def close(self, timeout=None):
+        """
+        Sends what is left in the buffer, then closes the connection. Gives
+        up reconnecting after timeout seconds.
+        """
+        with self.condition:
+            self.closed = True
+            if timeout is not None:
+                self.deadline = time.monotonic() + timeout
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+
+class LogdispatchrTCPOutput(BaseOutput):
+    """
+    Streams messages to another logdispatchr instance, listening with a
+    :class:`logdispatchr.inputs.LogdispatchrTCPInput`. Each batch is packed
+    with the msgpack formatter into length prefixed frames, and written to a
+    pool of long lived connections in turn.
+
+    :param host: the host to send the messages to
+    :type host: str
+    :param port: its port
+    :type port: int
+    :param pool_size: the number of connections to use
+    :type pool_size: int
+    :param max_frame_size: frames are cut around this size
+    :type max_frame_size: int
+    :param max_in_flight: the maximum number of bytes waiting to be sent, per
+                          connection. Writes block when it is reached.
+    :type max_in_flight: int
+    :param reconnect_min_delay: the first reconnection delay, in seconds
+    :type reconnect_min_delay: float
+    :param reconnect_max_delay: the maximum reconnection delay, in seconds
+    :type reconnect_max_delay: float
+    """
+    def __init__(self, host='localhost', port=5140, pool_size=2,
+                 max_frame_size=256 * 1024, max_in_flight=4 * 1024 * 1024,
+                 reconnect_min_delay=0.1, reconnect_max_delay=30, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.max_frame_size = max_frame_size
+        self.formatter = formatters.get_formatter('msgpack')
+        self.connections = [
+                TCPConnection((host, port), max_in_flight,
+                              reconnect_min_delay, reconnect_max_delay)
+                for _ in range(pool_size)]
+        self.next_connection = 0
+
+    def _write_message(self, message):
+        self._write_messages([message])
+
+    def _write_messages(self, batch):
+        render = self.formatter.render
+        frames = []
+        payload = []
+        size = 0
+        for message in batch:
+            data = render(message)
+            payload.append(data)
+            size += len(data)
+            if size >= self.max_frame_size:
+                frames.append(frame(b''.join(payload)))
+                payload = []
+                size = 0
+        if payload:
+            frames.append(frame(b''.join(payload)))
+        connection = self.connections[self.next_connection]
+        self.next_connection = (self.next_connection + 1) % \
+            len(self.connections)
+        connection.write(b''.join(frames))
+
+    def close(self):
+        for connection in self.connections:
+            connection.close(timeout=10)
+
+
+class AggregatingOutput(BaseOutput):
+    """
+    Counts the messages instead of shipping them: every slide seconds, it
+    writes to its target output a summary of the last window seconds,
+    orders of magnitude smaller than the messages themselves:
+
+    * a message per key, severity and host seen in the window, with their
+      count,
+    * a message with summary_key as key, holding the total count and the
+      top most frequent message templates (messages with their numbers,
+      addresses and identifiers replaced by ``<*>``).
+
+    Memory is bounded: counts are kept for at most max_groups (key,
+    severity, host) at once, the messages of the others are only counted in
+    the total, as overflow. Templates are counted in a count-min sketch, so
+    their counts are estimates, never too low.
+
+    :param target: the configuration of the output the summaries are
+                   written to, with its class. Summaries are forwarded via
+                   msgpack to another logdispatchr instance with a
+                   :class:`LogdispatchrTCPOutput` or
+                   :class:`LogdispatchrUDPOutput`.
+    :type target: dict
+    :param window: the length of the window summarized, in seconds
+    :type window: float
+    :param slide: how often to write a summary, in seconds. Equal to window
+                  by default (tumbling windows); shorter windows overlap
+                  (sliding windows). Must divide window.
+    :type slide: float
+    :param top: the number of templates in the summaries
+    :type top: int
+    :param summary_key: the key of the template summaries
+    :type summary_key: str
+    :param max_groups: the maximum number of (key, severity, host) counted
+                       in a window
+    :type max_groups: int
+    :param sketch_width: the number of counters per row of the sketch
+    :type sketch_width: int
+    :param sketch_depth: the number of rows of the sketch
+    :type sketch_depth: int
+    """
+    clock = staticmethod(time.monotonic)
+    # only counts, the summaries are written by its own thread
+    blocking = False
+
+    def __init__(self, target, window=60, slide=None, top=10,
+                 summary_key='logdispatchr.summary', max_groups=10000,
+                 sketch_width=2048, sketch_depth=4, **kwargs):
+        super().__init__(**kwargs)
+        slide = slide or window
+        panes = window / slide
+        if panes < 1 or panes != int(panes):
+            raise ValueError('the window (%s) must be a multiple of the '
+                             'slide (%s)' % (window, slide))
+        target = dict(target)
+        if 'class' not in target:
+            raise ValueError('invalid target for the aggregating output: '
+                             'missing "class" attribute')
+        self.target = globals()[target.pop('class')](**target)
+        self.window = window
+        self.slide = slide
+        self.panes = int(panes)
+        self.top = top
+        self.summary_key = summary_key
+        self.max_groups = max_groups
+        self.sketch_size = (sketch_width, sketch_depth)
+        self.lock = threading.Lock()
+        # the summaries built under lock, written to the target under
+        # write_lock once it is released, in order
+        self.pending = []
+        self.write_lock = threading.Lock()
+        # the counts of the whole window, and of each of its panes, the
+        # oldest first: [groups, sketch, total, overflow]
+        self.hitters = aggregation.HeavyHitters(
+                aggregation.CountMinSketch(*self.sketch_size), 4 * top)
+        self.counts = {}
+        self.total = 0
+        self.overflow = 0
+        self.history = collections.deque()
+        self._new_pane()
+        # set by the first message or tick
+        self.pane_end = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _new_pane(self):
+        self.pane = [{}, aggregation.CountMinSketch(*self.sketch_size), 0, 0]
+        self.history.append(self.pane)
+
+    def _write_message(self, message):
+        self._write_messages([message])
+
+    def _write_messages(self, batch):
+        # batches are counted first, so that each distinct group and message
+        # is only looked up once
+        groups = collections.Counter(
+                (m.get('key'), m.get('severity'), m.get('hostname'))
+                for m in batch)
+        texts = collections.Counter(str(m.get('message', '')) for m in batch)
+        templates = collections.Counter()
+        for text, count in texts.items():
+            templates[aggregation.template(text)] += count
+        with self.lock:
+            self._advance(self.clock())
+            counts = self.counts
+            pane = self.pane
+            pane_counts = pane[0]
+            for group, count in groups.items():
+                if group not in counts and len(counts) >= self.max_groups:
+                    pane[3] += count
+                    self.overflow += count
+                else:
+                    counts[group] = counts.get(group, 0) + count
+                    pane_counts[group] = pane_counts.get(group, 0) + count
+            for text, count in templates.items():
+                pane[1].add(text, count)
+                self.hitters.add(text, count)
+            pane[2] += len(batch)
+            self.total += len(batch)
+        self._write_summaries()
+
+    def tick(self):
+        """
+        Writes the summaries of the windows which ended.
+        """
+        with self.lock:
+            self._advance(self.clock())
+        self._write_summaries()
+
+    def _run(self):
+        delay = self.slide
+        while not self.stopped.wait(delay):
+            try:
+                self.tick()
+            except Exception:
+                logger.exception('failed to write the summaries of %s', self)
+            delay = max(self.pane_end - self.clock(), 0.01)
+
+    def _advance(self, now):
+        if self.pane_end is None:
+            self.pane_end = now + self.slide
+        while now >= self.pane_end:
+            self.pending.extend(self.summaries())
+            if now - self.pane_end >= self.window:
+                # nothing came in for a whole window
+                self._reset()
+                self.pane_end = now + self.slide
+                return
+            self._expire()
+            self.pane_end += self.slide
+
+    def _expire(self):
+        if len(self.history) < self.panes:
+            self._new_pane()
+            return
+        if self.panes == 1:
+            self._reset()
+            return
+        groups, sketch, total, overflow = self.history.popleft()
+        counts = self.counts
+        for group, count in groups.items():
+            count = counts[group] - count
+            if count:
+                counts[group] = count
+            else:
+                del counts[group]
+        self.hitters.sketch.merge(sketch, -1)
+        self.hitters.refresh()
+        self.total -= total
+        self.overflow -= overflow
+        self._new_pane()
+
+    def _reset(self):
+        self.counts = {}
+        self.hitters.clear()
+        self.total = 0
+        self.overflow = 0
+        self.history.clear()
+        self._new_pane()
+
+    def summaries(self):
+        """
+        :return: the summaries of the current window
+        :rtype: list
+        """
+        if not self.total:
+            return []
+        end = time.time()
+        summaries = []
+        for (key, severity, hostname), count in self.counts.items():
+            fields = {'key': key, 'count': count, 'window': self.window,
+                      'end': end,
+                      'message': '%d messages in %gs' % (count, self.window)}
+            if severity is not None:
+                fields['severity'] = severity
+            if hostname is not None:
+                fields['hostname'] = hostname
+            summaries.append(Message.from_fields(fields))
+        top = self.hitters.top(self.top)
+        summaries.append(Message.from_fields({
+            'key': self.summary_key, 'count': self.total,
+            'overflow': self.overflow, 'window': self.window, 'end': end,
+            'templates': [[text, count] for text, count in top],
+            'message': '%d messages in %gs, mostly: %s' % (
+                self.total, self.window,
+                '; '.join('%s (%d)' % item for item in top))}))
+        return summaries
+
+    def _write_summaries(self):
+        # the target is written to without holding lock, so that messages
+        # are still counted meanwhile
+        if not self.pending:
+            return
+        with self.write_lock:
+            with self.lock:
+                summaries, self.pending = self.pending, []
+            if summaries:
+                self.target._write_messages(summaries)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        with self.lock:
+            self.pending.extend(self.summaries())
+        self._write_summaries()
+        self.target.close()
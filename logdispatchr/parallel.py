@@ -0,0 +1,261 @@
+# -*- coding:utf-8 -*-
+"""
+Runs the CPU heavy work on the messages in a pool of processes, past the
+GIL: decoding the received payloads (e.g. parsing syslog), filtering them
+with a match rule, and custom transforms.
+
+Batches are cut into chunks, each sent to the pool as a single msgpack
+payload, so the cost of the IPC is shared by all the messages of a chunk.
+Several chunks are in flight at once, and their results are returned in
+order. Messages which were not decoded yet are sent as their received
+bytes, and decoded in the pool.
+
+Transforms are functions taking the fields of a message, key included, as a
+dict, and returning them, modified or not, or None to drop the message.
+They are configured as "module:function" paths, imported by each process of
+the pool. Field values msgpack can't encode are turned into strings.
+"""
+
+import logging
+import collections
+import multiprocessing
+import concurrent.futures
+
+import msgpack
+
+from logdispatchr import metrics
+from logdispatchr.matching import RuleCompiler
+from logdispatchr.models import Message, decode_text
+from logdispatchr.stages import BaseStage, import_path, register
+from logdispatchr.syslog import SyslogFields, parse_syslog
+
+logger = logging.getLogger(__name__)
+
+# the decoders which can run in the pool, sent by index
+DECODERS = (decode_text, parse_syslog)
+DECODER_INDEXES = {decoder: index for index, decoder in enumerate(DECODERS)}
+
+# set in each process of the pool by _init_worker
+_transforms = ()
+_predicate = None
+
+
+def load_transform(path):
+    """
+    :param path: a "module:function" path
+    :type path: str
+    :return: the function
+    :rtype: callable
+    :raises: ValueError if it can't be imported
+    """
+    try:
+        function = import_path(path)
+    except ValueError as e:
+        raise ValueError('invalid transform: %s' % e)
+    if not callable(function):
+        raise ValueError('invalid transform %r: not callable' % path)
+    return function
+
+
+def compile_match(rule):
+    """
+    :param rule: a match rule, see :mod:`logdispatchr.matching`, or None
+    :return: its predicate, or None
+    """
+    if rule is None:
+        return None
+    compiler = RuleCompiler()
+    predicate = compiler.compile(rule)
+    compiler.finish()
+    return predicate
+
+
+def _init_worker(transforms, match):
+    global _transforms, _predicate
+    _transforms = [load_transform(path) for path in transforms]
+    _predicate = compile_match(match)
+
+
+def encode_chunk(messages):
+    """
+    :param messages: the messages to send to the pool
+    :type messages: list
+    :return: their msgpack encoding: [key, raw, decoder index] for the
+             messages not decoded yet, [fields, is syslog] for the others
+    :rtype: bytes
+    """
+    items = []
+    for m in messages:
+        decoder = DECODER_INDEXES.get(m._decode)
+        if m._fields is None and decoder is not None:
+            items.append((m._key, m.raw, decoder))
+        else:
+            items.append(_pack_fields(dict(m), m._fields))
+    return msgpack.packb(items, use_bin_type=True, default=str)
+
+
+def _pack_fields(fields, original):
+    is_syslog = isinstance(original, SyslogFields)
+    if is_syslog:
+        # computed from the timestamp, and not serializable
+        fields.pop('time', None)
+    return (fields, is_syslog)
+
+
+def transform_chunk(data, transforms=None, predicate=None):
+    """
+    Decodes and transforms a chunk encoded by :func:`encode_chunk`. Called in
+    the pool, with the transforms and predicate set up by the initializer.
+
+    :return: the msgpack encoding of the [fields, is syslog] of each
+             message, or None for the dropped ones
+    :rtype: bytes
+    """
+    if transforms is None:
+        transforms, predicate = _transforms, _predicate
+    results = []
+    for item in msgpack.unpackb(data, raw=False):
+        if len(item) == 3:
+            key, raw, decoder = item
+            original = fields = DECODERS[decoder](raw)
+            fields['key'] = key
+        else:
+            fields, is_syslog = item
+            original = SyslogFields(fields) if is_syslog else fields
+            fields = original
+        if predicate is not None and not predicate(fields, {}):
+            results.append(None)
+            continue
+        for transform in transforms:
+            fields = transform(fields)
+            if fields is None:
+                break
+        if fields is None:
+            results.append(None)
+        else:
+            results.append(_pack_fields(dict(fields), original))
+    return msgpack.packb(results, use_bin_type=True, default=str)
+
+
+@register('process_pool')
+class ProcessPoolStage(BaseStage):
+    """
+    A pipeline stage running the decoding, filtering and transforms of the
+    messages in a pool of processes.
+
+    Results are returned as soon as they are ready, in order: a batch may
+    come out of this stage a few batches later, or at the next tick.
+
+    :param processes: the size of the pool, the number of CPUs by default
+    :type processes: int
+    :param chunk_size: the maximum number of messages sent to the pool at
+                       once
+    :type chunk_size: int
+    :param max_pending: the maximum number of chunks in flight, twice the
+                        number of processes by default. Once reached, the
+                        dispatcher waits for the oldest one.
+    :type max_pending: int
+    :param match: a match rule, see :mod:`logdispatchr.matching`: only the
+                  matching messages are kept
+    :type match: dict
+    :param transforms: the "module:function" paths of the transforms, run
+                       in this order
+    :type transforms: list
+    :param start_method: how to start the processes, see
+                         :func:`multiprocessing.get_context`. "forkserver"
+                         by default, as forking the threaded dispatcher is
+                         unsafe.
+    :type start_method: str
+    """
+    name = 'process_pool'
+    tick_interval = 0.05
+
+    def __init__(self, processes=None, chunk_size=256, max_pending=None,
+                 match=None, transforms=(), start_method='forkserver',
+                 name=None):
+        super().__init__(name)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or 2 * self.processes
+        self.transforms = [load_transform(path) for path in transforms]
+        self.predicate = compile_match(match)
+        self.context = multiprocessing.get_context(start_method)
+        self.initargs = (list(transforms), match)
+        self.executor = self._make_executor()
+        # (messages, future) of the chunks in flight, oldest first
+        self.pending = collections.deque()
+        self.failures = 0
+        self.dropped = metrics.STAGE_DROPPED.labels(self.name)
+
+    def _make_executor(self):
+        return concurrent.futures.ProcessPoolExecutor(
+                self.processes, mp_context=self.context,
+                initializer=_init_worker, initargs=self.initargs)
+
+    def _submit(self, chunk):
+        data = encode_chunk(chunk)
+        try:
+            return self.executor.submit(transform_chunk, data)
+        except concurrent.futures.process.BrokenProcessPool:
+            logger.error('the process pool is broken, starting a new one')
+            self.executor = self._make_executor()
+            return self.executor.submit(transform_chunk, data)
+
+    def process(self, batch):
+        for i in range(0, len(batch), self.chunk_size):
+            chunk = batch[i:i + self.chunk_size]
+            self.pending.append((chunk, self._submit(chunk)))
+        return self._collect(len(self.pending) - self.max_pending)
+
+    def tick(self):
+        return self._collect(0)
+
+    def flush(self):
+        out = self._collect(len(self.pending))
+        self.executor.shutdown()
+        return out
+
+    def _collect(self, at_least):
+        """
+        :param at_least: the number of chunks to wait for
+        :type at_least: int
+        :return: the results of the oldest chunks, in order
+        :rtype: list
+        """
+        out = []
+        pending = self.pending
+        while pending and (at_least > 0 or pending[0][1].done()):
+            at_least -= 1
+            chunk, future = pending.popleft()
+            out.extend(self._results(chunk, future))
+        return out
+
+    def _results(self, chunk, future):
+        try:
+            data = future.result()
+        except Exception:
+            # e.g. a transform returned something msgpack can't encode, or
+            # a process of the pool died: do it here instead
+            self.failures += 1
+            logger.exception('failed to transform %d messages in the process '
+                             'pool, transforming them in the dispatcher',
+                             len(chunk))
+            try:
+                data = transform_chunk(encode_chunk(chunk), self.transforms,
+                                       self.predicate)
+            except Exception:
+                logger.exception('failed to transform %d messages, passing '
+                                 'them as is', len(chunk))
+                return chunk
+        out = []
+        for m, result in zip(chunk, msgpack.unpackb(data, raw=False)):
+            if result is None:
+                continue
+            fields, is_syslog = result
+            transformed = Message.from_fields(
+                    SyslogFields(fields) if is_syslog else fields)
+            transformed.trace = m.trace
+            out.append(transformed)
+        if len(out) < len(chunk):
+            self.dropped.inc(len(chunk) - len(out))
+        return out
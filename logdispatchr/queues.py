@@ -0,0 +1,595 @@
+# -*- coding:utf-8 -*-
+
+import os
+import mmap
+import fcntl
+import heapq
+import queue
+import struct
+import logging
+import msgpack
+import threading
+import collections
+
+from logdispatchr.models import Message
+from logdispatchr.routing import Router
+
+logger = logging.getLogger(__name__)
+
+
+class BatchQueue(queue.Queue):
+    """
+    A :class:`queue.Queue` which can also take and hand out several items at
+    once, paying for the lock and the wakeup of the consumer only once per
+    batch instead of once per item.
+    """
+    def put_many(self, items, block=True):
+        """
+        Puts all the items in the queue, in order. When the queue is bounded
+        and block is True, waits for room as needed. Otherwise, the items
+        which don't fit are returned.
+
+        :param items: the items to enqueue
+        :type items: list
+        :return: the items which couldn't be enqueued
+        :rtype: list
+        """
+        i = 0
+        with self.not_full:
+            while i < len(items):
+                if self.maxsize > 0:
+                    room = self.maxsize - self._qsize()
+                    if room <= 0:
+                        if not block:
+                            break
+                        self.not_full.wait()
+                        continue
+                else:
+                    room = len(items) - i
+                for item in items[i:i + room]:
+                    self._put(item)
+                put = min(room, len(items) - i)
+                i += put
+                self.unfinished_tasks += put
+                self.not_empty.notify(put)
+        return items[i:]
+
+    def get_many(self, max_items, block=True, timeout=None):
+        """
+        Gets up to max_items items, waiting for the first one only.
+
+        :param max_items: the maximum number of items to return
+        :type max_items: int
+        :rtype: list
+        :raises: queue.Empty when no item is available in time
+        """
+        with self.not_empty:
+            if not block:
+                if not self._qsize():
+                    raise queue.Empty
+            elif timeout is None:
+                while not self._qsize():
+                    self.not_empty.wait()
+            else:
+                if not self.not_empty.wait_for(self._qsize, timeout):
+                    raise queue.Empty
+            items = []
+            while self._qsize() and len(items) < max_items:
+                items.append(self._get())
+            self.not_full.notify_all()
+            return items
+
+
+class SegmentStore(object):
+    """
+    An append-only, on-disk FIFO of messages. Messages are msgpack-encoded,
+    and written in fixed-size, memory-mapped segment files, each record
+    being prefixed by its length. Segments are deleted once read, and the
+    read position is persisted, so the content survives a restart.
+
+    :param directory: where to store the segments
+    :type directory: str
+    :param budget: the maximum disk usage, in bytes
+    :type budget: int
+    :param segment_size: the size of each segment file, in bytes
+    :type segment_size: int
+    :raises: RuntimeError if another store uses the directory
+
+    A directory is used by a single store at a time: it is locked until the
+    store is closed, or its process exits.
+    """
+    HEADER = struct.Struct('>I')
+    POSITION = struct.Struct('>QQ')
+    # written when the next record doesn't fit in the current segment
+    NEXT_SEGMENT = 0xffffffff
+
+    def __init__(self, directory, budget=1024 ** 3,
+                 segment_size=64 * 1024 ** 2):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max(2, budget // segment_size)
+        os.makedirs(directory, exist_ok=True)
+        self._lock()
+        self.maps = {}
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(directory)
+                               if name.endswith('.seg'))
+        self._open_position()
+        self._recover()
+
+    def _lock(self):
+        self.lock_fd = os.open(os.path.join(self.directory, 'lock'),
+                               os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self.lock_fd)
+            raise RuntimeError('%s is already used by another spilling queue'
+                               % self.directory)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, '%020d.seg' % segment)
+
+    def _map(self, segment, create=False):
+        if segment not in self.maps:
+            # never reuse a segment someone else created
+            fd = os.open(self._segment_path(segment),
+                         os.O_RDWR | (os.O_CREAT | os.O_EXCL if create else 0),
+                         0o600)
+            try:
+                if create:
+                    os.ftruncate(fd, self.segment_size)
+                self.maps[segment] = mmap.mmap(fd, self.segment_size)
+            finally:
+                os.close(fd)
+        return self.maps[segment]
+
+    def _delete(self, segment):
+        mm = self.maps.pop(segment, None)
+        if mm is not None:
+            mm.close()
+        os.unlink(self._segment_path(segment))
+        self.segments.remove(segment)
+
+    def _open_position(self):
+        path = os.path.join(self.directory, 'position')
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < self.POSITION.size:
+                os.ftruncate(fd, self.POSITION.size)
+            self.position = mmap.mmap(fd, self.POSITION.size)
+        finally:
+            os.close(fd)
+
+    def _records(self, segment, offset):
+        """
+        Yields the (offset, length) of the records of a segment, from offset.
+        """
+        mm = self._map(segment)
+        while offset + self.HEADER.size <= self.segment_size:
+            length, = self.HEADER.unpack_from(mm, offset)
+            if length == 0 or length == self.NEXT_SEGMENT:
+                return
+            yield offset, length
+            offset += self.HEADER.size + length
+
+    def _recover(self):
+        self.count = 0
+        self.read_segment, self.read_offset = \
+            self.POSITION.unpack_from(self.position)
+        if self.read_segment not in self.segments:
+            self.read_segment = self.segments[0] if self.segments else 0
+            self.read_offset = 0
+        self.write_offset = None
+        for segment in self.segments:
+            if segment < self.read_segment:
+                continue
+            offset = self.read_offset if segment == self.read_segment else 0
+            end = offset
+            for end, length in self._records(segment, offset):
+                self.count += 1
+                end += self.HEADER.size + length
+            self.write_offset = end
+        if self.count:
+            logger.info('recovered %d spilled messages from %s', self.count,
+                        self.directory)
+        else:
+            self._reset()
+
+    def _reset(self):
+        for segment in list(self.segments):
+            self._delete(segment)
+        self.read_segment = 0
+        self.read_offset = 0
+        self.write_offset = None
+        self._save_position()
+
+    def _save_position(self):
+        self.POSITION.pack_into(self.position, 0, self.read_segment,
+                                self.read_offset)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, message):
+        """
+        :param message: the message to store
+        :type message: Message
+        :return: False if the disk budget is exhausted
+        :rtype: bool
+        """
+        data = msgpack.packb(dict(message), use_bin_type=True)
+        needed = self.HEADER.size + len(data)
+        if needed + self.HEADER.size > self.segment_size:
+            logger.error('message too large to be spilled, dropping it: %s',
+                         message)
+            return True
+        if self.write_offset is None or self.write_offset + needed + \
+                self.HEADER.size > self.segment_size:
+            if len(self.segments) >= self.max_segments:
+                return False
+            if self.write_offset is not None:
+                self.HEADER.pack_into(self._map(self.segments[-1]),
+                                      self.write_offset, self.NEXT_SEGMENT)
+            segment = self.segments[-1] + 1 if self.segments else 0
+            self._map(segment, create=True)
+            self.segments.append(segment)
+            if self.count == 0:
+                self.read_segment = segment
+                self.read_offset = 0
+            self.write_offset = 0
+        mm = self._map(self.segments[-1])
+        self.HEADER.pack_into(mm, self.write_offset, len(data))
+        start = self.write_offset + self.HEADER.size
+        mm[start:start + len(data)] = data
+        self.write_offset = start + len(data)
+        self.count += 1
+        return True
+
+    def pop_many(self, max_messages):
+        """
+        :return: up to max_messages of the oldest stored messages
+        :rtype: list
+        """
+        messages = []
+        while len(messages) < max_messages and self.count:
+            mm = self._map(self.read_segment)
+            length = self.NEXT_SEGMENT
+            if self.read_offset + self.HEADER.size <= self.segment_size:
+                length, = self.HEADER.unpack_from(mm, self.read_offset)
+            if length == 0:
+                logger.error('%d spilled messages are missing from %s',
+                             self.count, self.directory)
+                self.count = 0
+                break
+            if length == self.NEXT_SEGMENT:
+                self._delete(self.read_segment)
+                self.read_segment = self.segments[0]
+                self.read_offset = 0
+                continue
+            start = self.read_offset + self.HEADER.size
+            messages.append(Message.from_fields(
+                    msgpack.unpackb(mm[start:start + length], raw=False)))
+            self.read_offset = start + length
+            self.count -= 1
+        if not self.count:
+            self._reset()
+        else:
+            self._save_position()
+        return messages
+
+    def close(self):
+        for mm in self.maps.values():
+            mm.flush()
+            mm.close()
+        self.maps = {}
+        self.position.close()
+        os.close(self.lock_fd)
+
+
+class SpillingQueue(object):
+    """
+    A :class:`BatchQueue` lookalike, keeping at most maxsize messages in
+    memory. The overflow goes to a :class:`SegmentStore`, and is read back,
+    in order, once the consumer has caught up. Producers only block once the
+    disk budget is exhausted.
+
+    Items which are not messages (like the dispatcher's STOP marker) always
+    stay in memory, and may thus overtake spilled messages, which are kept
+    for the next run.
+
+    :param maxsize: the maximum number of messages kept in memory
+    :type maxsize: int
+    :param store: where to spill the other ones
+    :type store: SegmentStore
+    """
+    def __init__(self, maxsize, store):
+        self.maxsize = maxsize
+        self.store = store
+        self.memory = collections.deque()
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+
+    def _qsize(self):
+        return len(self.memory) + len(self.store)
+
+    def qsize(self):
+        with self.mutex:
+            return self._qsize()
+
+    def empty(self):
+        return not self.qsize()
+
+    def put(self, item, block=True, timeout=None):
+        if self.put_many([item], block):
+            raise queue.Full
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def put_many(self, items, block=True):
+        """
+        Same as :meth:`BatchQueue.put_many`.
+        """
+        i = 0
+        with self.mutex:
+            while i < len(items):
+                item = items[i]
+                if not isinstance(item, Message) or \
+                        (not len(self.store) and
+                         len(self.memory) < self.maxsize):
+                    self.memory.append(item)
+                elif not self.store.append(item):
+                    # the disk budget is exhausted too
+                    if not block:
+                        break
+                    self.not_empty.notify()
+                    self.not_full.wait()
+                    continue
+                i += 1
+            if i:
+                self.not_empty.notify()
+        return items[i:]
+
+    def get(self, block=True, timeout=None):
+        return self.get_many(1, block, timeout)[0]
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_many(self, max_items, block=True, timeout=None):
+        """
+        Same as :meth:`BatchQueue.get_many`.
+        """
+        with self.not_empty:
+            if not block:
+                if not self._qsize():
+                    raise queue.Empty
+            elif not self.not_empty.wait_for(self._qsize, timeout):
+                raise queue.Empty
+            if not self.memory:
+                self.memory.extend(self.store.pop_many(self.maxsize))
+            items = []
+            while self.memory and len(items) < max_items:
+                items.append(self.memory.popleft())
+            self.not_full.notify_all()
+            return items
+
+    def close(self):
+        self.store.close()
+
+
+class TrafficClass(object):
+    """
+    A class of messages of a :class:`WeightedFairQueue`, with its own FIFO.
+
+    :param name: the name of the class
+    :type name: str
+    :param keys: shell glob patterns matching the keys of its messages
+    :type keys: list
+    :param weight: its share of the dequeued messages, relative to the
+                   other classes, when they all have messages waiting
+    :type weight: float
+    :param priority: the classes with the lowest priority are shed first
+                     when the queue is full
+    :type priority: int
+    """
+    def __init__(self, name, keys=(), weight=1, priority=0):
+        if weight <= 0:
+            raise ValueError('the weight of %s must be positive' % name)
+        self.name = name
+        self.keys = list(keys)
+        self.priority = priority
+        # how much the virtual time advances for each of its messages
+        self.cost = 1.0 / weight
+        self.last_tag = 0.0
+        # (finish tag, message)
+        self.messages = collections.deque()
+        self.shed = 0
+
+
+class WeightedFairQueue(object):
+    """
+    A :class:`BatchQueue` lookalike, sorting messages into traffic classes
+    by key, so that a flood of some keys can't starve the others.
+
+    Messages are dequeued by weighted fair queuing: each gets a finish tag,
+    the virtual time plus the inverse of the weight of its class, and the
+    message with the smallest tag goes first. Classes with messages waiting
+    thus share the consumer in proportion to their weights, and a class
+    which had nothing waiting gets its share back at once, without being
+    credited for the time it was idle.
+
+    When the queue is full, a new message makes room by shedding the oldest
+    message of the class with the lowest priority, if lower than its own.
+    Otherwise, it is shed itself, except for the classes of the highest
+    priority, which block the producers like :class:`BatchQueue`.
+
+    Items which are not messages (like the dispatcher's STOP marker) are
+    handed out once every message was.
+
+    :param maxsize: the maximum number of messages, in all the classes
+    :type maxsize: int
+    :param classes: the settings of each traffic class, by name, see
+                    :class:`TrafficClass`. A key matching the patterns of
+                    several classes goes to the first one, and the keys
+                    matching none go to the "default" class, added if
+                    missing.
+    :type classes: dict
+    :param cache_size: the number of keys whose class is remembered
+    :type cache_size: int
+    """
+    def __init__(self, maxsize, classes=None, cache_size=4096):
+        self.maxsize = maxsize
+        self.classes = [TrafficClass(name, **settings)
+                        for name, settings in (classes or {}).items()]
+        self.default = None
+        for traffic_class in self.classes:
+            if traffic_class.name == 'default':
+                self.default = traffic_class
+        if self.default is None:
+            self.default = TrafficClass('default')
+            self.classes.append(self.default)
+        self.router = Router(((pattern, traffic_class)
+                              for traffic_class in self.classes
+                              for pattern in traffic_class.keys), cache_size)
+        self.shedding_order = sorted(self.classes, key=lambda c: c.priority)
+        self.top_priority = self.shedding_order[-1].priority
+        self.size = 0
+        self.control = collections.deque()
+        # (tag of the first message, index, class) of each class with
+        # messages. Entries may be outdated, see _dequeue.
+        self.heap = []
+        self.indexes = {c: index for index, c in enumerate(self.classes)}
+        self.virtual_time = 0.0
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+
+    def _qsize(self):
+        return self.size + len(self.control)
+
+    def qsize(self):
+        with self.mutex:
+            return self._qsize()
+
+    def empty(self):
+        return not self.qsize()
+
+    def class_of(self, message):
+        """
+        :rtype: TrafficClass
+        """
+        classes = self.router.route(message.get('key'))
+        return classes[0] if classes else self.default
+
+    def _enqueue(self, traffic_class, message):
+        tag = max(self.virtual_time, traffic_class.last_tag) + \
+            traffic_class.cost
+        traffic_class.last_tag = tag
+        if not traffic_class.messages:
+            heapq.heappush(self.heap, (tag, self.indexes[traffic_class],
+                                       traffic_class))
+        traffic_class.messages.append((tag, message))
+        self.size += 1
+
+    def _dequeue(self):
+        while True:
+            tag, index, traffic_class = heapq.heappop(self.heap)
+            messages = traffic_class.messages
+            # skip the entries of the messages which were shed
+            if messages and messages[0][0] == tag:
+                break
+        _, message = messages.popleft()
+        if messages:
+            heapq.heappush(self.heap, (messages[0][0], index, traffic_class))
+        self.virtual_time = tag
+        self.size -= 1
+        return message
+
+    def _shed_for(self, traffic_class):
+        """
+        Drops the oldest message of the class with the lowest priority,
+        lower than the one of traffic_class.
+
+        :return: whether a message was dropped
+        :rtype: bool
+        """
+        for victim in self.shedding_order:
+            if victim.priority >= traffic_class.priority:
+                return False
+            messages = victim.messages
+            if messages:
+                messages.popleft()
+                if messages:
+                    heapq.heappush(self.heap, (messages[0][0],
+                                               self.indexes[victim], victim))
+                victim.shed += 1
+                self.size -= 1
+                return True
+        return False
+
+    def put(self, item, block=True, timeout=None):
+        if self.put_many([item], block):
+            raise queue.Full
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def put_many(self, items, block=True):
+        """
+        Same as :meth:`BatchQueue.put_many`, except that the messages shed
+        are not returned.
+        """
+        i = 0
+        with self.mutex:
+            while i < len(items):
+                item = items[i]
+                if not isinstance(item, Message):
+                    self.control.append(item)
+                    i += 1
+                    continue
+                traffic_class = self.class_of(item)
+                if self.size >= self.maxsize and \
+                        not self._shed_for(traffic_class):
+                    if traffic_class.priority < self.top_priority:
+                        traffic_class.shed += 1
+                        i += 1
+                        continue
+                    if not block:
+                        break
+                    self.not_empty.notify()
+                    self.not_full.wait()
+                    continue
+                self._enqueue(traffic_class, item)
+                i += 1
+            if i:
+                self.not_empty.notify()
+        return items[i:]
+
+    def get(self, block=True, timeout=None):
+        return self.get_many(1, block, timeout)[0]
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_many(self, max_items, block=True, timeout=None):
+        """
+        Same as :meth:`BatchQueue.get_many`.
+        """
+        with self.not_empty:
+            if not block:
+                if not self._qsize():
+                    raise queue.Empty
+            elif not self.not_empty.wait_for(self._qsize, timeout):
+                raise queue.Empty
+            items = []
+            while len(items) < max_items:
+                if self.size:
+                    items.append(self._dequeue())
+                elif self.control:
+                    items.append(self.control.popleft())
+                else:
+                    break
+            self.not_full.notify_all()
+            return items
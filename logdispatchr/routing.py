@@ -0,0 +1,90 @@
+# -*- coding:utf-8 -*-
+
+import re
+import fnmatch
+import logging
+import functools
+
+logger = logging.getLogger(__name__)
+
+GLOB_CHARS = re.compile(r'[*?\[]')
+
+
+class Router(object):
+    """
+    Finds the destinations of a message from its key. The shell glob
+    patterns of all the destinations are compiled once, and the result of
+    each lookup is cached, so routing a message usually costs a single dict
+    lookup, whatever the number of outputs.
+
+    Patterns are sorted in three kinds, from the cheapest to the most
+    expensive to match: exact keys, prefixes ("auth.*"), and any other
+    glob, compiled to a regex.
+
+    :param destinations: (pattern, destination) pairs. Destinations are
+                         returned in this order.
+    :type destinations: list
+    :param cache_size: the number of keys to remember
+    :type cache_size: int
+    :param predicates: content based rules, see
+                       :mod:`logdispatchr.matching`: the destinations found
+                       from the key of a message only get it if their
+                       predicate, if any, accepts it
+    :type predicates: dict
+    """
+    def __init__(self, destinations, cache_size=4096, predicates=None):
+        self.destinations = list(destinations)
+        self.predicates = predicates or {}
+        self.exact = {}
+        self.prefixes = []
+        self.globs = []
+        for position, (pattern, destination) in enumerate(self.destinations):
+            entry = (position, destination)
+            if not GLOB_CHARS.search(pattern):
+                self.exact.setdefault(pattern, []).append(entry)
+            elif pattern.endswith('*') and \
+                    not GLOB_CHARS.search(pattern[:-1]):
+                self.prefixes.append((pattern[:-1], entry))
+            else:
+                self.globs.append((re.compile(fnmatch.translate(pattern)),
+                                   entry))
+        self.route = functools.lru_cache(cache_size)(self._route)
+
+    def _route(self, key):
+        """
+        :param key: the key of a message
+        :type key: str
+        :return: the destinations of the messages with this key
+        :rtype: tuple
+        """
+        if key is None:
+            return ()
+        found = list(self.exact.get(key, ()))
+        found.extend(entry for prefix, entry in self.prefixes
+                     if key.startswith(prefix))
+        found.extend(entry for regex, entry in self.globs
+                     if regex.match(key))
+        found.sort(key=lambda entry: entry[0])
+        return tuple(destination for _, destination in found)
+
+    def route_message(self, message):
+        """
+        :param message: the message to route
+        :type message: Message
+        :return: the destinations of this message
+        :rtype: tuple
+        """
+        if 'key' not in message:
+            logger.warning('got message without key! %s, discarding', message)
+            return ()
+        destinations = self.route(message['key'])
+        predicates = self.predicates
+        if not predicates:
+            return destinations
+        hits = {}
+        accepted = []
+        for destination in destinations:
+            predicate = predicates.get(destination)
+            if predicate is None or predicate(message, hits):
+                accepted.append(destination)
+        return tuple(accepted)
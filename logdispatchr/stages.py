@@ -0,0 +1,640 @@
+# -*- coding:utf-8 -*-
+"""
+Pipeline stages run on the messages between the main queue and the
+routing, a batch at a time. Each stage takes the list of messages coming
+from the previous one, and returns the list handed to the next one: it may
+drop, modify, or add messages.
+
+Stages with periodic work (like closing time windows) set a tick_interval:
+their :meth:`BaseStage.tick` is then called about that often, even when no
+message comes in, and :meth:`BaseStage.flush` is called at shutdown.
+
+Stages are found by the name they were registered with, see
+:func:`register`, or by a "module:Class" path, see :func:`make_stage`.
+"""
+
+import re
+import csv
+import json
+import time
+import toml
+import heapq
+import fnmatch
+import logging
+import importlib
+import ipaddress
+import functools
+import collections
+
+from logdispatchr import metrics
+from logdispatchr.matching import BatchRegex, RuleCompiler
+from logdispatchr.models import Message
+from logdispatchr.throttle import LogThrottle
+
+logger = logging.getLogger(__name__)
+
+_stage_classes = {}
+
+
+def register(name):
+    """
+    Class decorator, making a stage available under name.
+
+    :param name: the type to use in the configuration file
+    :type name: str
+    """
+    def decorator(clazz):
+        _stage_classes[name] = clazz
+        return clazz
+    return decorator
+
+
+def import_path(path):
+    """
+    :param path: a "module:name" path
+    :type path: str
+    :return: the object it points to
+    :raises: ValueError if it can't be imported
+    """
+    module_name, sep, name = path.partition(':')
+    try:
+        if not sep:
+            raise ValueError('expected "module:name"')
+        return getattr(importlib.import_module(module_name), name)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise ValueError('invalid path %r: %s' % (path, e))
+
+
+def make_stage(config):
+    """
+    :param config: the settings of the stage, with its type: the name of a
+                   registered stage, or the "module:Class" path of a
+                   :class:`BaseStage` subclass
+    :type config: dict
+    :rtype: BaseStage
+    :raises: ValueError if the type is unknown
+    """
+    config = dict(config)
+    if 'type' not in config:
+        raise ValueError('a pipeline stage needs a type, one of %s'
+                         % ', '.join(sorted(_stage_classes)))
+    kind = config.pop('type')
+    if kind in _stage_classes:
+        clazz = _stage_classes[kind]
+    elif ':' in kind:
+        clazz = import_path(kind)
+    else:
+        raise ValueError('unknown stage type %r, expected a "module:Class" '
+                         'path or one of %s'
+                         % (kind, ', '.join(sorted(_stage_classes))))
+    return clazz(**config)
+
+
+class BaseStage(object):
+    """
+    Base class for the pipeline stages. All of them accept a name, to tell
+    apart several stages of the same type in the metrics and logs.
+
+    :param name: the name of this stage, its type by default
+    :type name: str
+    """
+    # the name of the stage in the metrics and logs
+    name = None
+    # how often tick should be called, in seconds, or None
+    tick_interval = None
+    # replaced in the tests
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, name=None):
+        if name is not None:
+            self.name = name
+
+    def process(self, batch):
+        """
+        :param batch: the messages coming from the previous stage
+        :type batch: list
+        :return: the messages for the next stage
+        :rtype: list
+        """
+        return batch
+
+    def tick(self):
+        """
+        Periodic work.
+
+        :return: new messages for the next stage
+        :rtype: list
+        """
+        return []
+
+    def flush(self):
+        """
+        Called once at shutdown, after the last batch.
+
+        :return: new messages for the next stage
+        :rtype: list
+        """
+        return self.tick()
+
+
+class Pipeline(object):
+    """
+    Runs batches through a chain of stages, calling their tick methods when
+    due, and timing each of them.
+
+    A stage raising an exception doesn't stop the dispatcher: the batch it
+    was given is passed through unchanged to the next stage, and the error
+    is counted, and logged at most once every ERROR_LOG_INTERVAL seconds per
+    stage.
+
+    :param stages: the stages, in order
+    :type stages: list
+    """
+    ERROR_LOG_INTERVAL = 10
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.timers = [metrics.STAGE_SECONDS.labels(stage.name)
+                       for stage in self.stages]
+        self.errors = [metrics.STAGE_ERRORS.labels(stage.name)
+                       for stage in self.stages]
+        self.throttles = [LogThrottle(self.ERROR_LOG_INTERVAL)
+                          for _ in self.stages]
+        intervals = [stage.tick_interval for stage in self.stages
+                     if stage.tick_interval]
+        self.tick_interval = min(intervals) if intervals else None
+        self.next_tick = None
+        if self.tick_interval:
+            self.next_tick = time.monotonic() + self.tick_interval
+
+    def __bool__(self):
+        return bool(self.stages)
+
+    def _call(self, index, method, *args):
+        """
+        Calls a method of a stage, with the messages it was given as
+        arguments, if any.
+
+        :return: what the method returned, or the messages it was given if
+                 it failed
+        :rtype: list
+        """
+        stage = self.stages[index]
+        try:
+            return getattr(stage, method)(*args)
+        except Exception:
+            self.errors[index].inc()
+            suppressed = self.throttles[index].allow()
+            if suppressed is not None:
+                logger.exception('stage %s failed to %s, passing the '
+                                 'messages through (%d errors not logged)',
+                                 stage.name, method, suppressed)
+            return args[0] if args else []
+
+    def _run(self, batch, start=0):
+        for index in range(start, len(self.stages)):
+            if not batch:
+                break
+            began = time.monotonic()
+            batch = self._call(index, 'process', batch)
+            self.timers[index].observe(time.monotonic() - began)
+        return batch
+
+    def process(self, batch):
+        """
+        :param batch: messages from the main queue. May be empty, when
+                      waiting for messages timed out.
+        :type batch: list
+        :return: the messages to route
+        :rtype: list
+        """
+        batch = self._run(batch)
+        if self.next_tick is not None and time.monotonic() >= self.next_tick:
+            self.next_tick = time.monotonic() + self.tick_interval
+            batch = batch + self._collect('tick')
+        return batch
+
+    def flush(self):
+        """
+        :return: whatever the stages still hold, to route before stopping
+        :rtype: list
+        """
+        return self._collect('flush')
+
+    def _collect(self, method):
+        produced = []
+        for index in range(len(self.stages)):
+            messages = self._call(index, method)
+            if messages:
+                produced.extend(self._run(messages, index + 1))
+        return produced
+
+
+@register('dedup')
+class Deduplicator(BaseStage):
+    """
+    Collapses repeated messages, like syslogd: the first copy of a message
+    goes through, and the next identical ones are counted instead, until
+    window seconds have passed. A "last message repeated N times" message is
+    then sent, with the same key, host and severity.
+
+    At most max_entries distinct messages are remembered, in the order their
+    window started: the oldest ones are summarized early when there are
+    more. Messages are identified by a hash of their key and fields.
+
+    :param window: how long to collapse copies of a message, in seconds
+    :type window: float
+    :param fields: the fields which, with the key, identify a message
+    :type fields: list
+    :param max_entries: the maximum number of distinct messages remembered
+    :type max_entries: int
+    """
+    name = 'dedup'
+
+    # copied from the first message into the summaries
+    SUMMARY_FIELDS = ('hostname', 'app_name', 'facility', 'severity')
+
+    def __init__(self, window=10, fields=('hostname', 'app_name', 'message'),
+                 max_entries=10000, name=None):
+        super().__init__(name)
+        self.window = window
+        self.fields = tuple(fields)
+        self.max_entries = max_entries
+        self.tick_interval = min(window, 1)
+        # identity -> [summary fields, copies, end of the window]
+        self.entries = collections.OrderedDict()
+        self.collapsed = metrics.STAGE_DROPPED.labels(self.name)
+
+    def _summary(self, entry):
+        fields = dict(entry[0])
+        fields['message'] = 'last message repeated %d times' % entry[1]
+        fields['repeated'] = entry[1]
+        return Message.from_fields(fields)
+
+    def process(self, batch):
+        now = self.clock()
+        entries = self.entries
+        fields = self.fields
+        out = []
+        collapsed = 0
+        for m in batch:
+            values = (m.get('key'),) + tuple(m.get(field)
+                                             for field in fields)
+            try:
+                identity = hash(values)
+            except TypeError:
+                # lists and tables, e.g. from msgpack forwards
+                identity = hash(repr(values))
+            entry = entries.get(identity)
+            if entry is not None:
+                if now < entry[2]:
+                    entry[1] += 1
+                    collapsed += 1
+                    continue
+                # the window is over, this copy starts a new one
+                del entries[identity]
+                if entry[1]:
+                    out.append(self._summary(entry))
+            summary = {'key': m.get('key')}
+            for field in self.SUMMARY_FIELDS:
+                if field in m:
+                    summary[field] = m[field]
+            entries[identity] = [summary, 0, now + self.window]
+            if len(entries) > self.max_entries:
+                _, oldest = entries.popitem(last=False)
+                if oldest[1]:
+                    out.append(self._summary(oldest))
+            out.append(m)
+        if collapsed:
+            self.collapsed.inc(collapsed)
+        return out
+
+    def tick(self):
+        now = self.clock()
+        entries = self.entries
+        out = []
+        # entries are sorted by the end of their window
+        while entries:
+            identity, entry = next(iter(entries.items()))
+            if entry[2] > now:
+                break
+            del entries[identity]
+            if entry[1]:
+                out.append(self._summary(entry))
+        return out
+
+    def flush(self):
+        out = [self._summary(entry) for entry in self.entries.values()
+               if entry[1]]
+        self.entries.clear()
+        return out
+
+
+@register('rate_limit')
+class RateLimiter(BaseStage):
+    """
+    Limits the rate of messages of each key with a token bucket: a key may
+    send burst messages at once, then rate messages per second. The other
+    messages are dropped, and the keys dropping the most are logged every
+    report_interval seconds.
+
+    Buckets are kept for at most max_keys keys, the least recently used
+    being forgotten first.
+
+    :param rate: the number of messages per second allowed for each key
+    :type rate: float
+    :param burst: the size of the buckets, rate by default
+    :type burst: float
+    :param max_keys: the maximum number of buckets
+    :type max_keys: int
+    :param overrides: other rates for the keys matching shell glob
+                      patterns, as a rate, or a table with rate and burst.
+                      The first matching pattern wins.
+    :type overrides: dict
+    :param report_interval: how often to log the dropped messages, in
+                            seconds
+    :type report_interval: float
+    """
+    name = 'rate_limit'
+
+    def __init__(self, rate, burst=None, max_keys=10000, overrides=None,
+                 report_interval=60, name=None):
+        super().__init__(name)
+        self.rate = rate
+        self.burst = burst or rate
+        self.max_keys = max_keys
+        self.overrides = []
+        for pattern, limit in (overrides or {}).items():
+            if not isinstance(limit, dict):
+                limit = {'rate': limit}
+            self.overrides.append((re.compile(fnmatch.translate(pattern)),
+                                   limit['rate'],
+                                   limit.get('burst', limit['rate'])))
+        self.tick_interval = report_interval
+        # key -> [tokens, last update, rate, burst, dropped]
+        self.buckets = collections.OrderedDict()
+        self.dropped = 0
+        self.dropped_metric = metrics.STAGE_DROPPED.labels(self.name)
+
+    def _new_bucket(self, key, now):
+        rate, burst = self.rate, self.burst
+        for regex, override_rate, override_burst in self.overrides:
+            if regex.match(key or ''):
+                rate, burst = override_rate, override_burst
+                break
+        bucket = self.buckets[key] = [burst, now, rate, burst, 0]
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return bucket
+
+    def process(self, batch):
+        now = self.clock()
+        buckets = self.buckets
+        out = []
+        dropped = 0
+        for m in batch:
+            key = m.get('key')
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = self._new_bucket(key, now)
+            else:
+                buckets.move_to_end(key)
+            tokens = bucket[0] + (now - bucket[1]) * bucket[2]
+            if tokens > bucket[3]:
+                tokens = bucket[3]
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                out.append(m)
+            else:
+                bucket[0] = tokens
+                bucket[4] += 1
+                dropped += 1
+        if dropped:
+            self.dropped += dropped
+            self.dropped_metric.inc(dropped)
+        return out
+
+    def tick(self):
+        if not self.dropped:
+            return []
+        worst = heapq.nlargest(5, ((bucket[4], key) for key, bucket
+                                   in self.buckets.items() if bucket[4]))
+        logger.warning('rate limited %d messages, mostly from %s',
+                       self.dropped, ', '.join('%s (%d)' % (key, count)
+                                               for count, key in worst))
+        for bucket in self.buckets.values():
+            bucket[4] = 0
+        self.dropped = 0
+        return []
+
+
+@register('extract')
+class Extract(BaseStage):
+    """
+    Extracts new fields from a field, with a regular expression: each of its
+    named groups which matched becomes a field. The field is searched in the
+    whole batch at once, see :class:`logdispatchr.matching.BatchRegex`.
+
+    :param regex: a regular expression with named groups
+    :type regex: str
+    :param field: the field to search
+    :type field: str
+    :param overwrite: whether to replace the fields the messages already
+                      have
+    :type overwrite: bool
+    """
+    name = 'extract'
+
+    def __init__(self, regex, field='message', overwrite=False, name=None):
+        super().__init__(name)
+        self.regex = BatchRegex(regex)
+        if not self.regex.regex.groupindex:
+            raise ValueError('%r has no named group to extract' % regex)
+        self.field = field
+        self.overwrite = overwrite
+
+    def process(self, batch):
+        field = self.field
+        overwrite = self.overwrite
+        found = self.regex.search([m.get(field) for m in batch])
+        for index, match in found.items():
+            m = batch[index]
+            for name, value in match.groupdict().items():
+                if value is not None and (overwrite or name not in m):
+                    m[name] = value
+        return batch
+
+
+@register('rename')
+class Rename(BaseStage):
+    """
+    Renames fields.
+
+    :param fields: the new name of each field to rename
+    :type fields: dict
+    """
+    name = 'rename'
+
+    def __init__(self, fields, name=None):
+        super().__init__(name)
+        self.fields = list(fields.items())
+
+    def process(self, batch):
+        fields = self.fields
+        for m in batch:
+            for old, new in fields:
+                if old in m:
+                    m[new] = m.pop(old)
+        return batch
+
+
+@register('enrich')
+class Enrich(BaseStage):
+    """
+    Adds fields to the messages from a lookup table, indexed by the value of
+    one of their fields: for instance, the datacenter and team of each host,
+    or the location of IP networks. Each distinct value is looked up once
+    per batch.
+
+    :param field: the field whose value is looked up
+    :type field: str
+    :param table: the fields to add for each value, as a table of tables
+    :type table: dict
+    :param path: instead of table, a TOML, JSON or CSV file holding it. The
+                 first column of a CSV file holds the values, and the others
+                 the fields to add, named after the header line.
+    :type path: str
+    :param networks: whether the values in the table are IP networks, like
+                     "10.1.0.0/16", matched by the longest prefix containing
+                     the IP address of the messages
+    :type networks: bool
+    :param overwrite: whether to replace the fields the messages already
+                      have
+    :type overwrite: bool
+    :param cache_size: the number of lookups of networks to remember
+    :type cache_size: int
+    """
+    name = 'enrich'
+
+    def __init__(self, field, table=None, path=None, networks=False,
+                 overwrite=False, cache_size=4096, name=None):
+        super().__init__(name)
+        if (table is None) == (path is None):
+            raise ValueError('the enrich stage needs either a table or a path')
+        if path is not None:
+            table = self.load(path)
+        self.field = field
+        self.overwrite = overwrite
+        self.table = table
+        self.prefixes = None
+        if networks:
+            self.table = {}
+            for network, fields in table.items():
+                try:
+                    network = ipaddress.ip_network(network, strict=False)
+                except ValueError as e:
+                    raise ValueError('invalid network in the enrich table: '
+                                     '%s' % e)
+                self.table[network] = fields
+            # the longest ones first
+            self.prefixes = sorted({(n.version, n.prefixlen)
+                                    for n in self.table}, reverse=True)
+            self.lookup = functools.lru_cache(cache_size)(self._lookup_network)
+
+    @staticmethod
+    def load(path):
+        """
+        :param path: a .toml, .json or .csv file
+        :return: the table it holds
+        :rtype: dict
+        """
+        with open(path, newline='') as f:
+            if path.endswith('.csv'):
+                rows = csv.reader(f)
+                header = next(rows)[1:]
+                return {row[0]: dict(zip(header, row[1:])) for row in rows
+                        if row}
+            if path.endswith('.json'):
+                return json.load(f)
+            return toml.load(f)
+
+    def lookup(self, value):
+        return self.table.get(value)
+
+    def _lookup_network(self, value):
+        try:
+            address = ipaddress.ip_address(value)
+        except ValueError:
+            return None
+        for version, prefixlen in self.prefixes:
+            if version == address.version:
+                fields = self.table.get(ipaddress.ip_network(
+                        (address, prefixlen), strict=False))
+                if fields is not None:
+                    return fields
+        return None
+
+    def process(self, batch):
+        field = self.field
+        overwrite = self.overwrite
+        found = {}
+        for m in batch:
+            value = m.get(field)
+            if value is None:
+                continue
+            if value not in found:
+                found[value] = self.lookup(value)
+            fields = found[value]
+            if fields is None:
+                continue
+            for name, new in fields.items():
+                if overwrite or name not in m:
+                    m[name] = new
+        return batch
+
+
+@register('drop')
+class Drop(BaseStage):
+    """
+    Drops the messages matching a rule, and/or a regular expression. The
+    regular expression is searched in the whole batch at once, see
+    :class:`logdispatchr.matching.BatchRegex`. When both are given, both
+    must match.
+
+    :param match: a match rule, see :mod:`logdispatchr.matching`
+    :type match: dict
+    :param regex: a regular expression searched in field
+    :type regex: str
+    :param field: the field searched by regex
+    :type field: str
+    """
+    name = 'drop'
+
+    def __init__(self, match=None, regex=None, field='message', name=None):
+        super().__init__(name)
+        if match is None and regex is None:
+            raise ValueError('the drop stage needs a match rule or a regex')
+        self.predicate = None
+        if match is not None:
+            compiler = RuleCompiler()
+            self.predicate = compiler.compile(match)
+            compiler.finish()
+        self.regex = BatchRegex(regex) if regex is not None else None
+        self.field = field
+        self.dropped = metrics.STAGE_DROPPED.labels(self.name)
+
+    def process(self, batch):
+        if self.regex is not None:
+            found = self.regex.search([m.get(self.field) for m in batch])
+            candidates = [batch[index] for index in sorted(found)]
+        else:
+            candidates = batch
+        if self.predicate is not None:
+            predicate = self.predicate
+            candidates = [m for m in candidates if predicate(m, {})]
+        if not candidates:
+            return batch
+        self.dropped.inc(len(candidates))
+        dropped = set(map(id, candidates))
+        return [m for m in batch if id(m) not in dropped]
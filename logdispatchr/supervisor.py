@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+
+import os
+import time
+import signal
+import logging
+import multiprocessing
+import multiprocessing.connection
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(engine, config_path, index):
+    """
+    Entry point of the worker processes: builds a dispatcher, and runs it.
+    """
+    # the supervisor is in charge of stopping us
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # until the dispatcher handles them
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    app = engine(config_path, worker=index)
+    app.mainloop()
+
+
+class Supervisor(object):
+    """
+    Runs several dispatcher processes, each with its own pipeline, to get
+    past the GIL. The UDP inputs of all the workers bind the same address
+    with SO_REUSEPORT, so the kernel shares the incoming datagrams among
+    them. Dead workers are restarted.
+
+    :param config_path: the configuration file, given to each worker
+    :type config_path: str
+    :param workers: the number of processes to run
+    :type workers: int
+    :param engine: the dispatcher class used by the workers
+    :type engine: type
+    :param restart_delay: the minimum delay between two starts of a same
+                          worker, in seconds, to avoid crash loops
+    :type restart_delay: float
+    """
+    def __init__(self, config_path, workers, engine, restart_delay=1.0):
+        self.config_path = config_path
+        self.workers = workers
+        self.engine = engine
+        self.restart_delay = restart_delay
+        self.processes = [None] * workers
+        self.started_at = [0] * workers
+        self.running = False
+
+    def spawn(self, index):
+        elapsed = time.monotonic() - self.started_at[index]
+        if elapsed < self.restart_delay:
+            time.sleep(self.restart_delay - elapsed)
+        process = multiprocessing.Process(
+                target=run_worker,
+                args=(self.engine, self.config_path, index),
+                name='worker-%d' % index)
+        process.daemon = True
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        logger.info('started worker %d (pid %d)', index, process.pid)
+
+    def start(self):
+        self.running = True
+        for index in range(self.workers):
+            self.spawn(index)
+
+    def check(self, timeout=None):
+        """
+        Waits for at least one worker to die, or for timeout, and restarts
+        the dead ones.
+        """
+        multiprocessing.connection.wait(
+                [p.sentinel for p in self.processes], timeout)
+        for index, process in enumerate(self.processes):
+            if not process.is_alive() and self.running:
+                logger.error('worker %d (pid %d) died with exit code %s, '
+                             'restarting it', index, process.pid,
+                             process.exitcode)
+                self.spawn(index)
+
+    def stop(self, *args):
+        self.running = False
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join()
+
+    def forward(self, signum, frame):
+        """
+        Passes a signal on to every worker.
+        """
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                os.kill(process.pid, signum)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        # toggles tracing
+        signal.signal(signal.SIGUSR1, self.forward)
+        # reloads the configuration
+        signal.signal(signal.SIGHUP, self.forward)
+        self.start()
+        try:
+            while self.running:
+                self.check()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
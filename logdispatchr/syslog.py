@@ -0,0 +1,150 @@
+# -*- coding:utf-8 -*-
+"""
+A single pass syslog parser, understanding both RFC 3164 (BSD) and RFC 5424
+messages. It is meant to be used as a lazy :class:`logdispatchr.models.Message`
+decoder, so it only runs for the messages whose fields are actually used.
+"""
+
+import re
+import datetime
+
+FACILITIES = ('kern', 'user', 'mail', 'daemon', 'auth', 'syslog', 'lpr',
+              'news', 'uucp', 'cron', 'authpriv', 'ftp', 'ntp', 'security',
+              'console', 'solaris-cron', 'local0', 'local1', 'local2',
+              'local3', 'local4', 'local5', 'local6', 'local7')
+
+SEVERITIES = ('emerg', 'alert', 'crit', 'err', 'warning', 'notice', 'info',
+              'debug')
+
+# the severity names, with their numeric level
+SEVERITY_LEVELS = {name: level for level, name in enumerate(SEVERITIES)}
+
+# every valid PRI value, decoded once and for all
+PRIORITIES = tuple({'facility': FACILITIES[pri >> 3],
+                    'severity': SEVERITIES[pri & 7]}
+                   for pri in range(len(FACILITIES) * 8))
+
+MONTHS = {b'Jan': 1, b'Feb': 2, b'Mar': 3, b'Apr': 4, b'May': 5, b'Jun': 6,
+          b'Jul': 7, b'Aug': 8, b'Sep': 9, b'Oct': 10, b'Nov': 11, b'Dec': 12}
+
+BOM = b'\xef\xbb\xbf'
+
+
+def _field(value):
+    if value == b'-':
+        return None
+    return value.decode('utf-8', 'replace')
+
+
+class SyslogFields(dict):
+    """
+    The fields of a parsed syslog message. The "time" field, a
+    :class:`datetime.datetime` parsed from "timestamp", is only computed when
+    first accessed.
+    """
+    def __missing__(self, name):
+        if name != 'time':
+            raise KeyError(name)
+        value = self['time'] = parse_timestamp(self.get('timestamp'))
+        return value
+
+
+def parse_timestamp(timestamp):
+    """
+    :param timestamp: an RFC 5424 or RFC 3164 timestamp
+    :type timestamp: str
+    :return: the parsed timestamp, or None if it is missing or invalid.
+             RFC 3164 timestamps are assumed to be in the current year, and
+             are naive.
+    :rtype: datetime.datetime
+    """
+    if not timestamp:
+        return None
+    try:
+        if timestamp[:1].isdigit():
+            if timestamp.endswith('Z'):
+                timestamp = timestamp[:-1] + '+00:00'
+            return datetime.datetime.fromisoformat(timestamp)
+        month = MONTHS[timestamp[:3].encode()]
+        day = int(timestamp[4:6])
+        hour, minute, second = map(int, timestamp[7:15].split(':'))
+        return datetime.datetime(datetime.date.today().year, month, day,
+                                 hour, minute, second)
+    except (KeyError, ValueError):
+        return None
+
+
+# one or more SD-ELEMENTs, with their quoted and escaped values
+STRUCTURED_DATA = re.compile(
+        rb'(?:\[(?:[^\]"\\]|\\.|"(?:[^"\\]|\\.)*")*\])+')
+
+
+def _split_structured_data(data):
+    """
+    :return: the structured data, and what follows it
+    """
+    match = STRUCTURED_DATA.match(data)
+    if match is None:
+        sd, _, rest = data.partition(b' ')
+        return sd, rest
+    end = match.end()
+    return data[:end], data[end + 1:]
+
+
+def parse_syslog(raw):
+    """
+    Parses a syslog message. Parts which can't be found are left out, and in
+    the worst case, the whole payload ends up in the "message" field.
+
+    :param raw: the received payload
+    :type raw: bytes
+    :return: the facility and severity names, and, depending on the
+             format, the timestamp, hostname, app_name, procid, msgid,
+             structured_data and message
+    :rtype: SyslogFields
+    """
+    data = raw.rstrip(b'\r\n\0')
+    fields = SyslogFields()
+    pos = 0
+    if data[:1] == b'<':
+        end = data.find(b'>', 1, 5)
+        # int() would also take signs, spaces and underscores
+        if end > 1 and data[1:end].isdigit():
+            pri = int(data[1:end])
+            if pri < len(PRIORITIES):
+                fields.update(PRIORITIES[pri])
+                pos = end + 1
+    if data[pos:pos + 2] == b'1 ':
+        # RFC 5424
+        parts = data[pos + 2:].split(b' ', 5)
+        if len(parts) == 6:
+            (timestamp, hostname, app_name, procid, msgid, rest) = parts
+            sd, msg = _split_structured_data(rest)
+            fields['timestamp'] = _field(timestamp)
+            fields['hostname'] = _field(hostname)
+            fields['app_name'] = _field(app_name)
+            fields['procid'] = _field(procid)
+            fields['msgid'] = _field(msgid)
+            fields['structured_data'] = _field(sd)
+            if msg.startswith(BOM):
+                msg = msg[3:]
+            fields['message'] = msg.decode('utf-8', 'replace')
+            return fields
+    elif data[pos:pos + 3] in MONTHS and data[pos + 15:pos + 16] == b' ':
+        # RFC 3164
+        fields['timestamp'] = data[pos:pos + 15].decode('ascii', 'replace')
+        hostname, _, rest = data[pos + 16:].partition(b' ')
+        fields['hostname'] = hostname.decode('utf-8', 'replace')
+        tag, sep, msg = rest.partition(b': ')
+        if sep and b' ' not in tag:
+            app_name, _, procid = tag.partition(b'[')
+            fields['app_name'] = app_name.decode('utf-8', 'replace')
+            if procid:
+                fields['procid'] = procid.rstrip(b']').decode('utf-8',
+                                                              'replace')
+            fields['message'] = msg.decode('utf-8', 'replace')
+        else:
+            fields['message'] = rest.decode('utf-8', 'replace')
+        return fields
+    fields['message'] = data[pos:].decode('utf-8', 'replace')
+    return fields
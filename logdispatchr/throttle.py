@@ -0,0 +1,39 @@
+# -*- coding:utf-8 -*-
+"""
+Rate limiting of log messages, for the errors and warnings which may happen
+for every message or batch: logging each of them would make an overload
+worse.
+"""
+
+import time
+
+
+class LogThrottle(object):
+    """
+    Lets a log message through at most once every interval seconds, and
+    counts the others.
+
+    :param interval: the minimum time between two log messages, in seconds
+    :type interval: float
+    """
+    # replaced in the tests
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, interval=10):
+        self.interval = interval
+        self.next_log = None
+        self.suppressed = 0
+
+    def allow(self):
+        """
+        :return: None if the message should not be logged, otherwise the
+                 number of messages suppressed since the last one logged
+        :rtype: int
+        """
+        now = self.clock()
+        if self.next_log is not None and now < self.next_log:
+            self.suppressed += 1
+            return None
+        self.next_log = now + self.interval
+        suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
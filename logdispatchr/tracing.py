@@ -0,0 +1,123 @@
+# -*- coding:utf-8 -*-
+"""
+Follows some messages through the pipeline, logging when each stage saw
+them: one message in every N, and/or the messages whose key matches some
+shell glob patterns.
+
+Tracing can be turned on and off at runtime (see :meth:`Tracer.configure`,
+SIGUSR1 and the /trace endpoint of the metrics server). When it is off, each
+stage only checks :attr:`Tracer.enabled` once per batch, and nothing is
+logged.
+
+Traced messages are logged by the "logdispatchr.trace" logger, at the INFO
+level, once per output they are written to, like::
+
+    trace app.web: received@syslog +0.000ms, dispatched +0.052ms,
+    dequeued@file +0.101ms, written@file +0.734ms
+"""
+
+import re
+import time
+import fnmatch
+import logging
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger('logdispatchr.trace')
+
+
+class Tracer(object):
+    """
+    Decides which messages are traced, and records their stages.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.every = 0
+        self.keys = ()
+        self.key_regex = None
+        self.count = 0
+
+    def configure(self, every=0, keys=()):
+        """
+        Starts tracing the matching messages, or stops tracing if neither
+        every nor keys are given.
+
+        :param every: trace one message in this many, or none if 0
+        :type every: int
+        :param keys: also trace the messages whose key matches one of these
+                     shell glob patterns
+        :type keys: list
+        """
+        self.every = int(every)
+        self.keys = tuple(keys)
+        self.key_regex = re.compile(
+                '|'.join(fnmatch.translate(k) for k in self.keys)) \
+            if self.keys else None
+        self.count = 0
+        self.enabled = bool(self.every or self.keys)
+        if self.enabled:
+            logger.info('tracing one message in %s%s', self.every or 'none',
+                        ', and keys matching %s' % ', '.join(self.keys)
+                        if self.keys else '')
+        else:
+            logger.info('tracing disabled')
+
+    def disable(self):
+        self.configure()
+
+    def start(self, messages, stage):
+        """
+        Picks the messages to trace among newly received ones. Callers
+        should first check :attr:`enabled`.
+
+        :param messages: the messages just received
+        :type messages: list
+        :param stage: where they were received
+        :type stage: str
+        """
+        now = time.monotonic()
+        every = self.every
+        regex = self.key_regex
+        for m in messages:
+            # not thread safe, but we only need a rough one in every
+            self.count += 1
+            if (every and not self.count % every) or \
+                    (regex is not None and
+                     regex.match(m.get('key') or '') is not None):
+                m.trace = [(stage, now)]
+
+    def mark(self, messages, stage):
+        """
+        Records that the traced messages among messages reached stage.
+        """
+        now = time.monotonic()
+        for m in messages:
+            trace = getattr(m, 'trace', None)
+            if trace is not None:
+                trace.append((stage, now))
+
+    def finish(self, messages, stage, started=None):
+        """
+        Logs the stages of the traced messages among messages, ending with
+        stage.
+
+        :param started: if given, when the last stage began, logged as
+                        "dequeued"
+        :type started: float
+        """
+        now = time.monotonic()
+        for m in messages:
+            trace = getattr(m, 'trace', None)
+            if trace is None:
+                continue
+            stages = list(trace)
+            if started is not None:
+                stages.append(('dequeued@' + stage.partition('@')[2],
+                               started))
+            stages.append((stage, now))
+            origin = stages[0][1]
+            trace_logger.info('trace %s: %s', m.get('key'), ', '.join(
+                '%s %+.3fms' % (name, (at - origin) * 1000)
+                for name, at in stages))
+
+
+TRACER = Tracer()
@@ -0,0 +1,284 @@
+# -*- coding:utf-8 -*-
+
+import os
+import time
+import queue
+import logging
+import msgpack
+import threading
+
+from logdispatchr import metrics
+from logdispatchr.models import Message
+from logdispatchr.queues import BatchQueue
+from logdispatchr.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+# the output settings consumed by the worker, not by the output itself
+WORKER_OPTIONS = ('queue_size', 'overflow', 'spill_path')
+
+OVERFLOW_POLICIES = ('block', 'drop-newest', 'drop-oldest', 'spill')
+
+# put in a queue to tell its consumer to flush and exit
+STOP = object()
+
+
+class SpillFile(object):
+    """
+    A naïve append-only on-disk queue, holding msgpack-encoded messages.
+    The file is truncated each time the reader catches up with the writer.
+
+    While a spill file is open, another one for the same path (e.g. for the
+    new generation of an output being reloaded) is suffixed with the first
+    free number instead: ".1", ".2", etc.
+
+    :param path: where to store the spilled messages
+    :type path: str
+    """
+    # the paths of the spill files of this process which are still open
+    _open_paths = set()
+    _open_paths_lock = threading.Lock()
+
+    def __init__(self, path):
+        with self._open_paths_lock:
+            candidate = path
+            generation = 0
+            while candidate in self._open_paths:
+                generation += 1
+                candidate = '%s.%d' % (path, generation)
+            self._open_paths.add(candidate)
+        self.path = candidate
+        self.lock = threading.Lock()
+        self.writer = open(self.path, 'wb')
+        self.reader = open(self.path, 'rb')
+        self.unpacker = msgpack.Unpacker(raw=False)
+        self.pending = 0
+
+    def __len__(self):
+        return self.pending
+
+    def append(self, message):
+        with self.lock:
+            self.writer.write(msgpack.packb(dict(message), use_bin_type=True))
+            self.writer.flush()
+            self.pending += 1
+
+    def pop_many(self, max_messages=1000):
+        """
+        :return: up to max_messages of the oldest spilled messages
+        :rtype: list
+        """
+        messages = []
+        with self.lock:
+            while len(messages) < max_messages and self.pending:
+                for data in self.unpacker:
+                    messages.append(Message.from_fields(data))
+                    self.pending -= 1
+                    if len(messages) >= max_messages:
+                        break
+                else:
+                    data = self.reader.read(1 << 16)
+                    if not data:
+                        # e.g. the file was truncated behind our back
+                        logger.error('%d spilled messages are missing from '
+                                     '%s', self.pending, self.path)
+                        self.pending = 0
+                        break
+                    self.unpacker.feed(data)
+            if not self.pending:
+                # caught up, start over
+                self.writer.seek(0)
+                self.writer.truncate()
+                self.reader.seek(0)
+                self.unpacker = msgpack.Unpacker(raw=False)
+        return messages
+
+    def close(self):
+        self.writer.close()
+        self.reader.close()
+        os.unlink(self.path)
+        with self._open_paths_lock:
+            self._open_paths.discard(self.path)
+
+
+class OutputWorker(object):
+    """
+    Feeds a single output from its own bounded queue and thread, so a slow
+    output only delays itself. Messages are expected to be already routed to
+    this output, and are written in batches according to the output's
+    max_batch_size and max_batch_latency_ms.
+
+    :param output: the output to feed
+    :type output: BaseOutput
+    :param queue_size: how many messages may wait for this output
+    :type queue_size: int
+    :param overflow: what to do with a message when the queue is full. One
+                     of "block" (wait, slowing down the whole dispatcher),
+                     "drop-newest", "drop-oldest", or "spill" (write it to
+                     spill_path, to be replayed later)
+    :type overflow: str
+    :param spill_path: the spill file, mandatory for the "spill" policy
+    :type spill_path: str
+    """
+    def __init__(self, output, queue_size=1000, overflow='block',
+                 spill_path=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('unknown overflow policy %r, expected one of %s'
+                             % (overflow, ', '.join(OVERFLOW_POLICIES)))
+        if overflow == 'spill' and spill_path is None:
+            raise ValueError('the "spill" overflow policy needs a spill_path')
+        self.output = output
+        self.overflow = overflow
+        self.queue = BatchQueue(queue_size)
+        self.spill = SpillFile(spill_path) if overflow == 'spill' else None
+        self.spilling = False
+        self.spill_lock = threading.Lock()
+        self.dropped = 0
+        self.thread = None
+        self.put = getattr(self, '_put_' + overflow.replace('-', '_'))
+        name = output.name
+        self.written = metrics.OUTPUT_WRITTEN.labels(name)
+        self.failed = metrics.OUTPUT_FAILED.labels(name)
+        self.write_seconds = metrics.OUTPUT_WRITE_SECONDS.labels(name)
+        metrics.OUTPUT_QUEUE_DEPTH.labels(name).set_function(self.queue.qsize)
+        metrics.OUTPUT_DROPPED.labels(name).set_function(lambda: self.dropped)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Makes the worker write everything it has left, then close the output.
+        Nothing should be put in the worker afterwards.
+
+        :param timeout: how long to wait for the worker to finish, in seconds
+        :type timeout: float
+        :return: whether it finished in time
+        :rtype: bool
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            # the queue may be full, and the output stuck
+            self.queue.put(STOP, timeout=timeout)
+        except queue.Full:
+            logger.error('%s is stuck, giving up on stopping it', self.output)
+            return False
+        if self.thread is not None:
+            if deadline is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                logger.error('%s did not finish writing in time',
+                             self.output)
+                return False
+        return True
+
+    def _put_block(self, message):
+        self.queue.put(message)
+
+    def _put_drop_newest(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def _put_drop_oldest(self, message):
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _put_spill(self, message):
+        with self.spill_lock:
+            if not self.spilling:
+                try:
+                    self.queue.put_nowait(message)
+                    return
+                except queue.Full:
+                    logger.warning('queue for %s is full, spilling to %s',
+                                   self.output, self.spill.path)
+                    self.spilling = True
+            self.spill.append(message)
+
+    def _unspill(self):
+        """
+        Moves spilled messages back in line, once the queue is empty. New
+        messages keep being spilled until the spill file is drained, to
+        preserve ordering.
+        """
+        messages = self.spill.pop_many()
+        with self.spill_lock:
+            if not len(self.spill):
+                self.spilling = False
+        return messages
+
+    def run(self):
+        while True:
+            if self.spilling and self.queue.empty():
+                self._write(self._unspill())
+                continue
+            batch = self._collect()
+            stop = batch[-1] is STOP
+            if stop:
+                batch.pop()
+            self._write(batch)
+            if stop:
+                break
+        while self.spilling:
+            self._write(self._unspill())
+        if self.spill is not None:
+            self.spill.close()
+        try:
+            self.output.close()
+        except Exception:
+            logger.exception('failed to close %s', self.output)
+
+    def _collect(self):
+        """
+        Waits for a message, then gathers a batch, waiting at most
+        max_batch_latency_ms for it to fill up.
+
+        :rtype: list
+        """
+        max_size = self.output.max_batch_size
+        batch = self.queue.get_many(max_size)
+        latency = self.output.max_batch_latency_ms / 1000
+        if latency <= 0 or len(batch) >= max_size or batch[-1] is STOP:
+            return batch
+        deadline = time.monotonic() + latency
+        while len(batch) < max_size and batch[-1] is not STOP:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.extend(self.queue.get_many(max_size - len(batch),
+                                                 timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        if not batch:
+            return
+        start = time.monotonic()
+        stage = 'written@'
+        try:
+            self.output._write_messages(batch)
+        except Exception:
+            stage = 'failed@'
+            self.failed.inc(len(batch))
+            logger.exception('%s failed to write %d messages',
+                             self.output, len(batch))
+        else:
+            self.written.inc(len(batch))
+        self.write_seconds.observe(time.monotonic() - start)
+        if TRACER.enabled:
+            TRACER.finish(batch, stage + str(self.output.name), start)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from logdispatchr.aggregation import CountMinSketch, HeavyHitters, template
+
+
+class TestTemplate(unittest.TestCase):
+
+    def test_template(self):
+        self.assertEqual(
+            template('session 4f9a2c1e opened from 10.0.0.1:5443 in 0x1f'),
+            'session <*> opened from <*> in <*>')
+        self.assertEqual(template('cache added to face'),
+                         'cache added to face')
+        self.assertEqual(template('x' * 300, max_length=5), 'xxxxx')
+
+
+class TestCountMinSketch(unittest.TestCase):
+
+    def test_estimates(self):
+        sketch = CountMinSketch(width=64, depth=4)
+        for i in range(500):
+            sketch.add('item %d' % (i % 50))
+        sketch.add('frequent', 1000)
+        self.assertGreaterEqual(sketch.estimate('item 3'), 10)
+        self.assertLess(sketch.estimate('item 3'), 100)
+        self.assertGreaterEqual(sketch.estimate('frequent'), 1000)
+
+    def test_merge(self):
+        sketch, other = CountMinSketch(16, 2), CountMinSketch(16, 2)
+        sketch.add('a', 3)
+        other.add('a', 2)
+        sketch.merge(other)
+        self.assertEqual(sketch.estimate('a'), 5)
+        sketch.merge(other, -1)
+        self.assertEqual(sketch.estimate('a'), 3)
+
+
+class TestHeavyHitters(unittest.TestCase):
+
+    def test_top(self):
+        hitters = HeavyHitters(CountMinSketch(), capacity=3)
+        for i in range(100):
+            hitters.add('noise %d' % i)
+            if i % 2:
+                hitters.add('half')
+            if not i % 10:
+                hitters.add('tenth')
+        self.assertEqual(hitters.top(2), [('half', 50), ('tenth', 10)])
+        self.assertLessEqual(len(hitters.candidates), 3)
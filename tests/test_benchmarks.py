@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import io
+import unittest
+import contextlib
+
+from benchmarks import __main__ as runner
+from benchmarks import bench_micro, bench_pipeline, bench_scheduler
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_micro(self):
+        results = bench_micro.run(300)
+        self.assertEqual(set(results), {'BaseOutput._match',
+                                        'Message construction',
+                                        'msgpack decode', 'regex search',
+                                        'AggregatingOutput'})
+        self.assertGreater(results['msgpack decode']['1 per datagram'], 0)
+
+    def test_pipeline(self):
+        results = bench_pipeline.run('msgpack', 1000, idle_timeout=0.2)
+        self.assertLess(results['drop rate'], 1)
+        self.assertGreater(results['p99 latency (ms)'], 0)
+
+    def test_scheduler(self):
+        results = bench_scheduler.run(0.2, loads=(4,))
+        self.assertEqual(set(results), {'fifo, 4x load', 'wfq, 4x load'})
+        self.assertEqual(results['wfq, 4x load']['critical drop rate'], 0)
+        self.assertGreater(results['wfq, 4x load']['debug drop rate'], 0)
+
+    def test_compare(self):
+        before = {'version': '0', 'date': '', 'results': {
+            'pipeline': {'throughput (msgs/s)': 100, 'p99 latency (ms)': 10},
+            'micro': {'match': 100}}}
+        after = {'version': '1', 'date': '', 'results': {
+            'pipeline': {'throughput (msgs/s)': 120, 'p99 latency (ms)': 20},
+            'micro': {'match': 95}}}
+        with contextlib.redirect_stdout(io.StringIO()):
+            regressions = runner.compare(before, after, 0.1)
+        self.assertEqual(regressions, ['pipeline / p99 latency (ms)'])
+
+    def test_compare_zero_baseline(self):
+        before = {'version': '0', 'date': '', 'results': {'scheduler': {
+            'critical drop rate': 0, 'debug drop rate': 0,
+            'p99 critical latency (ms)': None}}}
+        after = {'version': '1', 'date': '', 'results': {'scheduler': {
+            'critical drop rate': 0.2, 'debug drop rate': 0,
+            'p99 critical latency (ms)': 3}}}
+        with contextlib.redirect_stdout(io.StringIO()):
+            regressions = runner.compare(before, after, 0.1)
+        self.assertEqual(regressions, ['scheduler / critical drop rate'])
+        self.assertEqual(runner.without_nan({'a': {'b': float('nan')}}),
+                         {'a': {'b': None}})
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+
+import msgpack
+
+from logdispatchr import formatters
+from logdispatchr.models import Message
+from logdispatchr.syslog import parse_syslog
+
+
+class TestFormatters(unittest.TestCase):
+
+    def test_registry(self):
+        self.assertIs(formatters.get_formatter('json'),
+                      formatters.get_formatter('json'))
+        self.assertIsNone(formatters.get_formatter(None))
+        with self.assertRaises(ValueError):
+            formatters.get_formatter('nope')
+
+    def test_template(self):
+        formatter = formatters.get_formatter('{key}: {message!r:>8}|{x}')
+        m = Message(key='k', message='hi')
+        self.assertEqual(formatter.render(m), b"k:     'hi'|")
+
+    def test_template_fallback(self):
+        formatter = formatters.TemplateFormatter('{tags[0]} {message}')
+        m = Message(key='k', message='hi', tags=['a'])
+        self.assertEqual(formatter.render(m), b'a hi')
+
+    def test_json(self):
+        m = Message(key='k', message='héllo', n=1)
+        data = formatters.get_formatter('json').render(m)
+        self.assertEqual(json.loads(data.decode()), dict(m))
+
+    def test_msgpack(self):
+        m = Message(key='k', raw=b'\x00')
+        data = formatters.get_formatter('msgpack').render(m)
+        self.assertEqual(msgpack.unpackb(data, raw=False), dict(m))
+
+    def test_syslog(self):
+        m = Message.from_raw(b'<34>1 2003-10-11T22:14:15.003Z host su - ID47 '
+                             b'- failed', 'k', parse_syslog)
+        self.assertEqual(formatters.get_formatter('syslog').render(m),
+                         b'<34>1 2003-10-11T22:14:15.003Z host su - ID47 - '
+                         b'failed')
+
+    def test_rendered_once(self):
+        calls = []
+
+        class Counting(formatters.BaseFormatter):
+            def _render(self, message):
+                calls.append(message)
+                return b'x'
+
+        formatter = Counting()
+        m = Message(key='k')
+        formatter.render(m)
+        formatter.render(m)
+        self.assertEqual(len(calls), 1)
+        m['key'] = 'other'
+        formatter.render(m)
+        self.assertEqual(len(calls), 2)
+
+    def test_basic_formater(self):
+        formatter = formatters.BasicFormater('{a}-{b}')
+        self.assertEqual(formatter.format(a=1, b=2), '1-2')
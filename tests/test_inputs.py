@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import asyncio
+import tempfile
+import unittest
+
+from logdispatchr.framing import frame, FrameDecoder
+from logdispatchr.inputs import (BaseInput, UDPSyslogInput,
+                                 LogdispatchrUDPInput, LogdispatchrTCPInput,
+                                 FileTailInput, Checkpoint,
+                                 DatagramInputProtocol)
+from logdispatchr.models import Message
+from logdispatchr.outputs import LogdispatchrUDPOutput, LogdispatchrTCPOutput
+from logdispatchr.queues import BatchQueue
+
+
+class TestBaseInput(unittest.TestCase):
+
+    def test_ignored_formatter(self):
+        # inputs have no use for a formatter: older configuration files
+        # setting one still load
+        _input = BaseInput(key='test', formatter='unknown')
+        self.assertEqual(_input.key, 'test')
+
+
+class TestDatagramInput(unittest.TestCase):
+
+    def test_burst(self):
+        messages = BatchQueue()
+        _input = UDPSyslogInput(host='127.0.0.1', port=0, key='burst',
+                                message_queue=messages,
+                                receive_buffer_size=1 << 20)
+        _input.setup()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for i in range(500):
+            sock.sendto(str(i).encode(), _input.socket.getsockname())
+        sock.close()
+        got = []
+        while len(got) < 500:
+            got.extend(messages.get_many(500, timeout=2))
+        _input.close()
+        self.assertEqual([m['message'] for m in got],
+                         [str(i) for i in range(500)])
+
+    def test_reuse_port(self):
+        first = UDPSyslogInput(host='127.0.0.1', port=0, reuse_port=True)
+        first.setup()
+        second = UDPSyslogInput(host='127.0.0.1',
+                                port=first.socket.getsockname()[1],
+                                reuse_port=True)
+        second.setup()
+        first.close()
+        second.close()
+
+    def test_protocol_drops(self):
+        _input = UDPSyslogInput(key='test.drops',
+                                message_queue=asyncio.Queue(1))
+        protocol = DatagramInputProtocol(_input)
+        before = _input.dropped.get()
+        with self.assertLogs('logdispatchr.inputs', 'WARNING') as logs:
+            for _ in range(3):
+                protocol.datagram_received(b'hello', ('127.0.0.1', 1234))
+        self.assertEqual(_input.dropped.get() - before, 2)
+        self.assertEqual(len(logs.output), 1)
+
+
+class TestLogdispatchrUDP(unittest.TestCase):
+
+    def test_forward(self):
+        messages = BatchQueue()
+        _input = LogdispatchrUDPInput(host='127.0.0.1', port=0,
+                                      message_queue=messages)
+        _input.setup()
+        host, port = _input.socket.getsockname()
+        output = LogdispatchrUDPOutput(host=host, port=port, mtu=200)
+        sent = [Message(key='fwd', message='line %d' % i, raw=b'\xff\x00')
+                for i in range(20)]
+        output._write_messages(sent)
+        output.close()
+        got = []
+        while len(got) < 20:
+            got.extend(messages.get_many(20, timeout=2))
+        _input.close()
+        self.assertEqual(got, sent)
+
+    def test_invalid_datagram(self):
+        _input = LogdispatchrUDPInput()
+        self.assertEqual(_input.make_messages(b'\xc1garbage', ('x', 0)), [])
+
+
+class TestLogdispatchrTCP(unittest.TestCase):
+
+    def test_stream(self):
+        messages = BatchQueue()
+        _input = LogdispatchrTCPInput(host='127.0.0.1', port=0,
+                                      message_queue=messages)
+        _input.setup()
+        host, port = _input.socket.getsockname()
+        output = LogdispatchrTCPOutput(host=host, port=port,
+                                       max_frame_size=100)
+        sent = [Message(key='fwd', message='line %d' % i)
+                for i in range(100)]
+        for i in range(0, 100, 10):
+            output._write_messages(sent[i:i + 10])
+        output.close()
+        got = []
+        while len(got) < 100:
+            got.extend(messages.get_many(100, timeout=2))
+        _input.close()
+        # batches are spread over the pool, each one staying in order
+        self.assertEqual(sorted(got, key=lambda m: int(m['message'][5:])),
+                         sent)
+
+    def test_reconnects(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        output = LogdispatchrTCPOutput(host='127.0.0.1', port=port,
+                                       pool_size=1, reconnect_min_delay=0.05)
+        output._write_messages([Message(key='late', message='hello')])
+        messages = BatchQueue()
+        _input = LogdispatchrTCPInput(host='127.0.0.1', port=port,
+                                      message_queue=messages)
+        _input.setup()
+        got = messages.get_many(1, timeout=5)
+        output.close()
+        _input.close()
+        self.assertEqual(got, [Message(key='late', message='hello')])
+
+
+class TestFrameDecoder(unittest.TestCase):
+
+    def test_partial_frames(self):
+        decoder = FrameDecoder()
+        data = frame(b'hello') + frame(b'') + frame(b'world')
+        self.assertEqual(decoder.feed(data[:7]), [])
+        self.assertEqual(decoder.feed(data[7:]), [b'hello', b'', b'world'])
+
+    def test_too_large(self):
+        with self.assertRaises(ValueError):
+            FrameDecoder(4).feed(frame(b'hello'))
+
+
+class TestFileTailInput(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'app.log')
+        self.checkpoint = os.path.join(self.tmpdir.name, 'app.checkpoint')
+        self.messages = BatchQueue()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def start(self, **kwargs):
+        _input = FileTailInput(path=self.path, key='tail',
+                               checkpoint_path=self.checkpoint,
+                               checkpoint_interval=0, poll_interval=0.1,
+                               message_queue=self.messages, **kwargs)
+        _input.setup()
+        return _input
+
+    def append(self, data, path=None):
+        with open(path or self.path, 'ab') as f:
+            f.write(data)
+
+    def lines(self, count):
+        got = []
+        while len(got) < count:
+            got.extend(self.messages.get_many(count, timeout=2))
+        return [m['message'] for m in got]
+
+    def test_follow_rotate_and_resume(self):
+        self.append(b'old\n')
+        _input = self.start()
+        self.append(b'one\ntw')
+        self.append(b'o\n')
+        self.assertEqual(self.lines(2), ['one', 'two'])
+        os.rename(self.path, self.path + '.1')
+        self.append(b'three\n', self.path + '.1')
+        self.append(b'four\n')
+        self.assertEqual(self.lines(2), ['three', 'four'])
+        _input.close()
+        _input.thread.join()
+        self.append(b'five\n')
+        _input = self.start()
+        self.assertEqual(self.lines(1), ['five'])
+        _input.close()
+        _input.thread.join()
+
+    def test_checkpoint(self):
+        checkpoint = Checkpoint(self.checkpoint)
+        self.assertEqual(checkpoint.load(), {})
+        checkpoint.save(inode=1, offset=2)
+        checkpoint.save(inode=1, offset=3)
+        self.assertEqual(checkpoint.load(), {'inode': 1, 'offset': 3})
+        self.assertEqual(os.listdir(self.tmpdir.name), ['app.checkpoint'])
+
+    def test_truncate(self):
+        self.append(b'one\ntwo\n')
+        _input = self.start(start_at='beginning')
+        self.assertEqual(self.lines(2), ['one', 'two'])
+        with open(self.path, 'wb') as f:
+            f.write(b'x\n')
+        self.assertEqual(self.lines(1), ['x'])
+        _input.close()
+        _input.thread.join()
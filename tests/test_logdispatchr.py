@@ -9,13 +9,35 @@ Tests for `logdispatchr` module.
 """
 
 
+import os
 import sys
+import time
+import signal
+import threading
+import asyncio
+import socket
+import tempfile
 import unittest
 from contextlib import contextmanager
 from click.testing import CliRunner
 
 import logdispatchr
 from logdispatchr import cli
+from logdispatchr.core import LogDispatcher, AsyncLogDispatcher
+from logdispatchr.inputs import BaseInput
+from logdispatchr.models import Message
+from logdispatchr.queues import WeightedFairQueue
+
+
+@contextmanager
+def config_file(content):
+    fd, path = tempfile.mkstemp(suffix='.toml')
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+    try:
+        yield path
+    finally:
+        os.unlink(path)
 
 
 class TestLogdispatchr(unittest.TestCase):
@@ -40,5 +62,268 @@ class TestLogdispatchr(unittest.TestCase):
         pass
 
 
+SYSLOG_CONFIG = ('[inputs.syslog]\n'
+                 'class = "UDPSyslogInput"\n'
+                 'key = "test.syslog"\n'
+                 'host = "127.0.0.1"\n'
+                 'port = 0\n')
+
+
+class LateInput(BaseInput):
+    """
+    Pushes a last batch from its own thread once closed, like an input
+    flushing what it already recieved.
+    """
+    def close(self):
+        def push():
+            time.sleep(0.1)
+            self.messages.put_many([Message(key='test', message='late')])
+        self.thread = threading.Thread(target=push)
+        self.thread.start()
+
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+
+
+class TestLogDispatcher(unittest.TestCase):
+
+    def test_inputs_push_to_mainqueue(self):
+        with config_file(SYSLOG_CONFIG) as path:
+            app = LogDispatcher(path)
+        _input = app.inputs[0]
+        self.assertIs(_input.messages, app.mainqueue)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.sendto(b'hello', _input.socket.getsockname())
+        sock.close()
+        msg = app.mainqueue.get(timeout=2)
+        self.assertEqual(msg['message'], 'hello')
+        self.assertEqual(msg['key'], 'test.syslog')
+        _input.close()
+
+    def test_file_tail_in_first_worker_only(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = ('workers = 2\n[inputs.tail]\nclass = "FileTailInput"\n'
+                      'key = "tail"\npoll_interval = 0.1\npath = "%s"\n'
+                      % os.path.join(tmpdir, 'app.log'))
+            with config_file(config) as path:
+                first = LogDispatcher(path, worker=0)
+                second = LogDispatcher(path, worker=1)
+            self.assertEqual([i.name for i in first.inputs], ['tail'])
+            self.assertEqual(second.inputs, [])
+            first.inputs[0].close()
+            first.inputs[0].join(2)
+
+    def test_shutdown_joins_inputs(self):
+        with config_file('[outputs.out]\nclass = "NullOutput"\n') as path:
+            app = LogDispatcher(path)
+        app.inputs.append(LateInput(message_queue=app.mainqueue))
+        written = []
+        app.outputs[0]._write_messages = written.extend
+        for worker in app.workers:
+            worker.start()
+        app.output_thread = threading.Thread(target=app.write_outputs)
+        app.output_thread.start()
+        app.shutdown(5)
+        self.assertEqual([m['message'] for m in written], ['late'])
+
+    def test_scheduler(self):
+        with config_file(SYSLOG_CONFIG + '[scheduler.classes.syslog]\n'
+                         'keys = ["test.*"]\nweight = 2\n') as path:
+            app = LogDispatcher(path)
+        self.assertIsInstance(app.mainqueue, WeightedFairQueue)
+        self.assertEqual([c.name for c in app.mainqueue.classes],
+                         ['syslog', 'default'])
+        app.inputs[0].close()
+
+    def file_output(self, name, filtr):
+        path = os.path.join(self.tmpdir.name, name + '.log')
+        return ('[outputs.%s]\n'
+                'class = "FileOutput"\n'
+                'filtr = "%s"\n'
+                'path = "%s"\n'
+                'format = "{message}"\n' % (name, filtr, path))
+
+    def read_output(self, name):
+        with open(os.path.join(self.tmpdir.name, name + '.log')) as f:
+            return f.read().split()
+
+    def test_reload(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        path = os.path.join(self.tmpdir.name, 'config.toml')
+        with open(path, 'w') as f:
+            f.write(SYSLOG_CONFIG + self.file_output('kept', 'test.*') +
+                    self.file_output('removed', 'test.*'))
+        app = LogDispatcher(path)
+        _input = app.inputs[0]
+        kept = app.workers[0]
+        for worker in app.workers:
+            worker.start()
+        app._dispatch([Message(key='test.a', message='1')])
+
+        with open(path, 'w') as f:
+            f.write(SYSLOG_CONFIG + self.file_output('kept', 'test.*') +
+                    self.file_output('added', 'test.b'))
+        self.assertTrue(app.reload())
+        self.assertEqual(app.inputs, [_input])
+        self.assertTrue(_input.running)
+        self.assertIs(app.workers[0], kept)
+        self.assertEqual([o.name for o in app.outputs], ['kept', 'added'])
+        # drained and closed
+        self.assertEqual(self.read_output('removed'), ['1'])
+        app._dispatch([Message(key='test.a', message='2'),
+                       Message(key='test.b', message='3')])
+
+        with open(path, 'w') as f:
+            f.write(SYSLOG_CONFIG.replace('test.syslog', 'other') +
+                    self.file_output('kept', 'test.*'))
+        self.assertTrue(app.reload())
+        self.assertFalse(_input.running)
+        self.assertEqual(app.inputs[0].key, 'other')
+        self.assertEqual(self.read_output('added'), ['3'])
+
+        with open(path, 'w') as f:
+            f.write('[outputs.broken]\nclass = "NoSuchOutput"\n')
+        self.assertFalse(app.reload())
+        self.assertEqual([o.name for o in app.outputs], ['kept'])
+
+        app.inputs[0].close()
+        for worker in app.workers:
+            worker.stop(2)
+        self.assertEqual(self.read_output('kept'), ['1', '2', '3'])
+
+    def test_reloads_run_one_at_a_time(self):
+        with config_file(SYSLOG_CONFIG) as path:
+            app = LogDispatcher(path)
+        running = []
+        overlaps = []
+
+        def reload():
+            overlaps.append(len(running))
+            running.append(True)
+            time.sleep(0.1)
+            running.pop()
+
+        app.reload = reload
+        app.start_reload_thread()
+        for _ in range(3):
+            app._reload(signal.SIGHUP, None)
+            time.sleep(0.02)
+        time.sleep(0.3)
+        # the signals received during the first reload are coalesced
+        self.assertEqual(overlaps, [0, 0])
+        app.stopping = True
+        app.reload_requested.set()
+        app.reload_thread.join(1)
+        self.assertFalse(app.reload_thread.is_alive())
+        app.inputs[0].close()
+
+    def test_reload_spilling_output(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        path = os.path.join(self.tmpdir.name, 'config.toml')
+        spill = ('queue_size = 2\noverflow = "spill"\n'
+                 'spill_path = "%s"\n'
+                 % os.path.join(self.tmpdir.name, 'spill'))
+        with open(path, 'w') as f:
+            f.write(SYSLOG_CONFIG + self.file_output('spilled', 'test.*') +
+                    spill)
+        app = LogDispatcher(path)
+        app._dispatch([Message(key='test.a', message=str(i))
+                       for i in range(50)])
+        self.assertEqual(len(app.workers[0].spill), 48)
+        for worker in app.workers:
+            worker.start()
+        # the modified output gets a new worker, and its own spill file
+        with open(path, 'w') as f:
+            f.write(SYSLOG_CONFIG + self.file_output('spilled', 'test.*') +
+                    spill + 'buffer_size = 1\n')
+        self.assertTrue(app.reload())
+        # the old spill file was still open: the new worker spills to the
+        # next generation, and reads its own messages back from it
+        worker = app.workers[0]
+        self.assertEqual(worker.spill.path,
+                         os.path.join(self.tmpdir.name, 'spill.1'))
+        written = threading.Event()
+        write_messages = worker.output._write_messages
+
+        def blocked_write(messages):
+            written.wait(5)
+            write_messages(messages)
+        worker.output._write_messages = blocked_write
+        app._dispatch([Message(key='test.a', message=str(i))
+                       for i in range(50, 100)])
+        self.assertGreaterEqual(len(worker.spill), 46)
+        written.set()
+        app.inputs[0].close()
+        for worker in app.workers:
+            self.assertTrue(worker.stop(5))
+        self.assertEqual(self.read_output('spilled'),
+                         [str(i) for i in range(100)])
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)),
+                         ['config.toml', 'spilled.log'])
+
+
+class TestAsyncLogDispatcher(unittest.TestCase):
+
+    def test_datagram_protocol_input(self):
+        with config_file(SYSLOG_CONFIG) as path:
+            app = AsyncLogDispatcher(path)
+        _input = app.inputs[0]
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.sendto(b'hello', _input.socket.getsockname())
+        sock.close()
+        msg = app.loop.run_until_complete(
+                asyncio.wait_for(app.mainqueue.get(), 2))
+        self.assertEqual(msg['message'], 'hello')
+        self.assertEqual(msg['key'], 'test.syslog')
+        _input.close()
+        app.loop.close()
+
+    def test_failing_output(self):
+        with config_file(SYSLOG_CONFIG +
+                         '[outputs.failing]\nclass = "NullOutput"\n'
+                         '[outputs.working]\nclass = "NullOutput"\n') as path:
+            app = AsyncLogDispatcher(path)
+        failing, working = app.outputs
+        written = []
+
+        async def fail(batch):
+            raise OSError('disk full')
+
+        async def write(batch):
+            written.extend(batch)
+
+        failing._write_messages_async = fail
+        working._write_messages_async = write
+        with self.assertLogs('logdispatchr.core', 'ERROR'):
+            app.loop.run_until_complete(app._write_batch(
+                    [Message(key='test', message='1')]))
+        self.assertEqual([m['message'] for m in written], ['1'])
+        app.inputs[0].close()
+        app.loop.close()
+
+    def test_sigterm_drains(self):
+        with config_file(SYSLOG_CONFIG +
+                         '[outputs.out]\nclass = "NullOutput"\n') as path:
+            app = AsyncLogDispatcher(path)
+        written = []
+
+        async def write(batch):
+            await asyncio.sleep(0.2)
+            written.extend(batch)
+
+        app.outputs[0]._write_messages_async = write
+        app.mainqueue.put_nowait(Message(key='test', message='0'))
+        # received while the first batch is being written
+        app.loop.call_later(0.05, os.kill, os.getpid(), signal.SIGTERM)
+        app.loop.call_later(0.1, app.mainqueue.put_nowait,
+                            Message(key='test', message='1'))
+        app.mainloop()
+        self.assertTrue(app.stopping)
+        self.assertEqual([m['message'] for m in written], ['0', '1'])
+        app.loop.close()
+
+
 if __name__ == '__main__':
     sys.exit(unittest.main())
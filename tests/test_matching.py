@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import re
+import unittest
+
+from logdispatchr.core import ConfigParser
+from logdispatchr.matching import (BatchRegex, RegexSet, RuleCompiler,
+                                   parse_severities)
+from logdispatchr.models import Message
+from logdispatchr.routing import Router
+
+from tests.test_logdispatchr import config_file
+
+
+def message(**fields):
+    fields.setdefault('key', 'app')
+    return Message(**fields)
+
+
+class TestRegexSet(unittest.TestCase):
+
+    PATTERNS = ['error', r'(?i)timeout', r'(\d+) ms', r'(?P<user>root)',
+                r'(a)\1', r'^GET ', 'ms$']
+
+    def test_scan_matches_each_pattern(self):
+        regex_set = RegexSet()
+        for pattern in self.PATTERNS:
+            regex_set.add(pattern)
+        regex_set.compile()
+        for text in ('GET / took 12 ms', 'TIMEOUT for root', 'aa error',
+                     'nothing here', 'error then Timeout then 3 ms', ''):
+            expected = {i for i, pattern in enumerate(self.PATTERNS)
+                        if re.search(pattern, text)}
+            self.assertEqual(regex_set.scan(text), expected, text)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            RegexSet().add('(')
+
+
+class TestBatchRegex(unittest.TestCase):
+
+    def test_search(self):
+        regex = BatchRegex(r'^(?P<code>\d+) ok$')
+        values = ['200 ok', 'x 200 ok', None, '', 404, '500 ok']
+        self.assertEqual({i: m.group('code')
+                          for i, m in regex.search(values).items()},
+                         {0: '200', 5: '500'})
+        self.assertEqual(regex.search([]), {})
+
+    def test_matches_across_values_are_checked(self):
+        self.assertEqual(list(BatchRegex(r'a\sb').search(['a', 'b', 'a b'])),
+                         [2])
+        # values with newlines are searched one by one
+        self.assertEqual(list(BatchRegex(r'b$').search(['a\nb', 'b\na'])),
+                         [0])
+
+
+class TestRules(unittest.TestCase):
+
+    def test_severities(self):
+        self.assertEqual(parse_severities('emerg..crit'),
+                         {'emerg', 'alert', 'crit'})
+        self.assertEqual(parse_severities(['debug', 'warning..err']),
+                         {'debug', 'warning', 'err'})
+        self.assertEqual(parse_severities('info..'), {'info', 'debug'})
+        with self.assertRaises(ValueError):
+            parse_severities('loud')
+
+    def test_combinations(self):
+        compiler = RuleCompiler()
+        rule = compiler.compile({
+            'severity': 'emerg..warning',
+            'any': [{'regex': 'disk'},
+                    {'fields': {'app_name': ['sshd', 'sudo']}}],
+            'not': {'regex': {'hostname': '^test'}}})
+        compiler.finish()
+        cases = (
+            (dict(severity='err', message='disk full'), True),
+            (dict(severity='info', message='disk full'), False),
+            (dict(severity='err', message='oops', app_name='sudo'), True),
+            (dict(severity='err', message='oops', app_name='cron'), False),
+            (dict(severity='err', message='disk', hostname='test1'), False),
+            (dict(message='disk full'), False),
+        )
+        for fields, expected in cases:
+            self.assertIs(rule(message(**fields), {}), expected, fields)
+
+    def test_unknown_rule(self):
+        with self.assertRaises(ValueError):
+            RuleCompiler().compile({'colour': 'blue'})
+
+    def test_router(self):
+        compiler = RuleCompiler()
+        predicates = {'aggregator': compiler.compile({'not': {
+            'severity': 'debug'}})}
+        compiler.finish()
+        router = Router([('*', 'aggregator'), ('app', 'local')],
+                        predicates=predicates)
+        self.assertEqual(router.route_message(message(severity='debug')),
+                         ('local',))
+        self.assertEqual(router.route_message(message(severity='err')),
+                         ('aggregator', 'local'))
+
+    def test_config(self):
+        config = ('[outputs.aggregator]\n'
+                  'class = "NullOutput"\n'
+                  '[outputs.aggregator.match]\n'
+                  'regex = "error"\n'
+                  '[outputs.other]\n'
+                  'class = "NullOutput"\n'
+                  '[outputs.other.match]\n'
+                  'regex = "warn"\n')
+        with config_file(config) as path:
+            parser = ConfigParser(path)
+        outputs = parser.get_declared_outputs()
+        predicates = parser.get_output_match_rules(
+                {output: output.name for output in outputs})
+        self.assertEqual(len(predicates), 2)
+        hits = {}
+        m = message(message='an error')
+        self.assertTrue(predicates[outputs[0]](m, hits))
+        self.assertFalse(predicates[outputs[1]](m, hits))
+        # both regexes were searched in a single scan
+        self.assertEqual(hits, {'message': {0}})
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import socket
+import tempfile
+import threading
+import unittest
+import http.client
+import urllib.request
+
+from logdispatchr import metrics
+from logdispatchr.core import LogDispatcher
+from logdispatchr.workers import STOP
+
+from tests.test_logdispatchr import config_file
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter_per_thread(self):
+        registry = metrics.Registry()
+        counter = registry.counter('test_total', 'Test', ('name',))
+        value = counter.labels('a')
+
+        def work():
+            for i in range(1000):
+                value.inc()
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(value.cells), 4)
+        self.assertIn(b'test_total{name="a"} 4000\n', registry.exposition())
+
+    def test_gauge_function(self):
+        registry = metrics.Registry()
+        registry.gauge('depth', 'Depth').labels().set_function(lambda: 3)
+        self.assertEqual(registry.exposition(),
+                         b'# HELP depth Depth\n# TYPE depth gauge\n'
+                         b'depth 3\n')
+
+    def test_histogram(self):
+        registry = metrics.Registry()
+        histogram = registry.histogram('latency', 'Latency', ('output',),
+                                       buckets=(0.1, 1))
+        value = histogram.labels('x"y')
+        for observed in (0.05, 0.1, 0.5, 2):
+            value.observe(observed)
+        lines = registry.exposition().decode().splitlines()
+        self.assertEqual(lines[2:], [
+            'latency_bucket{output="x\\"y",le="0.1"} 2',
+            'latency_bucket{output="x\\"y",le="1"} 3',
+            'latency_bucket{output="x\\"y",le="+Inf"} 4',
+            'latency_sum{output="x\\"y"} 2.65',
+            'latency_count{output="x\\"y"} 4'])
+
+    def test_labels_checked(self):
+        counter = metrics.Registry().counter('c', 'C', ('a', 'b'))
+        with self.assertRaises(ValueError):
+            counter.labels('a')
+
+    def test_remove(self):
+        gauge = metrics.Registry().gauge('g', 'G', ('output',))
+        gauge.labels('a').set(1)
+        gauge.labels('b').set(2)
+        gauge.remove('a')
+        self.assertEqual(gauge.collect()[2:], ['g{output="b"} 2'])
+
+    def test_server(self):
+        registry = metrics.Registry()
+        registry.counter('hits_total', 'Hits').labels().inc(2)
+        server = metrics.MetricsServer('127.0.0.1:0', registry)
+        server.start()
+        try:
+            url = 'http://127.0.0.1:%d/metrics' % server.server_address[1]
+            with urllib.request.urlopen(url, timeout=5) as response:
+                self.assertEqual(response.headers['Content-Type'],
+                                 metrics.CONTENT_TYPE)
+                self.assertIn(b'hits_total 2', response.read())
+        finally:
+            server.close()
+
+    def test_unix_server(self):
+        registry = metrics.Registry()
+        registry.counter('hits_total', 'Hits').labels().inc()
+        path = os.path.join(tempfile.mkdtemp(), 'metrics.sock')
+        server = metrics.MetricsServer(path, registry)
+        server.start()
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(path)
+            conn = http.client.HTTPConnection('localhost')
+            conn.sock = sock
+            conn.request('GET', '/metrics')
+            self.assertIn(b'hits_total 1', conn.getresponse().read())
+            conn.close()
+        finally:
+            server.close()
+        self.assertFalse(os.path.exists(path))
+        os.rmdir(os.path.dirname(path))
+
+
+class TestPipelineMetrics(unittest.TestCase):
+
+    def test_dispatcher_counts(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = ('[inputs.metrics_in]\n'
+                      'class = "UDPSyslogInput"\n'
+                      'key = "metrics.test"\n'
+                      'host = "127.0.0.1"\n'
+                      'port = 0\n'
+                      '[outputs.metrics_out]\n'
+                      'class = "FileOutput"\n'
+                      'filtr = "metrics.*"\n'
+                      'path = "%s/out.log"\n' % tmpdir)
+            with config_file(config) as path:
+                app = LogDispatcher(path)
+            written = metrics.OUTPUT_WRITTEN.labels('metrics_out').get()
+            received = metrics.INPUT_RECEIVED.labels('metrics_in').get()
+            for worker in app.workers:
+                worker.start()
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            for i in range(3):
+                sock.sendto(b'hello', app.inputs[0].socket.getsockname())
+            sock.close()
+            app.inputs[0].close()
+            deadline = time.monotonic() + 5
+            while app.mainqueue.qsize() < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            app.mainqueue.put(STOP)
+            app.write_outputs()
+            for worker in app.workers:
+                worker.stop(5)
+        self.assertEqual(
+                metrics.INPUT_RECEIVED.labels('metrics_in').get(),
+                received + 3)
+        self.assertEqual(
+                metrics.OUTPUT_WRITTEN.labels('metrics_out').get(),
+                written + 3)
+        exposition = metrics.REGISTRY.exposition()
+        self.assertIn(b'logdispatchr_output_matched_messages_total'
+                      b'{output="metrics_out"}', exposition)
+        self.assertIn(b'logdispatchr_output_write_seconds_count'
+                      b'{output="metrics_out"}', exposition)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from logdispatchr.models import Message
+
+
+class TestMessage(unittest.TestCase):
+
+    def test_dict_like(self):
+        m = Message(key='k', message='hello')
+        self.assertEqual(m['key'], 'k')
+        self.assertIn('key', m)
+        self.assertEqual(dict(m), {'key': 'k', 'message': 'hello'})
+        self.assertEqual(m, Message({'message': 'hello', 'key': 'k'}))
+        self.assertEqual('{key}: {message}'.format(**m), 'k: hello')
+        del m['key']
+        self.assertNotIn('key', m)
+        self.assertIsNone(m.get('key'))
+
+    def test_lazy_decoding(self):
+        calls = []
+
+        def decode(raw):
+            calls.append(raw)
+            return {'message': raw.decode()}
+
+        m = Message.from_raw(b'hello', 'k', decode)
+        self.assertEqual(m['key'], 'k')
+        self.assertIn('key', m)
+        self.assertEqual(calls, [])
+        self.assertEqual(m['message'], 'hello')
+        self.assertEqual(m['message'], 'hello')
+        self.assertEqual(calls, [b'hello'])
+        self.assertEqual(m.raw, b'hello')
+
+    def test_no_dict_per_message(self):
+        self.assertFalse(hasattr(Message(), '__dict__'))
+
+    def test_from_fields(self):
+        fields = {'key': 'k', 'message': 'hello'}
+        m = Message.from_fields(fields)
+        self.assertIs(m.fields, fields)
+        self.assertEqual(m['key'], 'k')
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import glob
+import asyncio
+import tempfile
+import threading
+import unittest
+
+from logdispatchr.models import Message
+from logdispatchr.outputs import AggregatingOutput, BaseOutput, FileOutput
+
+
+class BatchOutput(BaseOutput):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def _write_messages(self, batch):
+        self.batches.append(len(batch))
+
+
+class TestBaseOutput(unittest.TestCase):
+
+    def test_async_writes_in_bulk(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        for blocking in (True, False):
+            output = BatchOutput()
+            output.blocking = blocking
+            loop.run_until_complete(output._write_messages_async(
+                    [Message(key='a', message=str(i)) for i in range(10)]))
+            self.assertEqual(output.batches, [10])
+
+
+class TestFileOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'out.log')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def batch(self, n, start=0):
+        return [Message(key='file', message='line %d' % i)
+                for i in range(start, start + n)]
+
+    def test_buffered_until_flush(self):
+        output = FileOutput(self.path, format='{key} {message}')
+        output._write_messages(self.batch(3))
+        self.assertEqual(os.path.getsize(self.path), 0)
+        output.close()
+        with open(self.path) as f:
+            self.assertEqual(f.read(),
+                             'file line 0\nfile line 1\nfile line 2\n')
+
+    def test_flush_when_buffer_full(self):
+        output = FileOutput(self.path, buffer_size=10, fsync='batch')
+        output._write_messages(self.batch(3))
+        self.assertEqual(os.path.getsize(self.path), 21)
+        output.close()
+
+    def test_rotate_and_compress(self):
+        output = FileOutput(self.path, buffer_size=1, rotate_size=30,
+                            compress=True)
+        for i in range(0, 9, 3):
+            output._write_messages(self.batch(3, i))
+        output.close()
+        rotated = glob.glob(self.path + '.*.gz')
+        self.assertEqual(len(rotated), 2)
+        lines = []
+        for path in rotated:
+            with gzip.open(path, 'rt') as f:
+                lines.extend(f.read().splitlines())
+        with open(self.path) as f:
+            lines.extend(f.read().splitlines())
+        self.assertEqual(sorted(lines), ['line %d' % i for i in range(9)])
+
+    def test_invalid_fsync(self):
+        with self.assertRaises(ValueError):
+            FileOutput(self.path, fsync='sometimes')
+
+
+class Clock(object):
+    now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAggregatingOutput(unittest.TestCase):
+
+    def make_output(self, **kwargs):
+        output = AggregatingOutput({'class': 'NullOutput'}, **kwargs)
+        output.clock = self.clock = Clock()
+        self.summaries = []
+        output.target._write_messages = self.summaries.extend
+        self.addCleanup(output.close)
+        return output
+
+    def write(self, output, key, count, message='took 12ms', **fields):
+        output._write_messages([Message(key=key, message=message, **fields)
+                                for _ in range(count)])
+
+    def counts(self):
+        counts = {(m['key'], m.get('hostname')): m['count']
+                  for m in self.summaries}
+        del self.summaries[:]
+        return counts
+
+    def test_tumbling(self):
+        output = self.make_output(window=10)
+        self.write(output, 'app', 3, hostname='web1')
+        self.write(output, 'app', 2, hostname='web2')
+        self.write(output, 'db', 1)
+        output.tick()
+        self.assertEqual(self.summaries, [])
+        self.clock.now = 10
+        output.tick()
+        self.assertEqual(self.counts(), {
+            ('app', 'web1'): 3, ('app', 'web2'): 2, ('db', None): 1,
+            ('logdispatchr.summary', None): 6})
+        self.write(output, 'db', 4)
+        self.clock.now = 20
+        output.tick()
+        self.assertEqual(self.counts(), {
+            ('db', None): 4, ('logdispatchr.summary', None): 4})
+        # nothing to summarize
+        self.clock.now = 30
+        output.tick()
+        self.assertEqual(self.summaries, [])
+
+    def test_sliding(self):
+        output = self.make_output(window=30, slide=10)
+        for now, count in ((0, 1), (10, 2), (20, 4), (30, 8)):
+            self.clock.now = now
+            self.write(output, 'app', count)
+        self.clock.now = 40
+        output.tick()
+        # the first 10 seconds are out of the window
+        self.assertEqual(self.counts()[('app', None)], 14)
+
+    def test_top_templates(self):
+        output = self.make_output(window=10, top=2)
+        for i in range(50):
+            self.write(output, 'app', 1, 'GET /item/%d 200 in %dms' % (i, i))
+        self.write(output, 'app', 20, 'connection reset by 10.0.0.%d' % 3)
+        self.write(output, 'app', 5, 'cache miss')
+        output.close()
+        summary = self.summaries[-1]
+        self.assertEqual(summary['templates'],
+                         [['GET /item/<*> <*> in <*>ms', 50],
+                          ['connection reset by <*>', 20]])
+
+    def test_max_groups(self):
+        output = self.make_output(window=10, max_groups=2)
+        for host in ('a', 'b', 'c', 'a'):
+            self.write(output, 'app', 1, hostname=host)
+        output.close()
+        summary = self.summaries.pop()
+        self.assertEqual((summary['count'], summary['overflow']), (4, 1))
+        self.assertEqual(self.counts(), {('app', 'a'): 2, ('app', 'b'): 1})
+
+    def test_counts_while_writing(self):
+        output = self.make_output(window=10)
+        writing, written = threading.Event(), threading.Event()
+
+        def write_summaries(summaries):
+            writing.set()
+            written.wait(5)
+            self.summaries.extend(summaries)
+        output.target._write_messages = write_summaries
+        self.write(output, 'app', 1)
+        self.clock.now = 10
+        tick = threading.Thread(target=output.tick)
+        tick.start()
+        # the summaries are being written: messages are still counted
+        self.assertTrue(writing.wait(5))
+        write = threading.Thread(target=self.write, args=(output, 'app', 2))
+        write.start()
+        write.join(1)
+        self.assertFalse(write.is_alive())
+        self.assertEqual(output.total, 2)
+        written.set()
+        tick.join()
+        self.assertEqual(self.counts(), {('app', None): 1,
+                                         ('logdispatchr.summary', None): 1})
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            AggregatingOutput({'class': 'NullOutput'}, window=60, slide=25)
+        with self.assertRaises(ValueError):
+            AggregatingOutput({})
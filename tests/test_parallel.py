@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import msgpack
+
+from logdispatchr.models import Message
+from logdispatchr.parallel import (ProcessPoolStage, encode_chunk,
+                                   load_transform, transform_chunk)
+from logdispatchr.syslog import parse_syslog
+
+
+def upper(fields):
+    fields['message'] = fields['message'].upper()
+    return fields
+
+
+def drop_odd(fields):
+    if int(fields['message']) % 2:
+        return None
+    return fields
+
+
+def message(i):
+    return Message(key='test', message=str(i))
+
+
+class TestTransformChunk(unittest.TestCase):
+
+    def test_raw_syslog_is_parsed(self):
+        raw = Message.from_raw(b'<11>Jan  2 03:04:05 web1 app[7]: hello',
+                               'test', parse_syslog)
+        (fields, is_syslog), (other, _) = msgpack.unpackb(transform_chunk(
+                encode_chunk([raw, message(1)]), [upper], None))
+        self.assertTrue(is_syslog)
+        self.assertEqual((fields['key'], fields['hostname'],
+                          fields['message']), ('test', 'web1', 'HELLO'))
+        self.assertEqual(other, {'key': 'test', 'message': '1'})
+
+    def test_load_transform(self):
+        self.assertIs(load_transform('tests.test_parallel:upper'), upper)
+        for path in ('tests.test_parallel', 'tests.nowhere:upper',
+                     'tests.test_parallel:nothing'):
+            with self.assertRaises(ValueError):
+                load_transform(path)
+
+
+class TestProcessPoolStage(unittest.TestCase):
+
+    def setUp(self):
+        self.stage = ProcessPoolStage(
+                processes=2, chunk_size=10, max_pending=3,
+                transforms=['tests.test_parallel:drop_odd'],
+                match={'not': {'regex': '^1$'}})
+        self.addCleanup(self.stage.executor.shutdown)
+
+    def test_in_order(self):
+        out = []
+        for start in range(0, 100, 25):
+            out.extend(self.stage.process(
+                    [message(i) for i in range(start, start + 25)]))
+        self.assertLessEqual(len(self.stage.pending), 3)
+        out.extend(self.stage.flush())
+        self.assertEqual([m['message'] for m in out],
+                         [str(i) for i in range(0, 100, 2)])
+
+    def test_syslog(self):
+        raw = Message.from_raw(b'<11>Jan  2 03:04:05 web1 app[7]: 2',
+                               'test', parse_syslog)
+        raw.trace = [('received', 0)]
+        m, = self.stage.process([raw, message(1)]) + self.stage.flush()
+        self.assertEqual((m['key'], m['hostname'], m['severity']),
+                         ('test', 'web1', 'err'))
+        # still computed lazily
+        self.assertEqual(m['time'].day, 2)
+        self.assertEqual(m.trace, [('received', 0)])
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import tempfile
+import threading
+import unittest
+
+from logdispatchr.models import Message
+from logdispatchr.queues import (BatchQueue, SegmentStore, SpillingQueue,
+                                 WeightedFairQueue)
+
+
+class TestBatchQueue(unittest.TestCase):
+
+    def test_put_many_get_many(self):
+        q = BatchQueue()
+        self.assertEqual(q.put_many([1, 2, 3]), [])
+        self.assertEqual(q.get_many(2), [1, 2])
+        self.assertEqual(q.get(), 3)
+        with self.assertRaises(queue.Empty):
+            q.get_many(10, block=False)
+
+    def test_put_many_non_blocking_returns_leftovers(self):
+        q = BatchQueue(2)
+        self.assertEqual(q.put_many([1, 2, 3, 4], block=False), [3, 4])
+        self.assertEqual(q.qsize(), 2)
+
+    def test_put_many_blocks_for_room(self):
+        q = BatchQueue(2)
+        t = threading.Thread(target=q.put_many, args=([1, 2, 3, 4, 5],))
+        t.start()
+        got = []
+        while len(got) < 5:
+            got.extend(q.get_many(10, timeout=2))
+        t.join()
+        self.assertEqual(got, [1, 2, 3, 4, 5])
+
+
+class TestSpillingQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_queue(self, maxsize=2, budget=4096):
+        store = SegmentStore(self.tmpdir.name, budget, segment_size=1024)
+        return SpillingQueue(maxsize, store)
+
+    def messages(self, n, start=0):
+        return [Message(key='spill', message='x' * 50 + str(i))
+                for i in range(start, start + n)]
+
+    def test_spills_and_drains_in_order(self):
+        q = self.make_queue()
+        sent = self.messages(40)
+        self.assertEqual(q.put_many(sent), [])
+        self.assertEqual(len(q.memory), 2)
+        self.assertEqual(len(q.store), 38)
+        self.assertGreater(len(q.store.segments), 1)
+        got = []
+        while not q.empty():
+            got.extend(q.get_many(7))
+        self.assertEqual(got, sent)
+        self.assertEqual(q.store.segments, [])
+
+    def test_budget(self):
+        q = self.make_queue(budget=2048)
+        leftovers = q.put_many(self.messages(100), block=False)
+        self.assertTrue(leftovers)
+        self.assertEqual(q.qsize() + len(leftovers), 100)
+
+    def test_stop_marker_stays_in_memory(self):
+        q = self.make_queue()
+        marker = object()
+        q.put_many(self.messages(5) + [marker])
+        self.assertIs(q.memory[-1], marker)
+
+    def test_survives_restart(self):
+        q = self.make_queue()
+        sent = self.messages(30)
+        q.put_many(sent)
+        got = q.get_many(2) + q.get_many(3)
+        q.close()
+        q = self.make_queue()
+        while not q.empty():
+            got.extend(q.get_many(10))
+        self.assertEqual(got, sent)
+
+    def test_directory_locked(self):
+        q = self.make_queue()
+        with self.assertRaises(RuntimeError):
+            self.make_queue()
+        q.close()
+        self.make_queue().close()
+
+
+CLASSES = {
+    'critical': {'keys': ['auth.*'], 'weight': 3, 'priority': 2},
+    'debug': {'keys': ['*.debug'], 'weight': 1, 'priority': 0},
+}
+
+
+def keyed(key, i):
+    return Message(key=key, message=str(i))
+
+
+class TestWeightedFairQueue(unittest.TestCase):
+
+    def test_weights(self):
+        q = WeightedFairQueue(1000, CLASSES)
+        q.put_many([keyed('app.debug', i) for i in range(100)])
+        q.put_many([keyed('auth.ssh', i) for i in range(100)])
+        keys = [m['key'] for m in q.get_many(40)]
+        self.assertEqual(keys.count('auth.ssh'), 30)
+        # each class stays in order
+        self.assertEqual([m['message'] for m in q.get_many(200)
+                          if m['key'] == 'app.debug'],
+                         [str(i) for i in range(10, 100)])
+
+    def test_idle_class_is_not_credited(self):
+        q = WeightedFairQueue(1000, CLASSES)
+        q.put_many([keyed('app.debug', i) for i in range(100)])
+        q.get_many(50)
+        q.put_many([keyed('auth.ssh', i) for i in range(10)] +
+                   [keyed('other', 0)])
+        keys = [m['key'] for m in q.get_many(14)]
+        self.assertEqual(keys.count('auth.ssh'), 10)
+        self.assertIn('other', keys)
+
+    def test_shedding(self):
+        q = WeightedFairQueue(3, CLASSES)
+        q.put_many([keyed('app.debug', i) for i in range(3)])
+        # same priority as debug: shed instead of blocking
+        self.assertEqual(q.put_many([keyed('app', 0), keyed('app', 1)]), [])
+        # debug makes room for critical messages
+        self.assertEqual(q.put_many([keyed('auth.ssh', i)
+                                     for i in range(3)]), [])
+        self.assertEqual([c.shed for c in q.classes], [0, 3, 2])
+        # nothing left to shed for the highest priority
+        last = [keyed('auth.ssh', 4)]
+        self.assertEqual(q.put_many(last, block=False), last)
+        self.assertEqual([m['key'] for m in q.get_many(10)],
+                         ['auth.ssh'] * 3)
+
+    def test_control_items_come_last(self):
+        q = WeightedFairQueue(10)
+        stop = object()
+        q.put_many([keyed('a', 0), stop, keyed('a', 1)])
+        self.assertEqual(q.get_many(10)[-1], stop)
+        with self.assertRaises(queue.Empty):
+            q.get_many(1, timeout=0.01)
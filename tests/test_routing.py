@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from logdispatchr.models import Message
+from logdispatchr.outputs import BaseOutput
+from logdispatchr.routing import Router
+
+
+class TestRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = Router([
+            ('*', 'all'),
+            ('auth.log', 'exact'),
+            ('auth.*', 'prefix'),
+            ('*.debug', 'suffix'),
+            ('kern?.[ew]*', 'glob'),
+        ])
+
+    def test_route(self):
+        self.assertEqual(self.router.route('auth.log'),
+                         ('all', 'exact', 'prefix'))
+        self.assertEqual(self.router.route('auth.debug'),
+                         ('all', 'prefix', 'suffix'))
+        self.assertEqual(self.router.route('kern1.warn'), ('all', 'glob'))
+        self.assertEqual(self.router.route('kern1.info'), ('all',))
+
+    def test_route_message_without_key(self):
+        self.assertEqual(self.router.route_message(Message(message='x')), ())
+
+    def test_cache(self):
+        self.router.route('auth.log')
+        self.router.route('auth.log')
+        self.assertEqual(self.router.route.cache_info().hits, 1)
+
+
+class TestBaseOutputMatch(unittest.TestCase):
+
+    def test_match(self):
+        self.assertTrue(BaseOutput('auth')._match('auth'))
+        self.assertFalse(BaseOutput('auth.*')._match('auth'))
+        self.assertTrue(BaseOutput('a?th.[lm]*')._match('auth.log'))
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+
+from logdispatchr import metrics
+from logdispatchr.core import LogDispatcher
+from logdispatchr.models import Message
+from logdispatchr.stages import (BaseStage, Deduplicator, Drop, Enrich,
+                                 Extract, Pipeline, RateLimiter, Rename,
+                                 make_stage)
+
+from tests.test_logdispatchr import config_file
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def message(text, key='app', **fields):
+    return Message(key=key, message=text, **fields)
+
+
+class TestDeduplicator(unittest.TestCase):
+
+    def setUp(self):
+        self.stage = Deduplicator(window=10)
+        self.stage.clock = self.clock = Clock()
+
+    def test_collapses_copies(self):
+        batch = [message('boom', severity='err')] * 5 + [message('other')]
+        out = self.stage.process(batch)
+        self.assertEqual([m['message'] for m in out], ['boom', 'other'])
+        self.assertEqual(self.stage.tick(), [])
+        self.clock.now += 10
+        summary, = self.stage.tick()
+        self.assertEqual(dict(summary), {
+            'key': 'app', 'severity': 'err', 'repeated': 4,
+            'message': 'last message repeated 4 times'})
+        self.assertEqual(self.stage.entries, {})
+
+    def test_new_window(self):
+        self.stage.process([message('boom'), message('boom')])
+        self.clock.now += 11
+        out = self.stage.process([message('boom')])
+        self.assertEqual([m['message'] for m in out],
+                         ['last message repeated 1 times', 'boom'])
+
+    def test_bounded(self):
+        self.stage.max_entries = 2
+        out = self.stage.process([message('a'), message('a'), message('b'),
+                                  message('c')])
+        self.assertEqual([m['message'] for m in out],
+                         ['a', 'b', 'last message repeated 1 times', 'c'])
+        self.assertEqual(len(self.stage.entries), 2)
+
+    def test_unhashable_fields(self):
+        batch = [message(['a', {'b': 1}])] * 3 + [message(['a'])]
+        out = self.stage.process(batch)
+        self.assertEqual([m['message'] for m in out], [['a', {'b': 1}], ['a']])
+
+    def test_keys_differ(self):
+        out = self.stage.process([message('a', key='x'),
+                                  message('a', key='y')])
+        self.assertEqual(len(out), 2)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.stage = RateLimiter(rate=2, burst=3, max_keys=2,
+                                 overrides={'vip.*': 100})
+        self.stage.clock = self.clock = Clock()
+
+    def test_token_bucket(self):
+        self.assertEqual(len(self.stage.process([message('x')] * 10)), 3)
+        self.clock.now += 1
+        self.assertEqual(len(self.stage.process([message('x')] * 10)), 2)
+        self.assertEqual(self.stage.dropped, 15)
+        with self.assertLogs('logdispatchr.stages', 'WARNING') as logs:
+            self.stage.tick()
+        self.assertIn('rate limited 15 messages, mostly from app (15)',
+                      logs.output[0])
+        self.assertEqual(self.stage.dropped, 0)
+
+    def test_overrides_and_bound(self):
+        out = self.stage.process([message('x', key='vip.a')] * 10 +
+                                 [message('x', key='b')] * 10 +
+                                 [message('x', key='c')] * 10)
+        self.assertEqual(len(out), 10 + 3 + 3)
+        self.assertEqual(list(self.stage.buckets), ['b', 'c'])
+
+
+class Doubler(BaseStage):
+    tick_interval = 0.001
+
+    def process(self, batch):
+        return batch + batch
+
+    def flush(self):
+        return [message('flushed')]
+
+
+class Failing(BaseStage):
+    name = 'test_failing'
+
+    def process(self, batch):
+        raise KeyError('boom')
+
+    def flush(self):
+        raise KeyError('boom')
+
+
+class TestTransforms(unittest.TestCase):
+
+    def test_extract(self):
+        stage = Extract(r'(?P<status>\d{3}) (?P<bytes>\d+)?$')
+        batch = [message('GET / 200 512'), message('GET / 404 '),
+                 message('oops', status='kept')]
+        stage.process(batch)
+        self.assertEqual([m.get('status') for m in batch],
+                         ['200', '404', 'kept'])
+        self.assertEqual([m.get('bytes') for m in batch], ['512', None, None])
+        with self.assertRaises(ValueError):
+            Extract(r'\d+')
+
+    def test_rename(self):
+        m, = Rename({'hostname': 'host', 'missing': 'nothing'}).process(
+                [message('a', hostname='web1')])
+        self.assertEqual(dict(m), {'key': 'app', 'message': 'a',
+                                   'host': 'web1'})
+
+    def test_enrich(self):
+        stage = Enrich('hostname', {'web1': {'dc': 'par1', 'team': 'web'}})
+        batch = stage.process([message('a', hostname='web1'),
+                               message('b', hostname='web1', dc='own'),
+                               message('c', hostname='db1'), message('d')])
+        self.assertEqual([m.get('dc') for m in batch],
+                         ['par1', 'own', None, None])
+        with self.assertRaises(ValueError):
+            Enrich('hostname')
+
+    def test_enrich_networks(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write('network,city\n10.0.0.0/8,Paris\n10.1.0.0/16,Lyon\n'
+                    '2001:db8::/32,Nantes\n')
+        self.addCleanup(os.unlink, path)
+        stage = Enrich('ip', path=path, networks=True)
+        batch = stage.process([message(str(i), ip=ip) for i, ip in enumerate(
+                ('10.2.3.4', '10.1.2.3', '2001:db8::1', '192.168.0.1', 'x'))])
+        self.assertEqual([m.get('city') for m in batch],
+                         ['Paris', 'Lyon', 'Nantes', None, None])
+
+    def test_drop(self):
+        stage = Drop(regex='^GET /health', match={'severity': 'info'})
+        batch = [message('GET /health', severity='info'),
+                 message('GET /health', severity='err'),
+                 message('GET /', severity='info')]
+        self.assertEqual(stage.process(batch), batch[1:])
+        self.assertEqual(Drop(match={'severity': 'info'}).process(batch),
+                         batch[1:2])
+        with self.assertRaises(ValueError):
+            Drop()
+
+    def test_make_stage(self):
+        stage = make_stage({'type': 'rename', 'name': 'tidy',
+                            'fields': {'a': 'b'}})
+        self.assertIsInstance(stage, Rename)
+        self.assertEqual(stage.name, 'tidy')
+        stage = make_stage({'type': 'tests.test_stages:Doubler'})
+        self.assertIsInstance(stage, Doubler)
+        for config in ({'type': 'nothing'}, {'fields': {}},
+                       {'type': 'tests.test_stages:Nothing'}):
+            with self.assertRaises(ValueError):
+                make_stage(config)
+
+
+PIPELINE_CONFIG = """
+[dedup]
+window = 5
+
+[[pipeline]]
+type = "extract"
+regex = '(?P<status>\\d{3})$'
+
+[[pipeline]]
+type = "drop"
+name = "drop_ok"
+match = { fields = { status = "200" } }
+"""
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_config(self):
+        with config_file(PIPELINE_CONFIG) as path:
+            app = LogDispatcher(path)
+        self.assertEqual([stage.name for stage in app.pipeline.stages],
+                         ['dedup', 'extract', 'drop_ok'])
+        out = app.pipeline.process([message('GET / 200'),
+                                    message('GET / 500')])
+        self.assertEqual([m['status'] for m in out], ['500'])
+        with config_file(PIPELINE_CONFIG + 'oops = 1\n') as path:
+            with self.assertRaisesRegex(ValueError, 'stage #2'):
+                LogDispatcher(path)
+
+    def test_timing(self):
+        stage = Rename({'a': 'b'}, name='test_timing')
+        Pipeline([stage]).process([message('a')])
+        counts, total = metrics.STAGE_SECONDS.labels('test_timing').get()
+        self.assertEqual(counts[-1], 1)
+
+    def test_flush_runs_through_next_stages(self):
+        pipeline = Pipeline([Doubler(), Doubler()])
+        self.assertEqual(len(pipeline.process([message('a')])), 4)
+        self.assertEqual([m['message'] for m in pipeline.flush()],
+                         ['flushed', 'flushed', 'flushed'])
+        self.assertFalse(Pipeline([]))
+
+    def test_failing_stage(self):
+        pipeline = Pipeline([Failing(), Doubler()])
+        errors = metrics.STAGE_ERRORS.labels('test_failing')
+        before = errors.get()
+        with self.assertLogs('logdispatchr.stages', 'ERROR') as logs:
+            out = pipeline.process([message('a')])
+            out += pipeline.process([message('b')])
+        # passed through unchanged, the second error isn't logged
+        self.assertEqual([m['message'] for m in out], ['a', 'a', 'b', 'b'])
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(errors.get() - before, 2)
+        self.assertEqual([m['message'] for m in pipeline.flush()],
+                         ['flushed'])
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+
+from logdispatchr.supervisor import Supervisor
+
+
+class CountingEngine(object):
+    """
+    Appends a line to its config "path" and exits right away.
+    """
+    def __init__(self, config_path, worker=0):
+        self.config_path = config_path
+
+    def mainloop(self):
+        with open(self.config_path, 'a') as f:
+            f.write('%d\n' % os.getpid())
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def test_restarts_dead_workers(self):
+        with tempfile.NamedTemporaryFile() as f:
+            supervisor = Supervisor(f.name, 2, CountingEngine,
+                                    restart_delay=0)
+            supervisor.start()
+            while True:
+                supervisor.check(timeout=5)
+                with open(f.name) as log:
+                    if len(log.readlines()) >= 4:
+                        break
+            supervisor.stop()
+        self.assertFalse(any(p.is_alive() for p in supervisor.processes))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+
+from logdispatchr.models import Message
+from logdispatchr.syslog import parse_syslog
+
+
+class TestParseSyslog(unittest.TestCase):
+
+    def test_rfc5424(self):
+        fields = parse_syslog(
+                b'<34>1 2003-10-11T22:14:15.003Z mymachine.example.com su - '
+                b'ID47 [exampleSDID@32473 iut="3" eventSource="App lication"]'
+                b'[other a="]"] \xef\xbb\xbf\'su root\' failed\n')
+        self.assertEqual(fields['facility'], 'auth')
+        self.assertEqual(fields['severity'], 'crit')
+        self.assertEqual(fields['hostname'], 'mymachine.example.com')
+        self.assertEqual(fields['app_name'], 'su')
+        self.assertIsNone(fields['procid'])
+        self.assertEqual(fields['msgid'], 'ID47')
+        self.assertEqual(fields['structured_data'],
+                         '[exampleSDID@32473 iut="3" eventSource="App '
+                         'lication"][other a="]"]')
+        self.assertEqual(fields['message'], "'su root' failed")
+        self.assertNotIn('time', fields)
+        self.assertEqual(fields['time'], datetime.datetime(
+                2003, 10, 11, 22, 14, 15, 3000,
+                tzinfo=datetime.timezone.utc))
+
+    def test_rfc5424_without_structured_data(self):
+        fields = parse_syslog(b'<165>1 - host app 42 - - hello world')
+        self.assertEqual(fields['facility'], 'local4')
+        self.assertEqual(fields['severity'], 'notice')
+        self.assertEqual(fields['procid'], '42')
+        self.assertIsNone(fields['structured_data'])
+        self.assertIsNone(fields['time'])
+        self.assertEqual(fields['message'], 'hello world')
+
+    def test_rfc3164(self):
+        fields = parse_syslog(
+                b'<13>Oct 11 22:14:15 mymachine sshd[1234]: it works: yes')
+        self.assertEqual(fields['facility'], 'user')
+        self.assertEqual(fields['severity'], 'notice')
+        self.assertEqual(fields['timestamp'], 'Oct 11 22:14:15')
+        self.assertEqual(fields['hostname'], 'mymachine')
+        self.assertEqual(fields['app_name'], 'sshd')
+        self.assertEqual(fields['procid'], '1234')
+        self.assertEqual(fields['message'], 'it works: yes')
+        self.assertEqual(fields['time'].month, 10)
+
+    def test_garbage(self):
+        self.assertEqual(parse_syslog(b'<999>whatever'),
+                         {'message': '<999>whatever'})
+        self.assertEqual(parse_syslog(b'no pri'), {'message': 'no pri'})
+        for pri in (b'-1', b'192', b'+1', b' 1', b'1_0'):
+            data = b'<' + pri + b'>x'
+            self.assertEqual(parse_syslog(data), {'message': data.decode()})
+        self.assertEqual(parse_syslog(b'<191>x')['severity'], 'debug')
+
+    def test_lazy_message(self):
+        m = Message.from_raw(b'<11>1 - h a - - - boom', 'k', parse_syslog)
+        self.assertIsNone(m._fields)
+        self.assertEqual(m['severity'], 'err')
+        self.assertEqual(m.get('time'), None)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import urllib.request
+
+from logdispatchr import metrics
+from logdispatchr.models import Message
+from logdispatchr.tracing import TRACER, Tracer
+from logdispatchr.workers import OutputWorker
+
+from tests.test_workers import ListOutput
+
+
+def messages(key, count):
+    return [Message(key=key, message=str(i)) for i in range(count)]
+
+
+class TestTracer(unittest.TestCase):
+
+    def tearDown(self):
+        TRACER.disable()
+
+    def test_disabled(self):
+        tracer = Tracer()
+        self.assertFalse(tracer.enabled)
+        tracer.configure(10)
+        self.assertTrue(tracer.enabled)
+        tracer.disable()
+        self.assertFalse(tracer.enabled)
+
+    def test_sampling(self):
+        tracer = Tracer()
+        tracer.configure(every=10, keys=['auth.*'])
+        batch = messages('app.web', 100) + messages('auth.ssh', 5)
+        tracer.start(batch, 'received@test')
+        traced = [m for m in batch if m.trace is not None]
+        self.assertEqual(len(traced), 15)
+        self.assertEqual(traced[0].trace[0][0], 'received@test')
+
+    def test_worker_logs_traces(self):
+        TRACER.configure(keys=['traced'])
+        output = ListOutput()
+        output.name = 'traced_out'
+        worker = OutputWorker(output)
+        batch = messages('traced', 1) + messages('other', 1)
+        TRACER.start(batch, 'received@in')
+        TRACER.mark(batch, 'dispatched')
+        with self.assertLogs('logdispatchr.trace', 'INFO') as logs:
+            worker._write(batch)
+        self.assertEqual(len(logs.output), 1)
+        line = logs.output[0]
+        self.assertIn('trace traced: received@in +0.000ms, dispatched', line)
+        self.assertIn('dequeued@traced_out', line)
+        self.assertIn('written@traced_out', line)
+
+    def test_trace_endpoint(self):
+        server = metrics.MetricsServer('127.0.0.1:0', metrics.Registry())
+        server.start()
+        url = 'http://127.0.0.1:%d/trace' % server.server_address[1]
+        try:
+            with urllib.request.urlopen(url + '?every=5&key=a.*&key=b',
+                                        data=b'', timeout=5) as response:
+                self.assertEqual(response.read(), b'tracing enabled\n')
+            self.assertEqual((TRACER.every, TRACER.keys), (5, ('a.*', 'b')))
+            urllib.request.urlopen(url, data=b'', timeout=5).close()
+            self.assertFalse(TRACER.enabled)
+        finally:
+            server.close()
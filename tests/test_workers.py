@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import tempfile
+import unittest
+
+from logdispatchr.models import Message
+from logdispatchr.outputs import BaseOutput
+from logdispatchr.workers import OutputWorker
+
+
+class ListOutput(BaseOutput):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.written = []
+        self.batches = []
+        self.closed = False
+
+    def _write_messages(self, batch):
+        self.batches.append(len(batch))
+        super()._write_messages(batch)
+
+    def _write_message(self, message):
+        self.written.append(message)
+
+    def close(self):
+        self.closed = True
+
+
+def message(i):
+    return Message(key='test', message=str(i))
+
+
+class TestOutputWorker(unittest.TestCase):
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            OutputWorker(ListOutput(), overflow='explode')
+
+    def test_drop_newest(self):
+        worker = OutputWorker(ListOutput(), queue_size=2,
+                              overflow='drop-newest')
+        for i in range(4):
+            worker.put(message(i))
+        self.assertEqual(worker.dropped, 2)
+        self.assertEqual(worker.queue.get_nowait()['message'], '0')
+
+    def test_drop_oldest(self):
+        worker = OutputWorker(ListOutput(), queue_size=2,
+                              overflow='drop-oldest')
+        for i in range(4):
+            worker.put(message(i))
+        self.assertEqual(worker.dropped, 2)
+        self.assertEqual(worker.queue.get_nowait()['message'], '2')
+
+    def test_spill_keeps_order(self):
+        output = ListOutput()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            worker = OutputWorker(output, queue_size=2, overflow='spill',
+                                  spill_path=os.path.join(tmpdir, 'spill'))
+            for i in range(10):
+                worker.put(message(i))
+            self.assertTrue(worker.spilling)
+            self.assertEqual(len(worker.spill), 8)
+            worker.start()
+            self.assertTrue(worker.stop(timeout=5))
+            # closed and removed once drained
+            self.assertFalse(os.path.exists(worker.spill.path))
+        self.assertEqual([m['message'] for m in output.written],
+                         [str(i) for i in range(10)])
+
+    def test_spill_generations(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'spill')
+            old = OutputWorker(ListOutput(), queue_size=1, overflow='spill',
+                               spill_path=path)
+            new = OutputWorker(ListOutput(), queue_size=1, overflow='spill',
+                               spill_path=path)
+            self.assertEqual(new.spill.path, path + '.1')
+            # both generations spill at the same time
+            for worker, name in ((old, 'old'), (new, 'new')):
+                for i in range(5):
+                    worker.put(Message(key='test', message='%s%d' % (name, i)))
+                self.assertEqual(len(worker.spill), 4)
+            for worker, name in ((old, 'old'), (new, 'new')):
+                worker.start()
+                self.assertTrue(worker.stop(timeout=5))
+                self.assertEqual([m['message'] for m in worker.output.written],
+                                 ['%s%d' % (name, i) for i in range(5)])
+            self.assertEqual(os.listdir(tmpdir), [])
+
+    def test_stop_timeout(self):
+        output = ListOutput()
+        worker = OutputWorker(output, queue_size=1)
+        worker.put(message(0))
+        # never started, so the queue stays full
+        start = time.monotonic()
+        with self.assertLogs('logdispatchr.workers', 'ERROR'):
+            self.assertFalse(worker.stop(timeout=0.1))
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_batches(self):
+        output = ListOutput(max_batch_size=4)
+        worker = OutputWorker(output, queue_size=100)
+        for i in range(10):
+            worker.put(message(i))
+        worker.start()
+        worker.stop(timeout=5)
+        self.assertEqual(output.batches, [4, 4, 2])
+        self.assertTrue(output.closed)
+
+    def test_batch_latency(self):
+        output = ListOutput(max_batch_size=100, max_batch_latency_ms=200)
+        worker = OutputWorker(output)
+        worker.start()
+        worker.put(message(0))
+        time.sleep(0.05)
+        worker.put(message(1))
+        time.sleep(0.5)
+        self.assertEqual(output.batches, [2])
+        worker.stop(timeout=5)